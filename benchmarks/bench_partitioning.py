@@ -0,0 +1,170 @@
+"""
+Benchmark spreading a bulk scan over several local validation daemons, with
+leaves routed by issuer affinity (`validator.IssuerPartitioner`) or
+round-robin. Every leaf is sent with its intermediate, as a TLS scan would
+see it; with round-robin every daemon ends up parsing and verifying every
+intermediate, so less of each daemon's cache budget goes to hits.
+
+    python benchmarks/bench_partitioning.py --workers 4 --intermediates 200
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import timeit
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from validator_daemon import LocalCluster  # noqa: E402
+
+
+SERVER_AUTH = ExtendedKeyUsageOID.SERVER_AUTH.dotted_string
+
+
+class RoundRobinPartitioner(object):
+    def __init__(self, workers):
+        self._workers = itertools.cycle(workers)
+
+    def worker_for(self, cert):
+        return next(self._workers)
+
+
+def _issue(subject, key, issuer, issuer_key, serial_number, ca, names=()):
+    now = datetime.datetime.utcnow()
+    builder = x509.CertificateBuilder().serial_number(
+        serial_number
+    ).public_key(
+        key.public_key()
+    ).not_valid_before(
+        now - datetime.timedelta(days=1)
+    ).not_valid_after(
+        now + datetime.timedelta(days=30)
+    ).subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)])
+    ).issuer_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)])
+    ).add_extension(
+        x509.AuthorityKeyIdentifier.from_issuer_public_key(
+            issuer_key.public_key()
+        ),
+        critical=False,
+    )
+    if ca:
+        builder = builder.add_extension(
+            x509.BasicConstraints(ca=True, path_length=None), critical=True
+        ).add_extension(
+            x509.KeyUsage(
+                digital_signature=False, content_commitment=False,
+                key_encipherment=False, data_encipherment=False,
+                key_agreement=False, key_cert_sign=True, crl_sign=True,
+                encipher_only=False, decipher_only=False,
+            ),
+            critical=False,
+        )
+    else:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(n) for n in names]),
+            critical=False,
+        )
+    cert = builder.sign(issuer_key, hashes.SHA256(), default_backend())
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+def build_population(num_intermediates, leaves_per_intermediate):
+    def new_key():
+        return ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    root_key = new_key()
+    root = _issue("Root", root_key, "Root", root_key, 1, ca=True)
+    leaf_key = new_key()
+    serial_numbers = itertools.count(2)
+    requests = []
+    for i in range(num_intermediates):
+        name = "Intermediate {}".format(i)
+        key = new_key()
+        intermediate = _issue(
+            name, key, "Root", root_key, next(serial_numbers), ca=True
+        )
+        for j in range(leaves_per_intermediate):
+            host = "host{}.ca{}.example".format(j, i)
+            leaf = _issue(
+                host, leaf_key, name, key, next(serial_numbers), ca=False,
+                names=[host],
+            )
+            requests.append({
+                "certs": [leaf],
+                "name": host,
+                "extended_key_usage": SERVER_AUTH,
+                "extra_certs": [intermediate],
+            })
+    return root, requests
+
+
+def run(root, requests, workers, batch_size, cache_bytes, round_robin):
+    with LocalCluster(
+        [root], processes=workers,
+        validator_kwargs={"cache_bytes": cache_bytes},
+    ) as cluster:
+        partitioner = None
+        if round_robin:
+            partitioner = RoundRobinPartitioner(cluster.paths)
+        with cluster.client(partitioner) as client:
+            validated = 0
+            start = timeit.default_timer()
+            for i in range(0, len(requests), batch_size):
+                results = client.validate_many(requests[i:i + batch_size])
+                validated += sum(r[0] is not None for r in results)
+            elapsed = timeit.default_timer() - start
+            stats = client.cache_stats()
+    return validated, elapsed, stats
+
+
+def _hit_rate(stats, name):
+    hits = sum(s[name]["hits"] for s in stats.values())
+    misses = sum(s[name]["misses"] for s in stats.values())
+    return hits / (hits + misses) if hits + misses else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--intermediates", type=int, default=200)
+    parser.add_argument("--leaves-per-intermediate", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--cache-bytes", type=int, default=256 * 1024,
+        help="cache budget of each daemon",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    root, requests = build_population(
+        args.intermediates, args.leaves_per_intermediate
+    )
+    random.Random(args.seed).shuffle(requests)
+
+    for (label, round_robin) in [("round-robin", True), ("issuer", False)]:
+        validated, elapsed, stats = run(
+            root, requests, args.workers, args.batch_size, args.cache_bytes,
+            round_robin,
+        )
+        print("{:12} {:8.0f} certs/s  edges {:5.1%} hits  info {:5.1%} hits"
+              "  ({} of {} valid)".format(
+                  label, len(requests) / elapsed,
+                  _hit_rate(stats, "edges"), _hit_rate(stats, "info"),
+                  validated, len(requests),
+              ))
+
+
+if __name__ == "__main__":
+    main()
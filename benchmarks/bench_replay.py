@@ -0,0 +1,175 @@
+"""
+Replay a capture written by `CaptureRecorder` offline: every validation is
+re-run with its original timestamp against the AIA and OCSP responses seen
+at the time, and the latency distribution, cache hit rates and any results
+that differ from the captured ones are reported. Run it against two
+versions of the library to compare them on real traffic.
+
+    python benchmarks/bench_replay.py capture.gz --repeat 3 \
+        --crl ca.crl --revocation-filter revoked.filter
+
+The captured `ocsp_fetch` and path cost are applied. CRLs and revocation
+filters aren't stored in captures, so they have to be given again; any
+validations replayed with different ones are reported.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from validator import (  # noqa: E402
+    FilterCascade, PathCost, ValidationError, X509Validator, load_capture
+)
+
+
+class ReplayFetcher(object):
+    """
+    Serves each validation from the `StaticFetcher` captured with it.
+    """
+
+    def __init__(self):
+        self.current = None
+
+    def get(self, url):
+        return self.current.get(url)
+
+    def post(self, url, data, content_type):
+        return self.current.post(url, data, content_type)
+
+
+def replay(path, path_cost=None, crls=(), revocation_filter=None):
+    """
+    Replays the capture at `path` with the captured configuration, except
+    for `path_cost` if it's given. Also returns how many validations were
+    replayed with each setting differing from the captured one.
+    """
+    fetcher = ReplayFetcher()
+    ignored = ["path_cost"] if path_cost is not None else []
+    validator = None
+    config = None
+    # The settings the validator differs from `config` on, or None once
+    # either may have changed.
+    differences = None
+    mismatched = {}
+    latencies = []
+    captured_latencies = []
+    diffs = []
+    for kind, event in load_capture(path):
+        if validator is None:
+            # Captures from before configurations were recorded start with
+            # the roots, and get the defaults.
+            captured = event if kind == "config" else None
+            if path_cost is None and captured is not None:
+                path_cost = captured.path_cost
+            validator = X509Validator(
+                [], fetcher=fetcher, path_cost=path_cost,
+                ocsp_fetch=captured is not None and captured.ocsp_fetch,
+                revocation_filter=revocation_filter,
+            )
+        if kind == "validation":
+            if differences is None:
+                differences = [] if config is None else [
+                    name for name in config.differences(validator)
+                    if name not in ignored
+                ]
+            for name in differences:
+                mismatched[name] = mismatched.get(name, 0) + 1
+            fetcher.current = event.fetcher
+            start = timeit.default_timer()
+            try:
+                result = list(validator.validate(event.leaf, event.ctx))
+            except ValidationError:
+                result = None
+            latencies.append(timeit.default_timer() - start)
+            captured_latencies.append(event.elapsed)
+            if result != event.result:
+                diffs.append((event, result))
+            continue
+
+        if kind == "config":
+            config = event
+        else:
+            if kind == "roots":
+                validator.update_roots(event)
+            else:
+                validator.register_intermediates(event)
+            # CRLs are verified against the roots and intermediates, so
+            # they're retried as those arrive.
+            if crls:
+                validator.load_crls(crls)
+        differences = None
+    return (
+        latencies, captured_latencies, diffs, mismatched,
+        validator.cache_stats(),
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def describe(latencies):
+    if not latencies:
+        return "-"
+    return "p50 {:.1f} us, p90 {:.1f} us, p99 {:.1f} us, max {:.1f} us".format(
+        *[percentile(latencies, p) * 1e6 for p in (50, 90, 99, 100)]
+    )
+
+
+def outcome(chain):
+    if chain is None:
+        return "invalid"
+    return "a {}-certificate chain".format(len(chain))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--path-cost", action="store_true",
+        help="build chains best-first with the default costs, whatever the "
+             "capture used",
+    )
+    parser.add_argument("--crl", action="append", default=[],
+                        help="CRL file (PEM or DER) to load")
+    parser.add_argument("--revocation-filter",
+                        help="revocation filter cascade to use")
+    args = parser.parse_args(argv)
+
+    revocation_filter = None
+    if args.revocation_filter:
+        revocation_filter = FilterCascade.load(args.revocation_filter)
+    for i in range(args.repeat):
+        latencies, captured, diffs, mismatched, stats = replay(
+            args.capture, PathCost() if args.path_cost else None,
+            args.crl, revocation_filter,
+        )
+        print("run {}: {} validations".format(i + 1, len(latencies)))
+        print("  replayed:  {}".format(describe(latencies)))
+        print("  captured:  {}".format(describe(captured)))
+        for name, count in sorted(mismatched.items()):
+            print("  {} validations replayed with a different {}".format(
+                count, name
+            ))
+        for name, cache in sorted(stats.items()):
+            hit_rate = cache["hit_rate"]
+            print("  cache {:<17} {:>7} entries, hit rate {}".format(
+                name, cache["entries"],
+                "-" if hit_rate is None else "{:.1%}".format(hit_rate),
+            ))
+        print("  result diffs: {}".format(len(diffs)))
+        for event, result in diffs[:10]:
+            print("    {} at {}: captured {}, replayed {}".format(
+                event.ctx.name.value, event.ctx.timestamp,
+                outcome(event.result), outcome(result),
+            ))
+
+
+if __name__ == "__main__":
+    main()
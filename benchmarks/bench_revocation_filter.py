@@ -0,0 +1,90 @@
+"""
+Benchmark `FilterCascade` over a synthetic certificate population: build
+time, size on disk, lookup latency, and a check that it's exact for every
+enrolled certificate.
+
+    python benchmarks/bench_revocation_filter.py --valid 1000000 \
+        --revoked 20000
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from validator import FilterCascade, _revocation_filter_key  # noqa: E402
+
+
+def synthetic_population(num_issuers, num_valid, num_revoked, seed):
+    rng = random.Random(seed)
+    issuers = [
+        bytes(bytearray(rng.getrandbits(8) for _ in range(32)))
+        for _ in range(num_issuers)
+    ]
+    keys = set()
+    while len(keys) < num_valid + num_revoked:
+        keys.add(_revocation_filter_key(
+            rng.choice(issuers), rng.getrandbits(128)
+        ))
+    keys = list(keys)
+    rng.shuffle(keys)
+    return keys[:num_revoked], keys[num_revoked:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--issuers", type=int, default=200)
+    parser.add_argument("--valid", type=int, default=200000)
+    parser.add_argument("--revoked", type=int, default=5000)
+    parser.add_argument("--false-positive-rate", type=float, default=0.01)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    revoked, valid = synthetic_population(
+        args.issuers, args.valid, args.revoked, args.seed
+    )
+
+    start = timeit.default_timer()
+    cascade = FilterCascade.build(revoked, valid, args.false_positive_rate)
+    build_time = timeit.default_timer() - start
+
+    fd, path = tempfile.mkstemp(suffix=".filter")
+    os.close(fd)
+    try:
+        cascade.save(path)
+        size = os.path.getsize(path)
+        cascade = FilterCascade.load(path)
+
+        errors = (
+            sum(1 for key in revoked if key not in cascade) +
+            sum(1 for key in valid if key in cascade)
+        )
+
+        sample = random.Random(args.seed).sample(
+            revoked + valid, min(args.lookups, len(revoked) + len(valid))
+        )
+        start = timeit.default_timer()
+        for key in sample:
+            key in cascade
+        lookup_time = (timeit.default_timer() - start) / len(sample)
+    finally:
+        os.remove(path)
+
+    print("population:   {} valid, {} revoked, {} issuers".format(
+        len(valid), len(revoked), args.issuers
+    ))
+    print("levels:       {}".format(len(cascade._levels)))
+    print("size:         {:.1f} KiB".format(size / 1024))
+    print("build time:   {:.2f} s".format(build_time))
+    print("lookup time:  {:.2f} us".format(lookup_time * 1e6))
+    print("errors:       {}".format(errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark what short-lived processes pay before their first validation:
+importing `validator` in a fresh interpreter, and constructing an
+`X509Validator`. Also reports whether `requests` was imported, which should
+only happen on the first AIA or OCSP fetch.
+
+    python benchmarks/bench_startup.py --runs 20
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from validator import X509Validator  # noqa: E402
+
+
+_IMPORT_CODE = """
+import sys, timeit
+start = timeit.default_timer()
+import validator
+print(timeit.default_timer() - start)
+print("requests" in sys.modules)
+"""
+
+
+def time_import(runs):
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _IMPORT_CODE], cwd=ROOT
+        ).decode("ascii").split()
+        times.append(float(output[0]))
+        imported_requests = output[1] == "True"
+    return min(times), sorted(times)[len(times) // 2], imported_requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--constructions", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    best, median, imported_requests = time_import(args.runs)
+    construction = timeit.timeit(
+        lambda: X509Validator([]), number=args.constructions
+    ) / args.constructions
+
+    print("import:        {:.1f} ms best, {:.1f} ms median".format(
+        best * 1e3, median * 1e3
+    ))
+    print("construction:  {:.1f} us".format(construction * 1e6))
+    print("requests:      {}".format(
+        "imported" if imported_requests else "not imported"
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import dsa, ec, rsa
+from cryptography.x509 import ocsp
 
 import pytest
 
@@ -19,7 +20,9 @@ from validator import (
     ValidationError
 )
 
-from .utils import create_ca_issuer, create_extension
+from .utils import (
+    create_ca_issuer, create_extension, create_ocsp_responder
+)
 
 
 class KeyCache(object):
@@ -146,7 +149,7 @@ class CAWorkspace(object):
                         key_usage=None,
                         extended_key_usages=[ANY_EXTENDED_KEY_USAGE_OID],
                         ca_issuers=None,
-                        extra_extensions=[]):
+                        extra_extensions=[], serial_number=1):
 
         if key is None:
             key = self._key_cache.generate_rsa_key()
@@ -171,7 +174,7 @@ class CAWorkspace(object):
             signature_hash_algorithm = hashes.SHA256()
 
         builder = x509.CertificateBuilder().serial_number(
-            1
+            serial_number
         ).public_key(
             key.public_key()
         ).not_valid_before(
@@ -253,6 +256,61 @@ class CAWorkspace(object):
     def issue_new_self_signed(self, **kwargs):
         return self._issue_new_cert(**kwargs)
 
+    def issue_new_crl(self, ca, revoked=[], key=None, next_update=None):
+        if key is None:
+            key = ca.key
+        if next_update is None:
+            next_update = (
+                datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+            )
+        builder = x509.CertificateRevocationListBuilder().issuer_name(
+            ca.cert.subject
+        ).last_update(
+            datetime.datetime.utcnow()
+        ).next_update(
+            next_update
+        )
+        for cert in revoked:
+            builder = builder.add_revoked_certificate(
+                x509.RevokedCertificateBuilder().serial_number(
+                    cert.cert.serial_number
+                ).revocation_date(
+                    datetime.datetime.utcnow()
+                ).build(default_backend())
+            )
+        return builder.sign(key, hashes.SHA256(), default_backend())
+
+    def issue_new_ocsp_response(self, cert, issuer, responder=None,
+                                status=ocsp.OCSPCertStatus.GOOD,
+                                this_update=None, next_update=None):
+        if responder is None:
+            responder = issuer
+        if this_update is None:
+            this_update = datetime.datetime.utcnow()
+        if next_update is None:
+            next_update = this_update + datetime.timedelta(hours=1)
+        if status == ocsp.OCSPCertStatus.REVOKED:
+            revocation_time = this_update
+        else:
+            revocation_time = None
+        builder = ocsp.OCSPResponseBuilder().add_response(
+            cert=cert.cert,
+            issuer=issuer.cert,
+            algorithm=hashes.SHA1(),
+            cert_status=status,
+            this_update=this_update,
+            next_update=next_update,
+            revocation_time=revocation_time,
+            revocation_reason=None,
+        ).responder_id(
+            ocsp.OCSPResponderEncoding.HASH, responder.cert
+        )
+        if responder is not issuer:
+            builder = builder.certificates([responder.cert])
+        return builder.sign(responder.key, hashes.SHA256()).public_bytes(
+            serialization.Encoding.DER
+        )
+
 
 @pytest.fixture
 def ca_workspace(key_cache):
@@ -273,6 +331,10 @@ class WSGIApplication(object):
         except KeyError:
             start_response(str("404 Not Found"), [])
             return []
+        if callable(contents):
+            contents = contents(environ["wsgi.input"].read(
+                int(environ.get("CONTENT_LENGTH") or 0)
+            ))
         start_response(
             str("200 OK"),
             [(str("Content-Type"), str("application/pkix-cert"))],
@@ -299,6 +361,22 @@ class Server(object):
         self.wsgi_app.urls[url] = data
         return create_ca_issuer("{}{}".format(self.base_url, url))
 
+    def create_ocsp_url(self, respond):
+        """
+        `respond` is called with each OCSP request, and returns the DER
+        encoded response.
+        """
+        self.requests = []
+
+        def responder(body):
+            request = ocsp.load_der_ocsp_request(body)
+            self.requests.append(request)
+            return respond(request)
+
+        url = "/ocsp/{}".format(len(self.wsgi_app.urls))
+        self.wsgi_app.urls[url] = responder
+        return create_ocsp_responder("{}{}".format(self.base_url, url))
+
 
 @pytest.fixture
 def server():
@@ -2,6 +2,11 @@ from __future__ import absolute_import, division, unicode_literals
 
 from cryptography import x509
 
+import pytest
+
+import validator
+from validator import ValidationError, X509Validator
+
 from .utils import create_ca_issuer
 
 
@@ -96,3 +101,105 @@ def test_aia_to_untrusted(ca_workspace, server):
     ca_workspace.assert_validates(
         cert, [cert, intermediate1, root], extra_certs=[intermediate1]
     )
+
+
+def test_aia_validation_result(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    intermediate_url = server.create_aia_url(intermediate)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[intermediate_url]
+    )
+
+    result = X509Validator([root.cert]).validate(
+        cert.cert, ca_workspace._build_validation_context()
+    )
+    assert result == [cert.cert, intermediate.cert, root.cert]
+    assert result.used_aia
+    assert result.aia_fetches == 1
+
+
+def _create_counted_aia_url(server, contents):
+    fetches = []
+
+    def respond(body):
+        fetches.append(body)
+        return contents
+
+    url = "/counted/{}".format(len(server.wsgi_app.urls))
+    server.wsgi_app.urls[url] = respond
+    return (create_ca_issuer("{}{}".format(server.base_url, url)), fetches)
+
+
+def test_aia_negative_cache(ca_workspace, server):
+    # No roots at all, so there are no local candidates for any issuer.
+    root = ca_workspace._issue_new_ca()
+    aia_url, fetches = _create_counted_aia_url(server, b"not a cert")
+    cert1 = ca_workspace.issue_new_leaf(root, ca_issuers=[aia_url])
+    cert2 = ca_workspace.issue_new_leaf(root, ca_issuers=[aia_url])
+    ctx = ca_workspace._build_validation_context()
+
+    v = X509Validator([])
+    with pytest.raises(ValidationError):
+        v.validate(cert1.cert, ctx)
+    assert len(fetches) == 1
+    with pytest.raises(ValidationError):
+        v.validate(cert1.cert, ctx)
+    with pytest.raises(ValidationError):
+        v.validate(cert2.cert, ctx)
+    assert len(fetches) == 1
+
+    # Changing the trust store forgets what was learned about it.
+    v.update_roots([])
+    with pytest.raises(ValidationError):
+        v.validate(cert1.cert, ctx)
+    assert len(fetches) == 2
+
+
+def test_aia_negative_cache_expires(ca_workspace, server, monkeypatch):
+    root = ca_workspace._issue_new_ca()
+    aia_url, fetches = _create_counted_aia_url(server, b"not a cert")
+    cert = ca_workspace.issue_new_leaf(root, ca_issuers=[aia_url])
+    ctx = ca_workspace._build_validation_context()
+
+    now = [1000.0]
+    monkeypatch.setattr(validator, "_monotonic", lambda: now[0])
+    v = X509Validator([], negative_cache_ttl=10)
+    with pytest.raises(ValidationError):
+        v.validate(cert.cert, ctx)
+    now[0] += 9
+    with pytest.raises(ValidationError):
+        v.validate(cert.cert, ctx)
+    assert len(fetches) == 1
+    now[0] += 2
+    with pytest.raises(ValidationError):
+        v.validate(cert.cert, ctx)
+    assert len(fetches) == 2
+
+
+def test_aia_negative_cache_disabled(ca_workspace, server):
+    root = ca_workspace._issue_new_ca()
+    aia_url, fetches = _create_counted_aia_url(server, b"not a cert")
+    cert = ca_workspace.issue_new_leaf(root, ca_issuers=[aia_url])
+    ctx = ca_workspace._build_validation_context()
+
+    v = X509Validator([], negative_cache_ttl=0)
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            v.validate(cert.cert, ctx)
+    assert len(fetches) == 2
+
+
+def test_aia_unsupported_key(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(
+        root, key=ca_workspace._key_cache.generate_dsa_key()
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    # An AIA server returning an issuer with an unsupported key is rejected
+    # like one passed in `extra_certs`.
+    ca_workspace.assert_doesnt_validate(cert)
+    ca_workspace.assert_doesnt_validate(cert, extra_certs=[intermediate])
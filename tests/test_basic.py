@@ -4,12 +4,16 @@ import datetime
 import ipaddress
 
 from cryptography import x509
-from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 
 import pytest
 
-from .utils import create_extension, relative_datetime
+from validator import ValidationContext, ValidationError, X509Validator
+
+from .utils import (
+    UNKNOWN_SIGNATURE_OID, create_extension, relative_datetime, replace_oid
+)
 
 
 def test_empty_trust_store(ca_workspace):
@@ -166,6 +170,24 @@ def test_unsupported_signature_hash(ca_workspace, key_cache):
     ca_workspace.assert_doesnt_validate(sha1_leaf)
 
 
+def test_unknown_signature_algorithm(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+    der = replace_oid(
+        cert.cert.public_bytes(serialization.Encoding.DER),
+        x509.SignatureAlgorithmOID.RSA_WITH_SHA256.dotted_string,
+        UNKNOWN_SIGNATURE_OID,
+    )
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    with pytest.raises(ValidationError):
+        validator.validate(der, ctx)
+    assert validator.validate_batch([der, cert.cert], ctx) == [
+        None, [cert.cert, root.cert]
+    ]
+
+
 def test_maximum_chain_depth(ca_workspace):
     root = ca_workspace.issue_new_trusted_root()
     intermediates = []
@@ -512,3 +534,160 @@ def test_key_usage_ca(ca_workspace):
     cert = ca_workspace.issue_new_leaf(intermediate)
 
     ca_workspace.assert_doesnt_validate(cert, extra_certs=[intermediate])
+
+
+def test_validation_result(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(
+        not_valid_before=relative_datetime(-datetime.timedelta(days=3)),
+        not_valid_after=relative_datetime(datetime.timedelta(days=3)),
+    )
+    intermediate = ca_workspace.issue_new_ca(
+        root,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=2)),
+        not_valid_after=relative_datetime(datetime.timedelta(days=2)),
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=1)),
+        not_valid_after=relative_datetime(datetime.timedelta(days=3)),
+    )
+
+    result = X509Validator([root.cert]).validate(
+        cert.cert,
+        ca_workspace._build_validation_context(extra_certs=[intermediate]),
+    )
+    assert result == [cert.cert, intermediate.cert, root.cert]
+    assert result.anchor == root.cert
+    assert result.valid_from == cert.cert.not_valid_before
+    assert result.valid_until == intermediate.cert.not_valid_after
+    assert not result.used_aia
+    assert result.aia_fetches == 0
+    assert result.signature_checks >= 2
+
+
+def test_match_names(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, names=[
+        x509.DNSName("host{}.example.com".format(i)) for i in range(1000)
+    ] + [
+        x509.DNSName("*.Tenant.example.com"),
+        x509.IPAddress(ipaddress.IPv4Address("127.0.0.1")),
+    ])
+
+    validator = X509Validator([root.cert])
+    assert validator.match_names(cert.cert, [
+        x509.DNSName("host0.example.com"),
+        x509.DNSName("HOST999.example.com"),
+        x509.DNSName("host1000.example.com"),
+        x509.DNSName("www.tenant.example.com"),
+        x509.DNSName("tenant.example.com"),
+        x509.DNSName("a.www.tenant.example.com"),
+        x509.DNSName("localhost"),
+    ]) == [True, True, False, True, False, False, False]
+    with pytest.raises(ValidationError):
+        validator.match_names(
+            cert.cert, [x509.IPAddress(ipaddress.IPv4Address("127.0.0.1"))]
+        )
+
+
+def test_many_name_constraints(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(extra_extensions=[
+        create_extension(
+            x509.NameConstraints(
+                permitted_subtrees=[
+                    x509.DNSName("tenant{}.example.com".format(i))
+                    for i in range(500)
+                ] + [x509.DNSName(".Wildcard.example.com")],
+                excluded_subtrees=[
+                    x509.DNSName("blocked.tenant7.example.com"),
+                ],
+            ),
+            critical=False,
+        )
+    ])
+
+    for (trusted, name) in [
+        (True, "tenant0.example.com"),
+        (True, "www.TENANT499.example.com"),
+        (False, "tenant500.example.com"),
+        (False, "xtenant1.example.com"),
+        (True, "a.wildcard.example.com"),
+        (False, "wildcard.example.com"),
+        (False, "blocked.tenant7.example.com"),
+        (False, "sub.blocked.tenant7.example.com"),
+    ]:
+        cert = ca_workspace.issue_new_leaf(root, names=[x509.DNSName(name)])
+        if trusted:
+            ca_workspace.assert_validates(
+                cert, [cert, root], name=x509.DNSName(name)
+            )
+        else:
+            ca_workspace.assert_doesnt_validate(
+                cert, name=x509.DNSName(name)
+            )
+
+
+def test_concurrent_signature_checks(ca_workspace):
+    # Only in the standard library from Python 3.2.
+    futures = pytest.importorskip("concurrent.futures")
+    roots = [ca_workspace.issue_new_trusted_root() for _ in range(3)]
+    intermediate = ca_workspace.issue_new_ca(roots[0])
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+    expected = [cert.cert, intermediate.cert, roots[0].cert]
+
+    def count_lookups(validator):
+        lookups = []
+        find_local_issuers = validator._find_local_issuers
+
+        def counted(*args):
+            lookups.append(args[0])
+            return find_local_issuers(*args)
+
+        validator._find_local_issuers = counted
+        return lookups
+
+    validator = X509Validator([r.cert for r in roots])
+    lookups = count_lookups(validator)
+    result = validator.validate(cert.cert, ctx)
+    assert result == expected
+    assert result.signature_checks == 3
+
+    with futures.ThreadPoolExecutor(4) as executor:
+        validator = X509Validator(
+            [r.cert for r in roots], signature_executor=executor
+        )
+        concurrent_lookups = count_lookups(validator)
+        result = validator.validate(cert.cert, ctx)
+    assert result == expected
+    # All four candidates were checked at once, at both levels.
+    assert result.signature_checks == 8
+    # With the candidates found once per certificate either way.
+    assert len(concurrent_lookups) == len(lookups)
+
+
+def test_der_input(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    cert_der = cert.cert.public_bytes(serialization.Encoding.DER)
+    intermediate_der = intermediate.cert.public_bytes(
+        serialization.Encoding.DER
+    )
+
+    def build_context():
+        return ValidationContext(
+            name=x509.DNSName("example.com"),
+            extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH,
+            extra_certs=[intermediate_der, b"not a cert"],
+        )
+
+    validator = X509Validator([root.cert])
+    chain1 = validator.validate(cert_der, build_context())
+    assert chain1 == [cert.cert, intermediate.cert, root.cert]
+    # Identical bytes are parsed into the same objects
+    chain2 = validator.validate(bytearray(cert_der), build_context())
+    assert all(c1 is c2 for c1, c2 in zip(chain1, chain2))
+
+    with pytest.raises(ValidationError):
+        validator.validate(b"not a cert", build_context())
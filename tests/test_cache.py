@@ -0,0 +1,153 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from validator import (
+    X509Validator, _CacheManager, _FrequencySketch, _INTERN_CACHE_BYTES,
+    set_certificate_cache_bytes,
+)
+
+
+def test_budget():
+    manager = _CacheManager(10000)
+    a = manager.cache("a", 100)
+    b = manager.cache("b", 300)
+    for i in range(1000):
+        a.set(i, i)
+        b.set(i, i)
+    stats = manager.stats()
+    assert 0 < stats["a"]["bytes"] + stats["b"]["bytes"] <= 10000
+    assert stats["a"]["bytes"] == 100 * len(a)
+    assert stats["b"]["bytes"] == 300 * len(b)
+
+
+def test_scan_resistance():
+    manager = _CacheManager(10000)
+    cache = manager.cache("a", 100)
+    hot = ["hot-{}".format(i) for i in range(50)]
+    for key in hot:
+        cache.set(key, key)
+    for _ in range(5):
+        for key in hot:
+            assert cache.get(key) == key
+
+    for i in range(5000):
+        cache.set(i, i)
+
+    assert all(cache.get(key) == key for key in hot)
+    assert len(cache) <= 100
+
+
+def test_discard_if():
+    manager = _CacheManager(10000)
+    a = manager.cache("a", 100)
+    b = manager.cache("b", 100)
+    for i in range(10):
+        a.set(i, i)
+        b.set(i, i)
+    a.discard_if(lambda key: key % 2 == 0)
+    assert [a.get(i) for i in range(4)] == [None, 1, None, 3]
+    assert [b.get(i) for i in range(4)] == [0, 1, 2, 3]
+    assert len(a) == 5
+    assert manager.stats()["a"]["bytes"] == 500
+
+
+def test_cache_stats(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    validator = X509Validator([root.cert])
+    validator.validate(cert.cert, ctx)
+    edges = validator.cache_stats()["edges"]
+    assert edges["entries"] > 0
+    assert edges["hits"] == 0
+
+    validator.validate(cert.cert, ctx)
+    stats = validator.cache_stats()
+    assert stats["edges"]["hits"] > 0
+    assert 0 < stats["info"]["hit_rate"] <= 1
+    assert set(stats) == {
+        "edges", "info", "ocsp", "negative_issuers", "certificates"
+    }
+
+
+def test_certificate_cache(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+    der = cert.cert.public_bytes(serialization.Encoding.DER)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    try:
+        set_certificate_cache_bytes(len(der) * 4)
+        validator.validate(der, ctx)
+        validator.validate(der, ctx)
+        stats = validator.cache_stats()["certificates"]
+        assert stats["entries"] == 1
+        assert stats["hits"] == 1
+        assert len(der) < stats["bytes"] <= len(der) * 4
+
+        set_certificate_cache_bytes(len(der))
+        validator.validate(der, ctx)
+        assert validator.cache_stats()["certificates"]["entries"] == 0
+    finally:
+        set_certificate_cache_bytes(_INTERN_CACHE_BYTES)
+
+
+def test_info_size_follows_contents(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    small = ca_workspace.issue_new_leaf(
+        root, names=[x509.DNSName("example.com")]
+    )
+    large = ca_workspace.issue_new_leaf(root, serial_number=2, names=[
+        x509.DNSName("host{}.example.com".format(i)) for i in range(1000)
+    ] + [x509.DNSName("example.com")])
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    validator.validate(small.cert, ctx)
+    small_bytes = validator.cache_stats()["info"]["bytes"]
+    validator.validate(large.cert, ctx)
+    large_bytes = validator.cache_stats()["info"]["bytes"] - small_bytes
+    assert large_bytes > 1000 * len("host0.example.com")
+
+
+def test_hits_are_counted_for_admission():
+    manager = _CacheManager(10000)
+    cache = manager.cache("a", 100)
+    cache.set("hot", 1)
+    for _ in range(3 * manager._READ_BUFFER_SIZE):
+        assert cache.get("hot") == 1
+    with manager._lock:
+        manager._replay_reads()
+    assert manager._sketch.estimate(("a", "hot")) > 3
+
+
+def test_oversized_entry():
+    manager = _CacheManager(10000)
+    cache = manager.cache("a", 100)
+    for i in range(100):
+        cache.set(i, i)
+    entries = len(cache)
+    for _ in range(20):
+        cache.set("huge", "huge", size=20000)
+    assert cache.get("huge") is None
+    assert len(cache) == entries
+
+
+def test_frequency_sketch():
+    manager = _CacheManager(10000)
+    # Only allocated once something is cached.
+    assert manager._sketch is None
+    manager.cache("a", 100).set("key", 1)
+    assert manager._sketch is not None
+
+    sketch = _FrequencySketch(12)
+    for _ in range(11):
+        sketch.increment("key")
+    assert sketch.estimate("key") == 11
+    sketch.increment("other", sketch._sample_size)
+    assert sketch.estimate("key") == 5
@@ -0,0 +1,135 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import ipaddress
+
+from cryptography import x509
+
+import pytest
+
+from validator import (
+    CaptureRecorder, FilterCascade, PathCost, ValidationError, X509Validator,
+    load_capture,
+)
+
+from .test_revocation import CRL_SIGN_KEY_USAGE, write_crl
+
+
+def test_capture_and_replay(ca_workspace, server, tmpdir):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+    untrusted = ca_workspace.issue_new_leaf(ca_workspace._issue_new_ca())
+    ctx = ca_workspace._build_validation_context()
+
+    path = str(tmpdir.join("capture.gz"))
+    recorder = CaptureRecorder(path, sample_rate=1)
+    validator = X509Validator([root.cert], recorder=recorder)
+    validator.validate(cert.cert, ctx)
+    with pytest.raises(ValidationError):
+        validator.validate(untrusted.cert, ctx)
+    recorder.close()
+
+    events = list(load_capture(path))
+    assert [kind for kind, _ in events] == [
+        "config", "roots", "validation", "validation"
+    ]
+    assert events[1][1] == [root.cert]
+    (_, captured), (_, failed) = events[2:]
+    assert captured.leaf == cert.cert
+    assert captured.ctx.timestamp == ctx.timestamp
+    assert captured.result == [cert.cert, intermediate.cert, root.cert]
+    assert failed.result is None
+
+    # Offline, the captured AIA response is served instead
+    validator = X509Validator([root.cert], fetcher=captured.fetcher)
+    assert validator.validate(captured.leaf, captured.ctx) == captured.result
+    assert len(captured.fetcher.requests) == 1
+
+
+def test_capture_sampling(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(root)
+    ctx = ca_workspace._build_validation_context()
+
+    path = str(tmpdir.join("capture.gz"))
+    recorder = CaptureRecorder(path, sample_rate=0)
+    validator = X509Validator([root.cert], recorder=recorder)
+    validator.register_intermediates([intermediate.cert])
+    validator.validate(cert.cert, ctx)
+    recorder.close()
+
+    assert [
+        (kind, certs) for kind, certs in load_capture(path)
+        if kind != "config"
+    ] == [("roots", [root.cert]), ("intermediates", [intermediate.cert])]
+
+
+def test_capture_non_dns_names(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+    names = [
+        x509.IPAddress(ipaddress.ip_address("192.0.2.1")),
+        x509.IPAddress(ipaddress.ip_network("2001:db8::/32")),
+        x509.RFC822Name("user@example.com"),
+    ]
+
+    path = str(tmpdir.join("capture.gz"))
+    recorder = CaptureRecorder(path, sample_rate=1)
+    validator = X509Validator([root.cert], recorder=recorder)
+    for name in names + [x509.RegisteredID(x509.ObjectIdentifier("1.2.3"))]:
+        with pytest.raises(ValidationError):
+            validator.validate(
+                cert.cert, ca_workspace._build_validation_context(name=name)
+            )
+    recorder.close()
+
+    # Names which can't be stored are validated without being recorded.
+    captured = [v for kind, v in load_capture(path) if kind == "validation"]
+    assert [v.ctx.name for v in captured] == names
+
+
+def test_capture_config(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    crl_path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [])
+    )
+    with open(crl_path, "rb") as f:
+        crl_digest = hashlib.sha256(f.read()).hexdigest()
+    cascade = FilterCascade.build([b"revoked"], [b"valid"])
+    path_cost = PathCost(aia_fetch=3, anchors={root.cert: 2})
+
+    path = str(tmpdir.join("capture.gz"))
+    recorder = CaptureRecorder(path, sample_rate=1)
+    validator = X509Validator(
+        [root.cert], ocsp_fetch=True, path_cost=path_cost, recorder=recorder
+    )
+    validator.load_crls([crl_path])
+    validator.load_crls([crl_path])
+    validator.set_revocation_filter(cascade)
+    recorder.close()
+
+    configs = [c for kind, c in load_capture(path) if kind == "config"]
+    assert [c.crl_digests for c in configs] == [
+        [], [crl_digest], [crl_digest]
+    ]
+    assert [c.revocation_filter_digest for c in configs] == [
+        None, None, hashlib.sha256(cascade.to_bytes()).hexdigest()
+    ]
+    config = configs[-1]
+    assert config.ocsp_fetch
+    assert config.path_cost_class == "PathCost"
+    assert config.path_cost.aia_fetch == 3
+    assert config.path_cost.anchors == {root.cert: 2}
+    assert config.differences(validator) == []
+
+    replayed = X509Validator(
+        [root.cert], ocsp_fetch=True, path_cost=config.path_cost
+    )
+    assert config.differences(replayed) == ["crls", "revocation_filter"]
+    replayed.load_crls([crl_path])
+    replayed.set_revocation_filter(cascade)
+    assert config.differences(replayed) == []
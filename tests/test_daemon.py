@@ -0,0 +1,239 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from cryptography.hazmat.primitives import serialization
+
+import pytest
+
+from validator import X509Validator
+from validator_daemon import (
+    DaemonError, LocalCluster, PartitionedClient, ValidatorClient,
+    ValidatorServer,
+)
+
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="needs Unix domain sockets"
+)
+
+SERVER_AUTH = "1.3.6.1.5.5.7.3.1"
+
+
+def _der(cert):
+    return cert.cert.public_bytes(serialization.Encoding.DER)
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are short, so stay out of pytest's deep tmpdirs.
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, "validator.sock")
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def daemon(ca_workspace, socket_path):
+    root = ca_workspace.issue_new_trusted_root()
+    server = ValidatorServer(X509Validator([root.cert]), socket_path)
+    t = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}
+    )
+    t.start()
+    yield root
+    server.shutdown()
+    server.server_close()
+    t.join()
+    assert not os.path.exists(socket_path)
+
+
+def test_validate(ca_workspace, daemon, socket_path):
+    root = daemon
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    untrusted = ca_workspace.issue_new_leaf(ca_workspace._issue_new_ca())
+
+    with ValidatorClient(socket_path) as client:
+        results = client.validate(
+            [_der(cert), _der(untrusted)], "example.com", SERVER_AUTH,
+            extra_certs=[_der(intermediate)],
+        )
+    assert results[0] == [_der(cert), _der(intermediate), _der(root)]
+    assert results[0].valid_until <= cert.cert.not_valid_after
+    assert results[1] is None
+
+
+def test_pipelined_requests(ca_workspace, daemon, socket_path):
+    cert = ca_workspace.issue_new_leaf(daemon)
+
+    with ValidatorClient(socket_path) as client:
+        results = client.validate_many([
+            {
+                "certs": [_der(cert)],
+                "name": name,
+                "extended_key_usage": SERVER_AUTH,
+            }
+            for name in ["example.com", "example.org", "example.com"]
+        ])
+    assert [r[0] is not None for r in results] == [True, False, True]
+
+
+def test_many_large_requests(ca_workspace, daemon, socket_path):
+    # Far more response data than fits in the socket buffers.
+    cert = _der(ca_workspace.issue_new_leaf(daemon))
+    requests = [
+        {
+            "certs": [cert] * 500,
+            "name": "example.com",
+            "extended_key_usage": SERVER_AUTH,
+        }
+        for _ in range(8)
+    ]
+
+    results = []
+    with ValidatorClient(socket_path) as client:
+        t = threading.Thread(
+            target=lambda: results.extend(client.validate_many(requests))
+        )
+        t.daemon = True
+        t.start()
+        t.join(30)
+        assert not t.is_alive()
+    assert len(results) == 8
+    assert all(len(r) == 500 and r[0] is not None for r in results)
+
+
+def test_malformed_request(daemon, socket_path):
+    with ValidatorClient(socket_path) as client:
+        with pytest.raises(DaemonError):
+            client.validate([b"not a cert"], "example.com", SERVER_AUTH)
+        # The connection is still usable
+        assert client.validate([], "example.com", SERVER_AUTH) == []
+
+
+def test_cache_stats(ca_workspace, daemon, socket_path):
+    cert = ca_workspace.issue_new_leaf(daemon)
+
+    with ValidatorClient(socket_path) as client:
+        client.validate([_der(cert)], "example.com", SERVER_AUTH)
+        stats = client.cache_stats()
+    assert stats["edges"]["entries"] == 1
+
+
+class _BySerialNumber(object):
+    def __init__(self, paths):
+        self.paths = paths
+
+    def worker_for(self, cert):
+        from validator import _as_certificate
+
+        serial_number = _as_certificate(cert).serial_number
+        return self.paths[serial_number % len(self.paths)]
+
+
+def test_partitioned_client(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    certs = [
+        ca_workspace.issue_new_leaf(root, serial_number=i)
+        for i in range(2, 6)
+    ]
+    untrusted = ca_workspace.issue_new_leaf(
+        ca_workspace._issue_new_ca(), serial_number=7
+    )
+
+    directory = tempfile.mkdtemp()
+    paths = [os.path.join(directory, n) for n in ["a.sock", "b.sock"]]
+    servers = [ValidatorServer(X509Validator([root.cert]), p) for p in paths]
+    threads = [
+        threading.Thread(
+            target=s.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        for s in servers
+    ]
+    for t in threads:
+        t.start()
+    try:
+        with PartitionedClient(paths, _BySerialNumber(paths)) as client:
+            results = client.validate_many([
+                {
+                    "certs": [_der(c) for c in certs + [untrusted]],
+                    "name": "example.com",
+                    "extended_key_usage": SERVER_AUTH,
+                },
+                {
+                    "certs": [_der(certs[1])],
+                    "name": "example.org",
+                    "extended_key_usage": SERVER_AUTH,
+                },
+            ])
+            stats = client.cache_stats()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        for t in threads:
+            t.join()
+        shutil.rmtree(directory)
+
+    assert [r[0] if r else None for r in results[0]] == [
+        _der(c) for c in certs
+    ] + [None]
+    assert results[1] == [None]
+    # Each daemon only checked its own leaves' signatures; the second also
+    # checked the untrusted leaf's against the root.
+    assert [s["edges"]["entries"] for s in stats.values()] == [2, 3]
+
+
+def test_partitioned_many_large_requests(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    certs = [
+        _der(ca_workspace.issue_new_leaf(root, serial_number=i))
+        for i in [2, 3]
+    ]
+    requests = [
+        {
+            "certs": certs * 250,
+            "name": "example.com",
+            "extended_key_usage": SERVER_AUTH,
+        }
+        for _ in range(8)
+    ]
+
+    results = []
+    with LocalCluster([_der(root)], processes=2) as cluster:
+        with cluster.client(_BySerialNumber(cluster.paths)) as client:
+            t = threading.Thread(
+                target=lambda: results.extend(client.validate_many(requests))
+            )
+            t.daemon = True
+            t.start()
+            t.join(30)
+            assert not t.is_alive()
+    assert len(results) == 8
+    assert all(r[:2] == [[c] + [_der(root)] for c in certs] for r in results)
+
+
+def test_local_cluster(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    certs = [
+        ca_workspace.issue_new_leaf(intermediate, serial_number=i)
+        for i in range(2, 6)
+    ]
+
+    with LocalCluster(
+        [_der(root)], processes=2, intermediates=[_der(intermediate)]
+    ) as cluster:
+        with cluster.client() as client:
+            results = client.validate(
+                [_der(c) for c in certs], "example.com", SERVER_AUTH
+            )
+            stats = client.cache_stats()
+    assert [r[0] for r in results] == [_der(c) for c in certs]
+    # All the leaves share an issuer, so the other daemon only checked the
+    # intermediate when registering it.
+    assert sorted(s["edges"]["entries"] for s in stats.values()) == [1, 9]
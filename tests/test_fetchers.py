@@ -0,0 +1,96 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import subprocess
+import sys
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509 import ocsp
+
+import pytest
+
+from validator import (
+    DisabledFetcher, StaticFetcher, UrllibFetcher, ValidationContext,
+    ValidationError, X509Validator
+)
+
+from .utils import create_ca_issuer
+
+
+def test_urllib_fetcher(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    ocsp_url = server.create_ocsp_url(
+        lambda request: ca_workspace.issue_new_ocsp_response(
+            cert, intermediate, status=ocsp.OCSPCertStatus.REVOKED
+        )
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate,
+        ca_issuers=[server.create_aia_url(intermediate), ocsp_url],
+    )
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert], fetcher=UrllibFetcher())
+    assert validator.validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, root.cert
+    ]
+
+    validator = X509Validator(
+        [root.cert], fetcher=UrllibFetcher(), ocsp_fetch=True
+    )
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ctx)
+    assert len(server.requests) == 1
+
+
+def test_urllib_fetcher_errors(server):
+    fetcher = UrllibFetcher()
+    assert fetcher.get("{}/not-a-real-url".format(server.base_url)) is None
+    assert fetcher.get("http://host.invalid/") is None
+
+
+def test_disabled_fetcher(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    validator = X509Validator([root.cert], fetcher=DisabledFetcher())
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ca_workspace._build_validation_context())
+
+
+def test_static_fetcher(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    url = "http://example.com/intermediate.crt"
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[create_ca_issuer(url)]
+    )
+
+    fetcher = StaticFetcher({
+        url: intermediate.cert.public_bytes(serialization.Encoding.DER)
+    })
+    validator = X509Validator([root.cert], fetcher=fetcher)
+    ctx = ValidationContext(
+        name=x509.DNSName("example.com"),
+        extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH,
+    )
+    assert validator.validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, root.cert
+    ]
+    assert fetcher.requests == [url]
+
+
+def test_requests_imported_lazily():
+    code = (
+        "import sys, validator; validator.X509Validator([]); "
+        "assert 'requests' not in sys.modules"
+    )
+    subprocess.check_call(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(os.path.dirname(__file__), os.pardir),
+    )
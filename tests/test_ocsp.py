@@ -0,0 +1,189 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+
+from cryptography import x509
+from cryptography.x509 import ocsp
+
+import pytest
+
+from validator import ValidationContext, ValidationError, X509Validator
+
+from .utils import UNKNOWN_SIGNATURE_OID, relative_datetime, replace_oid
+
+
+def build_context(ocsp_responses=[], extra_certs=[]):
+    return ValidationContext(
+        name=x509.DNSName("example.com"),
+        extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH,
+        extra_certs=[c.cert for c in extra_certs],
+        ocsp_responses=ocsp_responses,
+    )
+
+
+def test_stapled_good(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    staple = ca_workspace.issue_new_ocsp_response(cert, root)
+
+    validator = X509Validator([root.cert])
+    assert validator.validate(cert.cert, build_context([staple])) == [
+        cert.cert, root.cert
+    ]
+
+
+def test_stapled_revoked(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root, serial_number=2)
+    cert = ca_workspace.issue_new_leaf(intermediate, serial_number=3)
+
+    validator = X509Validator([root.cert])
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, build_context(
+            [ca_workspace.issue_new_ocsp_response(
+                cert, intermediate, status=ocsp.OCSPCertStatus.REVOKED
+            )],
+            extra_certs=[intermediate],
+        ))
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, build_context(
+            [ca_workspace.issue_new_ocsp_response(
+                intermediate, root, status=ocsp.OCSPCertStatus.REVOKED
+            )],
+            extra_certs=[intermediate],
+        ))
+
+
+def test_stapled_unusable(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    other_root = ca_workspace.issue_new_self_signed()
+
+    validator = X509Validator([root.cert])
+    for staple in [
+        b"garbage",
+        # Signed by someone else
+        ca_workspace.issue_new_ocsp_response(
+            cert, root, responder=other_root,
+            status=ocsp.OCSPCertStatus.REVOKED,
+        ),
+        # Expired
+        ca_workspace.issue_new_ocsp_response(
+            cert, root, status=ocsp.OCSPCertStatus.REVOKED,
+            this_update=relative_datetime(-datetime.timedelta(days=2)),
+            next_update=relative_datetime(-datetime.timedelta(days=1)),
+        ),
+    ]:
+        validator.validate(cert.cert, build_context([staple]))
+
+
+def test_stapled_delegated_responder(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    responder = ca_workspace.issue_new_leaf(
+        root, serial_number=3,
+        extended_key_usages=[x509.ExtendedKeyUsageOID.OCSP_SIGNING],
+    )
+    not_a_responder = ca_workspace.issue_new_leaf(root, serial_number=4)
+
+    validator = X509Validator([root.cert])
+    validator.validate(cert.cert, build_context([
+        ca_workspace.issue_new_ocsp_response(
+            cert, root, responder=not_a_responder,
+            status=ocsp.OCSPCertStatus.REVOKED,
+        )
+    ]))
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, build_context([
+            ca_workspace.issue_new_ocsp_response(
+                cert, root, responder=responder,
+                status=ocsp.OCSPCertStatus.REVOKED,
+            )
+        ]))
+
+
+def test_stapled_response_cache(ca_workspace, monkeypatch):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    staple = ca_workspace.issue_new_ocsp_response(cert, root)
+
+    validator = X509Validator([root.cert])
+    verified = []
+    verify = validator._verify_ocsp_response
+
+    def counting_verify(response, *args):
+        verified.append(response)
+        return verify(response, *args)
+
+    monkeypatch.setattr(validator, "_verify_ocsp_response", counting_verify)
+    validator.validate(cert.cert, build_context([staple]))
+    validator.validate(cert.cert, build_context([staple]))
+    assert len(verified) == 1
+
+    # A different staple has to be verified.
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, build_context([
+            ca_workspace.issue_new_ocsp_response(
+                cert, root, status=ocsp.OCSPCertStatus.REVOKED
+            )
+        ]))
+    assert len(verified) == 2
+
+
+def test_ocsp_fetch(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    statuses = {}
+    ocsp_url = server.create_ocsp_url(
+        lambda request: ca_workspace.issue_new_ocsp_response(
+            statuses[request.serial_number], root,
+            status=statuses[request.serial_number].status,
+        )
+    )
+    good = ca_workspace.issue_new_leaf(
+        root, serial_number=2, ca_issuers=[ocsp_url]
+    )
+    good.status = ocsp.OCSPCertStatus.GOOD
+    revoked = ca_workspace.issue_new_leaf(
+        root, serial_number=3, ca_issuers=[ocsp_url]
+    )
+    revoked.status = ocsp.OCSPCertStatus.REVOKED
+    statuses.update({2: good, 3: revoked})
+
+    validator = X509Validator([root.cert])
+    validator.validate(revoked.cert, build_context())
+    assert server.requests == []
+
+    validator = X509Validator([root.cert], ocsp_fetch=True)
+    result = validator.validate(good.cert, build_context())
+    assert result.ocsp_fetches == 1
+    with pytest.raises(ValidationError):
+        validator.validate(revoked.cert, build_context())
+    assert len(server.requests) == 2
+
+    # Cached until nextUpdate
+    result = validator.validate(good.cert, build_context())
+    assert result.ocsp_fetches == 0
+    assert len(server.requests) == 2
+
+
+def test_stapled_unknown_algorithms(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    revoked = ca_workspace.issue_new_ocsp_response(
+        cert, root, status=ocsp.OCSPCertStatus.REVOKED
+    )
+    staples = [
+        replace_oid(
+            revoked,
+            x509.SignatureAlgorithmOID.RSA_WITH_SHA256.dotted_string,
+            UNKNOWN_SIGNATURE_OID,
+        ),
+        # An unknown hash algorithm for the certificate ID.
+        replace_oid(revoked, "1.3.14.3.2.26", "1.3.14.3.2.99"),
+    ]
+
+    validator = X509Validator([root.cert])
+    for staple in staples:
+        assert validator.validate(cert.cert, build_context([staple])) == [
+            cert.cert, root.cert
+        ]
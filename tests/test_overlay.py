@@ -0,0 +1,160 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import pytest
+
+from validator import ValidationError, X509Validator
+
+from .test_aia import _create_counted_aia_url
+from .test_revocation import CRL_SIGN_KEY_USAGE, write_crl
+
+
+def test_overlay_adds_root(ca_workspace):
+    shared = ca_workspace.issue_new_trusted_root()
+    private = ca_workspace._issue_new_ca()
+    shared_cert = ca_workspace.issue_new_leaf(shared)
+    private_cert = ca_workspace.issue_new_leaf(private)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([shared.cert])
+    tenant = base.overlay(roots=[private.cert])
+    other = base.overlay()
+
+    assert tenant.roots == (shared.cert, private.cert)
+    assert tenant.validate(shared_cert.cert, ctx) == [
+        shared_cert.cert, shared.cert
+    ]
+    assert tenant.validate(private_cert.cert, ctx) == [
+        private_cert.cert, private.cert
+    ]
+    for validator in [base, other]:
+        with pytest.raises(ValidationError):
+            validator.validate(private_cert.cert, ctx)
+
+
+def test_overlay_distrusts_root(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([root.cert])
+    base.register_intermediates([intermediate.cert])
+    tenant = base.overlay(distrusted=[root.cert])
+
+    assert tenant.roots == ()
+    assert tenant.intermediates == ()
+    with pytest.raises(ValidationError):
+        tenant.validate(cert.cert, ctx)
+    assert base.validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, root.cert
+    ]
+
+
+def test_overlay_shares_caches(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([root.cert])
+    tenant = base.overlay()
+    base.validate(cert.cert, ctx)
+    misses = base.cache_stats()["edges"]["misses"]
+
+    tenant.validate(cert.cert, ctx)
+    assert tenant.cache_stats()["edges"]["misses"] == misses
+
+
+def test_overlay_follows_base(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root()
+    private = ca_workspace._issue_new_ca()
+    intermediate = ca_workspace.issue_new_ca(root2)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([root1.cert])
+    tenant = base.overlay(roots=[private.cert])
+    base.update_roots([root1.cert, root2.cert])
+    assert tenant.roots == (root1.cert, root2.cert, private.cert)
+
+    base.register_intermediates([intermediate.cert])
+    assert tenant.intermediates == (intermediate.cert,)
+    assert tenant.validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, root2.cert
+    ]
+
+    base.update_roots([root1.cert])
+    assert tenant.roots == (root1.cert, private.cert)
+    assert tenant.intermediates == ()
+
+
+def test_overlay_registers_own_intermediates(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    private = ca_workspace._issue_new_ca()
+    intermediate = ca_workspace.issue_new_ca(private)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([root.cert])
+    tenant = base.overlay(roots=[private.cert])
+    assert tenant.register_intermediates([intermediate.cert]) == [
+        intermediate.cert
+    ]
+    assert base.intermediates == ()
+
+    # The tenant's intermediates survive changes to the base.
+    base.update_roots([])
+    assert tenant.intermediates == (intermediate.cert,)
+    assert tenant.validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, private.cert
+    ]
+
+    tenant.update_roots([])
+    assert tenant.intermediates == ()
+
+
+def test_overlay_revocation(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([root.cert])
+    tenant = base.overlay()
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert])
+    )
+    assert base.load_crls([path]) == [path]
+    with pytest.raises(ValidationError):
+        tenant.validate(cert.cert, ctx)
+
+    with pytest.raises(ValueError):
+        tenant.load_crls([path])
+    with pytest.raises(ValueError):
+        tenant.set_revocation_filter(None)
+
+
+def test_overlay_shares_negative_cache(ca_workspace, server):
+    root = ca_workspace._issue_new_ca()
+    aia_url, fetches = _create_counted_aia_url(server, b"not a cert")
+    cert = ca_workspace.issue_new_leaf(root, ca_issuers=[aia_url])
+    ctx = ca_workspace._build_validation_context()
+
+    base = X509Validator([])
+    tenant1 = base.overlay()
+    tenant2 = base.overlay()
+    with pytest.raises(ValidationError):
+        base.validate(cert.cert, ctx)
+    assert len(fetches) == 1
+
+    # Changes to one tenant don't make the others forget.
+    tenant1.update_roots([])
+    for validator in [tenant1, tenant2, base]:
+        with pytest.raises(ValidationError):
+            validator.validate(cert.cert, ctx)
+    assert len(fetches) == 1
+
+    # Changes to the base do.
+    base.update_roots([])
+    with pytest.raises(ValidationError):
+        tenant2.validate(cert.cert, ctx)
+    assert len(fetches) == 2
@@ -0,0 +1,79 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from validator import IssuerPartitioner, X509Validator, issuer_affinity_key
+
+from .utils import create_extension
+
+
+def _with_aki(ca_workspace, root, key_identifier, **kwargs):
+    return ca_workspace.issue_new_leaf(root, extra_extensions=[
+        create_extension(x509.AuthorityKeyIdentifier(
+            key_identifier=key_identifier,
+            authority_cert_issuer=None,
+            authority_cert_serial_number=None,
+        ), critical=False),
+    ], **kwargs)
+
+
+def test_issuer_affinity_key(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert1 = _with_aki(ca_workspace, root, b"\x01" * 20)
+    cert2 = _with_aki(ca_workspace, root, b"\x01" * 20, serial_number=2)
+    cert3 = _with_aki(ca_workspace, root, b"\x02" * 20)
+    plain = ca_workspace.issue_new_leaf(root)
+
+    assert issuer_affinity_key(cert1.cert) == issuer_affinity_key(
+        cert2.cert.public_bytes(serialization.Encoding.DER)
+    )
+    assert issuer_affinity_key(cert1.cert) != issuer_affinity_key(cert3.cert)
+    # Without an authority key identifier, the issuer name is used.
+    assert issuer_affinity_key(plain.cert) not in [
+        issuer_affinity_key(cert1.cert), issuer_affinity_key(cert3.cert)
+    ]
+
+
+def test_issuer_partitioner(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    certs = [
+        _with_aki(ca_workspace, root, bytes(bytearray([i] * 20))).cert
+        for i in range(32)
+    ]
+
+    partitioner = IssuerPartitioner(["a", "b", "c", "d"])
+    assignments = [partitioner.worker_for(cert) for cert in certs]
+    assert set(assignments) == {"a", "b", "c", "d"}
+    partitions = partitioner.partition(certs)
+    assert sorted(i for p in partitions.values() for i in p) == list(
+        range(len(certs))
+    )
+    for (worker, indexes) in partitions.items():
+        assert all(assignments[i] == worker for i in indexes)
+
+    # Removing a worker only moves the certificates it owned.
+    smaller = IssuerPartitioner(["a", "b", "c"])
+    for (cert, worker) in zip(certs, assignments):
+        if worker != "d":
+            assert smaller.worker_for(cert) == worker
+
+
+def test_validate_batch(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert1 = ca_workspace.issue_new_leaf(intermediate)
+    cert2 = ca_workspace.issue_new_leaf(root, serial_number=2)
+    untrusted = ca_workspace.issue_new_leaf(ca_workspace._issue_new_ca())
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    validator = X509Validator([root.cert])
+    results = validator.validate_batch(
+        [cert1.cert, b"not a cert", untrusted.cert, cert2.cert], ctx
+    )
+    assert results == [
+        [cert1.cert, intermediate.cert, root.cert],
+        None,
+        None,
+        [cert2.cert, root.cert],
+    ]
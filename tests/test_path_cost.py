@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from cryptography.hazmat.primitives import serialization
+
+from validator import PathCost, X509Validator
+
+from .utils import create_ca_issuer
+
+
+def test_prefers_shorter_chain(ca_workspace):
+    old_root = ca_workspace.issue_new_trusted_root()
+    new_root = ca_workspace.issue_new_trusted_root()
+    # new_root's key, cross-signed by old_root
+    cross_signed = ca_workspace.issue_new_ca(old_root, key=new_root.key)
+    intermediate = ca_workspace.issue_new_ca(new_root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context(
+        extra_certs=[cross_signed, intermediate]
+    )
+
+    roots = [old_root.cert, new_root.cert]
+    assert X509Validator(roots).validate(cert.cert, ctx) == [
+        cert.cert, intermediate.cert, cross_signed.cert, old_root.cert
+    ]
+    assert X509Validator(roots, path_cost=PathCost()).validate(
+        cert.cert, ctx
+    ) == [cert.cert, intermediate.cert, new_root.cert]
+
+
+def test_anchor_preference(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root1)
+    intermediate2 = ca_workspace.issue_new_ca(root2, key=intermediate1.key)
+    cert = ca_workspace.issue_new_leaf(intermediate1)
+    ctx = ca_workspace._build_validation_context(
+        extra_certs=[intermediate1, intermediate2]
+    )
+
+    roots = [root1.cert, root2.cert]
+    validator = X509Validator(roots, path_cost=PathCost())
+    assert validator.validate(cert.cert, ctx).anchor == root1.cert
+    validator = X509Validator(
+        roots, path_cost=PathCost(anchors={root1.cert: 5})
+    )
+    assert validator.validate(cert.cert, ctx).anchor == root2.cert
+
+
+def test_aia_only_when_needed(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    fetches = []
+
+    def respond(body):
+        fetches.append(body)
+        return intermediate.cert.public_bytes(serialization.Encoding.DER)
+
+    server.wsgi_app.urls["/intermediate.crt"] = respond
+    cert = ca_workspace.issue_new_leaf(
+        intermediate,
+        ca_issuers=[create_ca_issuer(
+            "{}/intermediate.crt".format(server.base_url)
+        )],
+    )
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    validator = X509Validator([root.cert], path_cost=PathCost())
+    result = validator.validate(cert.cert, ctx)
+    assert result == [cert.cert, intermediate.cert, root.cert]
+    assert fetches == []
+
+    # Enumerating every chain eventually follows AIA too
+    results = list(validator.iter_chains(cert.cert, ctx))
+    assert len(fetches) == 1
+    assert [r.used_aia for r in results] == [False, True]
+
+
+def test_iter_chains(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root)
+    intermediate2 = ca_workspace.issue_new_ca(
+        root, key=intermediate1.key, serial_number=2
+    )
+    cert = ca_workspace.issue_new_leaf(intermediate1)
+    ctx = ca_workspace._build_validation_context(
+        extra_certs=[intermediate1, intermediate2]
+    )
+
+    for path_cost in [None, PathCost()]:
+        validator = X509Validator([root.cert], path_cost=path_cost)
+        results = list(validator.iter_chains(cert.cert, ctx))
+        assert [list(r) for r in results] == [
+            [cert.cert, intermediate1.cert, root.cert],
+            [cert.cert, intermediate2.cert, root.cert],
+        ]
+
+
+def test_iter_chains_registered_intermediate(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root(key=root1.key, serial_number=2)
+    intermediate = ca_workspace.issue_new_ca(root1, serial_number=3)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    for path_cost in [None, PathCost()]:
+        validator = X509Validator(
+            [root1.cert, root2.cert], path_cost=path_cost
+        )
+        validator.register_intermediates([intermediate.cert])
+        results = list(validator.iter_chains(cert.cert, ctx))
+        # Each root also cross-signs the other, since they share a key.
+        assert all(r[:2] == [cert.cert, intermediate.cert] for r in results)
+        assert sorted(
+            [(root1.cert, root2.cert).index(c) for c in r[2:]]
+            for r in results
+        ) == [[0], [0, 1], [1], [1, 0]]
+
+
+def test_cheaper_than_registered_path(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root(key=root1.key, serial_number=2)
+    intermediate = ca_workspace.issue_new_ca(root1, serial_number=3)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    for expensive in [root1.cert, root2.cert]:
+        validator = X509Validator(
+            [root1.cert, root2.cert],
+            path_cost=PathCost(anchors={expensive: 5}),
+        )
+        validator.register_intermediates([intermediate.cert])
+        result = validator.validate(cert.cert, ctx)
+        assert len(result) == 3
+        assert result.anchor != expensive
@@ -0,0 +1,99 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+
+from cryptography import x509
+
+import pytest
+
+from validator import CertificatePool, ValidationContext, X509Validator
+
+from .utils import relative_datetime
+
+
+pytest.importorskip("numpy")
+
+
+def test_pool_screen(ca_workspace, key_cache):
+    root = ca_workspace.issue_new_trusted_root()
+    good = ca_workspace.issue_new_ca(root)
+    constrained = ca_workspace.issue_new_ca(root, path_length=0)
+    expired = ca_workspace.issue_new_ca(
+        root,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=2)),
+        not_valid_after=relative_datetime(-datetime.timedelta(days=1)),
+    )
+    client_only = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[x509.ExtendedKeyUsageOID.CLIENT_AUTH]
+    )
+    server_only = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[x509.ExtendedKeyUsageOID.SERVER_AUTH]
+    )
+    small_key = ca_workspace.issue_new_ca(
+        root, key=key_cache.generate_rsa_key(key_size=1024)
+    )
+    leaf = ca_workspace.issue_new_leaf(root)
+
+    pool = CertificatePool([
+        c.cert for c in [
+            good, constrained, expired, client_only, server_only, small_key,
+            leaf,
+        ]
+    ])
+    assert len(pool) == 7
+
+    ctx = ValidationContext(
+        name=x509.DNSName("example.com"),
+        extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH,
+    )
+    assert pool.screen(ctx) == [good.cert, constrained.cert, server_only.cert]
+    assert pool.screen(ctx, depth=1) == [good.cert, server_only.cert]
+
+    ctx.timestamp = relative_datetime(-datetime.timedelta(hours=36))
+    assert pool.screen(ctx) == [expired.cert]
+
+
+def test_validate_with_pool(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediates = [ca_workspace.issue_new_ca(root) for _ in range(5)]
+    cert = ca_workspace.issue_new_leaf(intermediates[3])
+
+    validator = X509Validator([root.cert])
+    ctx = ValidationContext(
+        name=x509.DNSName("example.com"),
+        extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH,
+        candidate_pool=CertificatePool([c.cert for c in intermediates]),
+    )
+    assert validator.validate(cert.cert, ctx) == [
+        cert.cert, intermediates[3].cert, root.cert
+    ]
+
+
+def test_pool_timeline(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(
+        not_valid_before=relative_datetime(-datetime.timedelta(days=10)),
+        not_valid_after=relative_datetime(datetime.timedelta(days=10)),
+    )
+    expired = ca_workspace.issue_new_ca(
+        root,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=2)),
+        not_valid_after=relative_datetime(-datetime.timedelta(days=1)),
+        extended_key_usages=[x509.ExtendedKeyUsageOID.CLIENT_AUTH],
+    )
+    cert = ca_workspace.issue_new_leaf(
+        expired,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=3)),
+    )
+    pool = CertificatePool([expired.cert])
+    validator = X509Validator([root.cert])
+
+    # The pool mustn't screen out certificates which aren't currently valid
+    timeline = validator.validity_timeline(
+        cert.cert, x509.DNSName("example.com"),
+        x509.ExtendedKeyUsageOID.CLIENT_AUTH, candidate_pool=pool,
+    )
+    assert [r[1] for r in timeline] == [expired.cert]
+    assert validator.validity_timeline(
+        cert.cert, x509.DNSName("example.com"),
+        x509.ExtendedKeyUsageOID.SERVER_AUTH, candidate_pool=pool,
+    ) == []
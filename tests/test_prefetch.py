@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from validator import AIAPrefetcher, X509Validator
+
+
+def test_crawl_registers_intermediate(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    validator = X509Validator([root.cert])
+    prefetcher = AIAPrefetcher(validator, min_interval=0)
+    assert prefetcher.crawl([cert.cert]) == [intermediate.cert]
+    assert validator.intermediates == (intermediate.cert,)
+
+    result = validator.validate(
+        cert.cert, ca_workspace._build_validation_context()
+    )
+    assert result == [cert.cert, intermediate.cert, root.cert]
+    assert result.aia_fetches == 0
+
+    # Nothing left to fetch
+    assert prefetcher.crawl([cert.cert]) == []
+
+
+def test_crawl_depth(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root)
+    intermediate2 = ca_workspace.issue_new_ca(
+        intermediate1, ca_issuers=[server.create_aia_url(intermediate1)]
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate2, ca_issuers=[server.create_aia_url(intermediate2)]
+    )
+
+    validator = X509Validator([root.cert])
+    assert AIAPrefetcher(validator, max_depth=1, min_interval=0).crawl(
+        [cert.cert]
+    ) == []
+    assert validator.intermediates == ()
+
+    registered = AIAPrefetcher(validator, max_depth=2, min_interval=0).crawl(
+        [cert.cert]
+    )
+    assert set(registered) == {intermediate1.cert, intermediate2.cert}
+
+
+def test_crawl_untrusted(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    untrusted_root = ca_workspace._issue_new_ca()
+    intermediate = ca_workspace.issue_new_ca(untrusted_root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    validator = X509Validator([root.cert])
+    assert AIAPrefetcher(validator, min_interval=0).crawl([cert.cert]) == []
+    assert validator.intermediates == ()
+
+
+def test_background_crawl(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    validator = X509Validator([root.cert])
+    prefetcher = AIAPrefetcher(validator, min_interval=0)
+    prefetcher.start()
+    try:
+        prefetcher.submit([cert.cert])
+        prefetcher.join()
+    finally:
+        prefetcher.stop()
+    assert validator.intermediates == (intermediate.cert,)
+
+
+def test_crawl_after_stop(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    validator = X509Validator([root.cert])
+    prefetcher = AIAPrefetcher(validator, min_interval=0)
+    prefetcher.start()
+    prefetcher.stop()
+    assert prefetcher.crawl([cert.cert]) == [intermediate.cert]
+
+
+def test_crawl_throttles_fetches(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    # Only the one fetch is made, so nothing waits out the interval.
+    validator = X509Validator([root.cert])
+    prefetcher = AIAPrefetcher(validator, min_interval=5)
+    start = time.time()
+    assert prefetcher.crawl([cert.cert]) == [intermediate.cert]
+    assert prefetcher.crawl([cert.cert]) == []
+    assert time.time() - start < 2.5
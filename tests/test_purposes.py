@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from cryptography import x509
+
+import pytest
+
+from validator import CertificatePool, X509Validator
+
+from .utils import create_extension
+
+
+SERVER_AUTH = x509.ExtendedKeyUsageOID.SERVER_AUTH
+CLIENT_AUTH = x509.ExtendedKeyUsageOID.CLIENT_AUTH
+
+
+def test_validate_purposes(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[SERVER_AUTH, CLIENT_AUTH]
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate,
+        names=[x509.DNSName("example.com"), x509.DNSName("example.org")],
+        extended_key_usages=[CLIENT_AUTH],
+    )
+
+    validator = X509Validator([root.cert])
+    results = validator.validate_purposes(
+        cert.cert, [
+            (x509.DNSName("example.com"), CLIENT_AUTH),
+            (x509.DNSName("example.org"), CLIENT_AUTH),
+            (x509.DNSName("example.com"), SERVER_AUTH),
+            (x509.DNSName("example.net"), CLIENT_AUTH),
+        ],
+        extra_certs=[intermediate.cert],
+    )
+    assert results[0] == [cert.cert, intermediate.cert, root.cert]
+    assert results[1] == [cert.cert, intermediate.cert, root.cert]
+    assert results[2] is None
+    assert results[3] is None
+    # Signatures were only checked for the first purpose
+    assert results[1].signature_checks == results[0].signature_checks
+
+
+def test_validate_purposes_per_purpose_chain(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    server_only = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[SERVER_AUTH]
+    )
+    constrained = ca_workspace.issue_new_ca(
+        root, key=server_only.key, serial_number=2,
+        extended_key_usages=[CLIENT_AUTH],
+        extra_extensions=[create_extension(
+            x509.NameConstraints(
+                permitted_subtrees=[x509.DNSName("example.org")],
+                excluded_subtrees=None,
+            ),
+            critical=False,
+        )],
+    )
+    cert = ca_workspace.issue_new_leaf(
+        server_only,
+        names=[x509.DNSName("example.com"), x509.DNSName("example.org")],
+    )
+
+    validator = X509Validator([root.cert])
+    results = validator.validate_purposes(
+        cert.cert, [
+            (x509.DNSName("example.com"), SERVER_AUTH),
+            (x509.DNSName("example.org"), CLIENT_AUTH),
+            (x509.DNSName("example.com"), CLIENT_AUTH),
+        ],
+        extra_certs=[server_only.cert, constrained.cert],
+    )
+    assert results[0][1] == server_only.cert
+    assert results[1][1] == constrained.cert
+    assert results[2] is None
+
+
+def test_validate_purposes_with_pool(ca_workspace):
+    pytest.importorskip("numpy")
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[SERVER_AUTH]
+    )
+    cert = ca_workspace.issue_new_leaf(intermediate)
+
+    validator = X509Validator([root.cert])
+    results = validator.validate_purposes(
+        cert.cert, [
+            (x509.DNSName("example.com"), SERVER_AUTH),
+            (x509.DNSName("example.com"), CLIENT_AUTH),
+        ],
+        candidate_pool=CertificatePool([intermediate.cert]),
+    )
+    assert results[0] == [cert.cert, intermediate.cert, root.cert]
+    assert results[1] is None
@@ -0,0 +1,67 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+
+import pytest
+
+from validator import ValidationError, X509Validator
+
+from .utils import relative_datetime
+
+
+def test_revalidate_known_chain(ca_workspace, monkeypatch):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    validator = X509Validator([root.cert])
+    chain = validator.validate(cert.cert, ctx)
+
+    monkeypatch.setattr(validator, "_build_chain_from", None)
+    monkeypatch.setattr(validator, "_verify_signature", None)
+    assert validator.revalidate(chain, ctx) == chain
+
+
+def test_revalidate_falls_back_to_new_path(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(
+        not_valid_after=relative_datetime(datetime.timedelta(days=10))
+    )
+    short_lived = ca_workspace.issue_new_ca(root)
+    reissued = ca_workspace.issue_new_ca(
+        root, key=short_lived.key,
+        not_valid_after=relative_datetime(datetime.timedelta(days=5)),
+    )
+    cert = ca_workspace.issue_new_leaf(
+        short_lived,
+        not_valid_after=relative_datetime(datetime.timedelta(days=5)),
+    )
+    ctx = ca_workspace._build_validation_context(
+        extra_certs=[short_lived, reissued]
+    )
+
+    validator = X509Validator([root.cert])
+    chain = validator.validate(cert.cert, ctx)
+    assert chain == [cert.cert, short_lived.cert, root.cert]
+
+    ctx.timestamp = relative_datetime(datetime.timedelta(days=2))
+    assert validator.revalidate(chain, ctx) == [
+        cert.cert, reissued.cert, root.cert
+    ]
+
+    ctx.timestamp = relative_datetime(datetime.timedelta(days=6))
+    with pytest.raises(ValidationError):
+        validator.revalidate(chain, ctx)
+
+
+def test_revalidate_removed_root(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    chain = validator.validate(cert.cert, ctx)
+    validator.update_roots([])
+
+    with pytest.raises(ValidationError):
+        validator.revalidate(chain, ctx)
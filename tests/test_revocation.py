@@ -0,0 +1,357 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import os
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+import pytest
+
+import validator as validator_module
+from validator import (
+    FilterCascade, ValidationError, X509Validator, revocation_filter_key
+)
+
+
+CRL_SIGN_KEY_USAGE = x509.KeyUsage(
+    key_cert_sign=True,
+    crl_sign=True,
+
+    digital_signature=False,
+    content_commitment=False,
+    key_encipherment=False,
+    data_encipherment=False,
+    key_agreement=False,
+    encipher_only=False,
+    decipher_only=False,
+)
+
+
+def write_crl(tmpdir, name, crl, encoding=serialization.Encoding.DER):
+    path = str(tmpdir.join(name))
+    with open(path, "wb") as f:
+        f.write(crl.public_bytes(encoding))
+    return path
+
+
+def test_crl_revoked_leaf(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    revoked = ca_workspace.issue_new_leaf(root, serial_number=2)
+    good = ca_workspace.issue_new_leaf(root, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [revoked]),
+        serialization.Encoding.PEM,
+    )
+    assert validator.load_crls([path]) == [path]
+
+    with pytest.raises(ValidationError):
+        validator.validate(revoked.cert, ctx)
+    assert validator.validate(good.cert, ctx) == [good.cert, root.cert]
+
+
+def test_crl_revoked_registered_intermediate(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    intermediate = ca_workspace.issue_new_ca(root, serial_number=2)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    validator.register_intermediates([intermediate.cert])
+    validator.validate(cert.cert, ctx)
+
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [intermediate])
+    )
+    validator.load_crls([path])
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ctx)
+
+
+def test_crl_requires_valid_issuer(ca_workspace, tmpdir, key_cache):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    no_crl_sign = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+
+    validator = X509Validator([root.cert, no_crl_sign.cert])
+    forged = write_crl(tmpdir, "forged.crl", ca_workspace.issue_new_crl(
+        root, [cert], key=key_cache.generate_rsa_key()
+    ))
+    unauthorized = write_crl(
+        tmpdir, "unauthorized.crl",
+        ca_workspace.issue_new_crl(no_crl_sign, [cert]),
+    )
+    garbage = str(tmpdir.join("garbage.crl"))
+    with open(garbage, "wb") as f:
+        f.write(b"not a CRL")
+
+    assert validator.load_crls([forged, unauthorized, garbage]) == []
+    validator.validate(cert.cert, ca_workspace._build_validation_context())
+
+
+def test_crl_reload(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert1 = ca_workspace.issue_new_leaf(root, serial_number=2)
+    cert2 = ca_workspace.issue_new_leaf(root, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert1])
+    )
+    assert validator.load_crls([path]) == [path]
+    # Unchanged files aren't processed again.
+    assert validator.load_crls([path]) == []
+
+    write_crl(tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert2]))
+    assert validator.load_crls([path]) == [path]
+    validator.validate(cert1.cert, ctx)
+    with pytest.raises(ValidationError):
+        validator.validate(cert2.cert, ctx)
+
+
+def test_crl_mmap(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    revoked = [
+        ca_workspace.issue_new_leaf(root, serial_number=n)
+        for n in [2, 1000, 2 ** 150]
+    ]
+    good = ca_workspace.issue_new_leaf(root, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, revoked)
+    )
+    mmap_dir = tmpdir.mkdir("mmap")
+    validator.load_crls([path], mmap_dir=str(mmap_dir), mmap_threshold=1)
+    assert len(os.listdir(str(mmap_dir))) == 1
+
+    for cert in revoked:
+        with pytest.raises(ValidationError):
+            validator.validate(cert.cert, ctx)
+    validator.validate(good.cert, ctx)
+
+
+def test_crl_reload_drops_stale_entries(ca_workspace, tmpdir):
+    root1 = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    root2 = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert1 = ca_workspace.issue_new_leaf(root1, serial_number=2)
+    cert2 = ca_workspace.issue_new_leaf(root2, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root1.cert, root2.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root1, [cert1])
+    )
+    other = write_crl(
+        tmpdir, "other.crl", ca_workspace.issue_new_crl(root2, [cert2])
+    )
+    validator.load_crls([path, other])
+    for cert in [cert1, cert2]:
+        with pytest.raises(ValidationError):
+            validator.validate(cert.cert, ctx)
+
+    # CRLs which are no longer given are dropped.
+    assert validator.load_crls([path]) == []
+    validator.validate(cert2.cert, ctx)
+
+    # So is the old issuer's CRL when a path switches issuers.
+    write_crl(tmpdir, "root.crl", ca_workspace.issue_new_crl(root2, [cert2]))
+    assert validator.load_crls([path]) == [path]
+    validator.validate(cert1.cert, ctx)
+    with pytest.raises(ValidationError):
+        validator.validate(cert2.cert, ctx)
+
+
+def test_crl_mmap_cleanup(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert1 = ca_workspace.issue_new_leaf(root, serial_number=2)
+    cert2 = ca_workspace.issue_new_leaf(root, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    mmap_dir = str(tmpdir.mkdir("mmap"))
+    crl = ca_workspace.issue_new_crl(root, [cert1])
+    path = write_crl(tmpdir, "root.crl", crl)
+    copy = write_crl(tmpdir, "copy.crl", crl)
+    validator.load_crls([path, copy], mmap_dir=mmap_dir, mmap_threshold=1)
+    assert len(os.listdir(mmap_dir)) == 1
+
+    # The old file is kept for as long as another path still uses it.
+    write_crl(tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert2]))
+    validator.load_crls(
+        [path, copy], mmap_dir=mmap_dir, mmap_threshold=1
+    )
+    assert len(os.listdir(mmap_dir)) == 2
+    validator.load_crls([path], mmap_dir=mmap_dir, mmap_threshold=1)
+    assert len(os.listdir(mmap_dir)) == 1
+    validator.validate(cert1.cert, ctx)
+    with pytest.raises(ValidationError):
+        validator.validate(cert2.cert, ctx)
+
+    validator.load_crls([], mmap_dir=mmap_dir)
+    assert os.listdir(mmap_dir) == []
+    validator.validate(cert2.cert, ctx)
+
+
+def test_crl_reload_keeps_unreadable(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert1 = ca_workspace.issue_new_leaf(root, serial_number=2)
+    cert2 = ca_workspace.issue_new_leaf(root, serial_number=3)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert1])
+    )
+    validator.load_crls([path])
+
+    # Deleted and corrupted files keep their previous CRL.
+    os.remove(path)
+    assert validator.load_crls([path]) == []
+    with pytest.raises(ValidationError):
+        validator.validate(cert1.cert, ctx)
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    assert validator.load_crls([path]) == []
+    with pytest.raises(ValidationError):
+        validator.validate(cert1.cert, ctx)
+    validator.validate(cert2.cert, ctx)
+
+
+def test_crl_expiry(ca_workspace, tmpdir, monkeypatch):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    path = write_crl(
+        tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert])
+    )
+    validator.load_crls([path])
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ctx)
+
+    real_datetime = datetime.datetime
+
+    class Later(real_datetime):
+        @classmethod
+        def utcnow(cls):
+            return real_datetime.utcnow() + datetime.timedelta(hours=2)
+
+    # Once past their nextUpdate, neither the loaded CRL nor a new one
+    # which is just as old counts any more.
+    monkeypatch.setattr(validator_module.datetime, "datetime", Later)
+    assert validator.load_crls([path]) == []
+    monkeypatch.undo()
+    validator.validate(cert.cert, ctx)
+
+    write_crl(tmpdir, "root.crl", ca_workspace.issue_new_crl(root, [cert]))
+    monkeypatch.setattr(validator_module.datetime, "datetime", Later)
+    assert validator.load_crls([path]) == []
+    monkeypatch.undo()
+    validator.validate(cert.cert, ctx)
+
+
+def test_crl_mmap_empty(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root(key_usage=CRL_SIGN_KEY_USAGE)
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    mmap_dir = str(tmpdir.mkdir("mmap"))
+    path = write_crl(tmpdir, "root.crl", ca_workspace.issue_new_crl(root))
+    assert validator.load_crls(
+        [path], mmap_dir=mmap_dir, mmap_threshold=0
+    ) == [path]
+    assert os.listdir(mmap_dir) == []
+    validator.validate(cert.cert, ctx)
+
+
+def test_filter_cascade():
+    revoked = [os.urandom(40) for _ in range(100)]
+    valid = [os.urandom(40) for _ in range(5000)]
+    cascade = FilterCascade.build(revoked, valid)
+
+    assert all(key in cascade for key in revoked)
+    assert not any(key in cascade for key in valid)
+
+    loaded = FilterCascade.from_bytes(cascade.to_bytes())
+    assert all(key in loaded for key in revoked)
+    assert not any(key in loaded for key in valid)
+
+
+def test_filter_cascade_empty(tmpdir):
+    cascade = FilterCascade.build([], [b"a", b"b"])
+    assert b"a" not in cascade
+
+    path = str(tmpdir.join("empty.filter"))
+    cascade.save(path)
+    assert b"a" not in FilterCascade.load(path)
+
+
+def test_filter_cascade_coverage(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    other = ca_workspace.issue_new_trusted_root()
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    cascade = FilterCascade.build(
+        revoked=[revocation_filter_key(root.cert, 2)], valid=[],
+        timestamp=now,
+    )
+    loaded = FilterCascade.from_bytes(cascade.to_bytes())
+
+    for c in [cascade, loaded]:
+        key_id = revocation_filter_key(root.cert, 2)[:-1]
+        assert c.covers(key_id, now)
+        assert not c.covers(key_id, now + datetime.timedelta(seconds=1))
+        assert not c.covers(revocation_filter_key(other.cert, 2)[:-1], now)
+
+
+def test_revocation_filter_uncovered(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root, serial_number=2)
+    ctx = ca_workspace._build_validation_context()
+
+    # Built before the certificate was issued, so it can't know about it.
+    validator = X509Validator([root.cert], revocation_filter=(
+        FilterCascade.build(
+            revoked=[revocation_filter_key(root.cert, 2)], valid=[],
+            timestamp=datetime.datetime.utcnow() - datetime.timedelta(days=1),
+        )
+    ))
+    assert validator.validate(cert.cert, ctx) == [cert.cert, root.cert]
+
+
+def test_revocation_filter(ca_workspace, tmpdir):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root, serial_number=2)
+    revoked = ca_workspace.issue_new_leaf(intermediate, serial_number=3)
+    good = ca_workspace.issue_new_leaf(intermediate, serial_number=4)
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    path = str(tmpdir.join("revoked.filter"))
+    FilterCascade.build(
+        revoked=[revocation_filter_key(intermediate.cert, 3)],
+        valid=[
+            revocation_filter_key(root.cert, 2),
+            revocation_filter_key(intermediate.cert, 4),
+        ],
+    ).save(path)
+
+    validator = X509Validator(
+        [root.cert], revocation_filter=FilterCascade.load(path)
+    )
+    with pytest.raises(ValidationError):
+        validator.validate(revoked.cert, ctx)
+    chain = validator.validate(good.cert, ctx)
+    assert chain == [good.cert, intermediate.cert, root.cert]
+
+    validator.set_revocation_filter(FilterCascade.build(
+        revoked=[revocation_filter_key(root.cert, 2)], valid=[]
+    ))
+    with pytest.raises(ValidationError):
+        validator.revalidate(chain, ctx)
@@ -0,0 +1,71 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+import pytest
+
+from validator import ValidationError, X509Validator
+
+
+SERVER_AUTH = x509.ExtendedKeyUsageOID.SERVER_AUTH
+
+
+def _start_session(validator, cert):
+    return validator.start_session(
+        cert.cert, x509.DNSName("example.com"), SERVER_AUTH
+    )
+
+
+def test_completes_when_chain_is_available(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root)
+    intermediate2 = ca_workspace.issue_new_ca(intermediate1)
+    cert = ca_workspace.issue_new_leaf(intermediate2)
+
+    session = _start_session(X509Validator([root.cert]), cert)
+    assert session.result is None
+    # Out of order, and as DER
+    assert session.add(
+        intermediate1.cert.public_bytes(serialization.Encoding.DER)
+    ) is None
+    result = session.add(intermediate2.cert)
+    assert result == [
+        cert.cert, intermediate2.cert, intermediate1.cert, root.cert
+    ]
+    assert session.finish() is result
+
+
+def test_completes_without_intermediates(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(root)
+
+    session = _start_session(X509Validator([root.cert]), cert)
+    assert session.result == [cert.cert, root.cert]
+
+
+def test_finish_follows_aia(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    session = _start_session(X509Validator([root.cert]), cert)
+    assert session.add(b"not a cert") is None
+    result = session.finish()
+    assert result == [cert.cert, intermediate.cert, root.cert]
+    assert result.used_aia
+
+
+def test_invalid_leaf(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    cert = ca_workspace.issue_new_leaf(
+        root, names=[x509.DNSName("example.org")]
+    )
+
+    session = _start_session(X509Validator([root.cert]), cert)
+    assert session.failed
+    assert session.add(root.cert) is None
+    with pytest.raises(ValidationError):
+        session.finish()
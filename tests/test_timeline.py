@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+
+from validator import X509Validator
+
+from .utils import relative_datetime
+
+
+def _days(n):
+    return relative_datetime(datetime.timedelta(days=n))
+
+
+def _timeline(ca_workspace, validator, cert, extra_certs):
+    ctx = ca_workspace._build_validation_context()
+    return validator.validity_timeline(
+        cert.cert, ctx.name, ctx.extended_key_usage,
+        extra_certs=[c.cert for c in extra_certs],
+    )
+
+
+def test_timeline_across_rollover(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(
+        not_valid_before=_days(-10), not_valid_after=_days(10)
+    )
+    old = ca_workspace.issue_new_ca(
+        root, not_valid_before=_days(-2), not_valid_after=_days(1)
+    )
+    new = ca_workspace.issue_new_ca(
+        root, key=old.key, serial_number=2,
+        not_valid_before=_days(0.5), not_valid_after=_days(5),
+    )
+    cert = ca_workspace.issue_new_leaf(
+        old, not_valid_before=_days(-1), not_valid_after=_days(2)
+    )
+
+    timeline = _timeline(
+        ca_workspace, X509Validator([root.cert]), cert, [old, new]
+    )
+    assert [list(r) for r in timeline] == [
+        [cert.cert, old.cert, root.cert],
+        [cert.cert, new.cert, root.cert],
+    ]
+    assert [(r.valid_from, r.valid_until) for r in timeline] == [
+        (cert.cert.not_valid_before, old.cert.not_valid_after),
+        (old.cert.not_valid_after, cert.cert.not_valid_after),
+    ]
+
+
+def test_timeline_with_gap(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(
+        not_valid_before=_days(-10), not_valid_after=_days(10)
+    )
+    old = ca_workspace.issue_new_ca(
+        root, not_valid_before=_days(-3), not_valid_after=_days(-2)
+    )
+    new = ca_workspace.issue_new_ca(
+        root, key=old.key, serial_number=2,
+        not_valid_before=_days(-1), not_valid_after=_days(1),
+    )
+    cert = ca_workspace.issue_new_leaf(
+        old, not_valid_before=_days(-4), not_valid_after=_days(4)
+    )
+
+    validator = X509Validator([root.cert])
+    timeline = _timeline(ca_workspace, validator, cert, [old, new])
+    assert [(r.valid_from, r.valid_until, r[1]) for r in timeline] == [
+        (old.cert.not_valid_before, old.cert.not_valid_after, old.cert),
+        (new.cert.not_valid_before, new.cert.not_valid_after, new.cert),
+    ]
+
+    assert _timeline(ca_workspace, validator, cert, []) == []
+
+
+def test_timeline_registered_intermediate(ca_workspace):
+    rollover = _days(1)
+    old_root = ca_workspace.issue_new_trusted_root(
+        not_valid_before=_days(-10), not_valid_after=rollover
+    )
+    new_root = ca_workspace.issue_new_trusted_root(
+        key=old_root.key, serial_number=2,
+        not_valid_before=rollover, not_valid_after=_days(10),
+    )
+    intermediate = ca_workspace.issue_new_ca(
+        old_root, serial_number=3,
+        not_valid_before=_days(-5), not_valid_after=_days(5),
+    )
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, not_valid_before=_days(-1), not_valid_after=_days(2)
+    )
+
+    # The path verified at registration only covers part of the timeline;
+    # the rest goes through the other root.
+    validator = X509Validator([old_root.cert, new_root.cert])
+    validator.register_intermediates([intermediate.cert])
+    expiry = old_root.cert.not_valid_after
+    timeline = _timeline(ca_workspace, validator, cert, [])
+    assert [(r.valid_from, r.valid_until, r.anchor) for r in timeline] == [
+        (cert.cert.not_valid_before, expiry, old_root.cert),
+        (expiry, cert.cert.not_valid_after, new_root.cert),
+    ]
+
+
+def test_timeline_local_copy_of_aia_issuer(ca_workspace, server):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(
+        intermediate, ca_issuers=[server.create_aia_url(intermediate)]
+    )
+
+    # The chain through the local copy is found before AIA is followed, so
+    # it's the one reported, and it didn't need AIA even though an equal
+    # certificate was fetched too.
+    timeline = _timeline(
+        ca_workspace, X509Validator([root.cert]), cert, [intermediate]
+    )
+    assert [list(r) for r in timeline] == [
+        [cert.cert, intermediate.cert, root.cert]
+    ]
+    assert [r.used_aia for r in timeline] == [False]
+    assert timeline[0].aia_fetches == 1
@@ -0,0 +1,185 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+
+from cryptography import x509
+
+import pytest
+
+from validator import ValidationError, X509Validator, _ValidationState
+
+from .utils import relative_datetime
+
+
+def test_update_roots_adds_root(ca_workspace):
+    root = ca_workspace._issue_new_ca()
+    cert = ca_workspace.issue_new_leaf(root)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([])
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ctx)
+
+    validator.update_roots([root.cert])
+    assert validator.roots == (root.cert,)
+    assert validator.validate(cert.cert, ctx) == [cert.cert, root.cert]
+
+
+def test_update_roots_removes_root(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root()
+    cert1 = ca_workspace.issue_new_leaf(root1)
+    cert2 = ca_workspace.issue_new_leaf(root2)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root1.cert, root2.cert])
+    validator.validate(cert1.cert, ctx)
+    validator.validate(cert2.cert, ctx)
+    assert validator._edge_cache.get((cert2.cert, root2.cert)) is True
+
+    validator.update_roots([root2.cert])
+    # Only signature checks made against the removed root are dropped.
+    assert validator._edge_cache.get((cert1.cert, root1.cert)) is None
+    assert validator._edge_cache.get((cert2.cert, root2.cert)) is True
+    with pytest.raises(ValidationError):
+        validator.validate(cert1.cert, ctx)
+    assert validator.validate(cert2.cert, ctx) == [cert2.cert, root2.cert]
+
+
+def test_in_flight_validation_uses_old_roots(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context(extra_certs=[intermediate])
+
+    validator = X509Validator([root.cert])
+    chains = validator._build_chain_from(
+        cert.cert, ctx, 0, _ValidationState(validator._trust_store)
+    )
+    validator.update_roots([])
+
+    assert next(chains) == [cert.cert, intermediate.cert, root.cert]
+    with pytest.raises(ValidationError):
+        validator.validate(cert.cert, ctx)
+
+
+def test_register_intermediates(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root)
+    intermediate2 = ca_workspace.issue_new_ca(intermediate1)
+    untrusted = ca_workspace.issue_new_ca(
+        ca_workspace.issue_new_self_signed()
+    )
+    cert = ca_workspace.issue_new_leaf(intermediate2)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    # Registration order doesn't matter.
+    registered = validator.register_intermediates(
+        [intermediate2.cert, untrusted.cert, intermediate1.cert]
+    )
+    assert set(registered) == {intermediate1.cert, intermediate2.cert}
+    assert validator.register_intermediates([intermediate1.cert]) == []
+
+    assert validator.validate(cert.cert, ctx) == [
+        cert.cert, intermediate2.cert, intermediate1.cert, root.cert
+    ]
+
+
+def test_registered_intermediate_skips_signature_checks(ca_workspace,
+                                                        monkeypatch):
+    root = ca_workspace.issue_new_trusted_root()
+    intermediate = ca_workspace.issue_new_ca(root)
+    cert = ca_workspace.issue_new_leaf(intermediate)
+    ctx = ca_workspace._build_validation_context()
+
+    validator = X509Validator([root.cert])
+    validator.register_intermediates([intermediate.cert])
+    validator._edge_cache.clear()
+
+    verified = []
+    verify_signature = validator._verify_signature
+    monkeypatch.setattr(
+        validator, "_verify_signature",
+        lambda cert, issuer: (
+            verified.append((cert, issuer)) or verify_signature(cert, issuer)
+        )
+    )
+    validator.validate(cert.cert, ctx)
+    assert (cert.cert, intermediate.cert) in verified
+    assert (intermediate.cert, root.cert) not in verified
+
+
+def test_registered_intermediate_context_checks(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root()
+    expired = ca_workspace.issue_new_ca(
+        root,
+        not_valid_before=relative_datetime(-datetime.timedelta(days=2)),
+        not_valid_after=relative_datetime(-datetime.timedelta(days=1)),
+    )
+    client_only = ca_workspace.issue_new_ca(
+        root, extended_key_usages=[x509.ExtendedKeyUsageOID.CLIENT_AUTH]
+    )
+    validator = X509Validator([root.cert])
+    assert len(validator.register_intermediates(
+        [expired.cert, client_only.cert]
+    )) == 2
+
+    with pytest.raises(ValidationError):
+        validator.validate(
+            ca_workspace.issue_new_leaf(expired).cert,
+            ca_workspace._build_validation_context(),
+        )
+    with pytest.raises(ValidationError):
+        validator.validate(
+            ca_workspace.issue_new_leaf(client_only).cert,
+            ca_workspace._build_validation_context(
+                extended_key_usage=x509.ExtendedKeyUsageOID.SERVER_AUTH
+            ),
+        )
+
+
+def test_registered_intermediate_pathlen(ca_workspace):
+    root = ca_workspace.issue_new_trusted_root(path_length=0)
+    intermediate = ca_workspace.issue_new_ca(root)
+
+    validator = X509Validator([root.cert])
+    assert validator.register_intermediates([intermediate.cert]) == []
+
+    root = ca_workspace.issue_new_trusted_root(path_length=1)
+    intermediate1 = ca_workspace.issue_new_ca(root)
+    intermediate2 = ca_workspace.issue_new_ca(intermediate1)
+    cert = ca_workspace.issue_new_leaf(intermediate1)
+
+    validator = X509Validator([root.cert])
+    assert validator.register_intermediates([intermediate1.cert]) == [
+        intermediate1.cert
+    ]
+    assert validator.validate(
+        cert.cert, ca_workspace._build_validation_context()
+    ) == [cert.cert, intermediate1.cert, root.cert]
+    with pytest.raises(ValidationError):
+        validator.validate(
+            ca_workspace.issue_new_leaf(intermediate2).cert,
+            ca_workspace._build_validation_context(
+                extra_certs=[intermediate2]
+            ),
+        )
+
+
+def test_update_roots_reverifies_intermediates(ca_workspace):
+    root1 = ca_workspace.issue_new_trusted_root()
+    root2 = ca_workspace.issue_new_trusted_root()
+    intermediate1 = ca_workspace.issue_new_ca(root1)
+    intermediate2 = ca_workspace.issue_new_ca(root2)
+
+    validator = X509Validator([root1.cert, root2.cert])
+    validator.register_intermediates([intermediate1.cert, intermediate2.cert])
+
+    validator.update_roots([root2.cert])
+    assert validator.intermediates == (intermediate2.cert,)
+    with pytest.raises(ValidationError):
+        validator.validate(
+            ca_workspace.issue_new_leaf(intermediate1).cert,
+            ca_workspace._build_validation_context(),
+        )
@@ -18,3 +18,37 @@ def create_ca_issuer(url):
         x509.AuthorityInformationAccessOID.CA_ISSUERS,
         x509.UniformResourceIdentifier(url)
     )
+
+
+def create_ocsp_responder(url):
+    return x509.AccessDescription(
+        x509.AuthorityInformationAccessOID.OCSP,
+        x509.UniformResourceIdentifier(url)
+    )
+
+
+def encode_oid(dotted_string):
+    arcs = [int(arc) for arc in dotted_string.split(".")]
+    body = bytearray([40 * arcs[0] + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7f))
+            arc >>= 7
+        body.extend(reversed(chunk))
+    return bytes(bytearray([0x06, len(body)]) + body)
+
+
+def replace_oid(data, old, new):
+    """
+    Replace every occurrence of the OID `old` in DER `data` with `new`,
+    which must encode to the same length.
+    """
+    (old, new) = (encode_oid(old), encode_oid(new))
+    assert len(old) == len(new) and old in data
+    return data.replace(old, new)
+
+
+# Not assigned to any signature algorithm.
+UNKNOWN_SIGNATURE_OID = "1.2.840.113549.1.1.99"
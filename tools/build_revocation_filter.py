@@ -0,0 +1,121 @@
+"""
+Build a revocation filter cascade for `X509Validator(revocation_filter=...)`.
+
+    python tools/build_revocation_filter.py --issuers cas.pem \
+        --crl ca1.crl --crl ca2.crl --certs known-certs.pem -o revoked.filter
+
+The cascade is only exact for the certificates it was built over, so it
+records their issuers and when it was built; the validator doesn't consult
+it for other certificates. Every certificate of those issuers issued before
+then should be among `--certs`; one issued later with an earlier notBefore
+may be reported as revoked.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from validator import (  # noqa: E402
+    DisabledFetcher, FilterCascade, X509Validator, _load_crl,
+    revocation_filter_key,
+)
+
+
+_PEM_CERTIFICATE = b"-----BEGIN CERTIFICATE-----"
+
+
+def load_certificates(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if _PEM_CERTIFICATE not in data:
+        return [x509.load_der_x509_certificate(data, default_backend())]
+    return [
+        x509.load_pem_x509_certificate(
+            _PEM_CERTIFICATE + block, default_backend()
+        )
+        for block in data.split(_PEM_CERTIFICATE)[1:]
+    ]
+
+
+def find_crl_issuer(crl, issuers):
+    for issuer in issuers.get(crl.issuer, []):
+        # As in the validator, only a CA allowed to sign CRLs can have
+        # revoked anything.
+        try:
+            key_usage = issuer.extensions.get_extension_for_class(
+                x509.KeyUsage
+            ).value
+        except x509.ExtensionNotFound:
+            continue
+        if not key_usage.crl_sign:
+            continue
+        if crl.is_signature_valid(issuer.public_key()):
+            return issuer
+    return None
+
+
+def find_cert_issuer(cert, issuers, verifier):
+    # Several CAs may share a name, after a key rollover or a cross-sign,
+    # so the certificate has to be checked against each one's key.
+    for issuer in issuers.get(cert.issuer, []):
+        if verifier._can_issue(cert, issuer, 0):
+            return issuer
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--issuers", action="append", default=[],
+                        help="file of CA certificates (PEM or DER)")
+    parser.add_argument("--crl", action="append", default=[],
+                        help="CRL file (PEM or DER)")
+    parser.add_argument("--certs", action="append", default=[],
+                        help="file of known certificates (PEM or DER)")
+    parser.add_argument("--false-positive-rate", type=float, default=0.01)
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args(argv)
+
+    issuers = {}
+    for path in args.issuers:
+        for cert in load_certificates(path):
+            issuers.setdefault(cert.subject, []).append(cert)
+
+    revoked = set()
+    for path in args.crl:
+        with open(path, "rb") as f:
+            crl = _load_crl(f.read())
+        issuer = find_crl_issuer(crl, issuers)
+        if issuer is None:
+            print("No issuer found for {}, skipping".format(path))
+            continue
+        for entry in crl:
+            revoked.add(revocation_filter_key(issuer, entry.serial_number))
+
+    verifier = X509Validator([], fetcher=DisabledFetcher())
+    valid = set()
+    for path in args.certs:
+        for cert in load_certificates(path):
+            issuer = find_cert_issuer(cert, issuers, verifier)
+            if issuer is None:
+                print("No issuer found for a certificate in {}, skipping"
+                      .format(path))
+                continue
+            valid.add(revocation_filter_key(issuer, cert.serial_number))
+
+    cascade = FilterCascade.build(
+        revoked, valid - revoked, args.false_positive_rate
+    )
+    cascade.save(args.output)
+    print("{} revoked, {} valid, {} bytes".format(
+        len(revoked), len(valid - revoked), os.path.getsize(args.output)
+    ))
+
+
+if __name__ == "__main__":
+    main()
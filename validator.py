@@ -1,13 +1,33 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import base64
+import binascii
+import bisect
+import calendar
+import copy
 import datetime
+import gzip
+import hashlib
+import heapq
+import ipaddress
+import itertools
+import json
+import math
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 from cryptography import x509
-from cryptography.exceptions import InvalidSignature
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec, rsa, padding
-
-import requests
+from cryptography.x509 import ocsp
 
 
 # TODO: https://github.com/pyca/cryptography/issues/3745
@@ -18,80 +38,2389 @@ class ValidationError(Exception):
     pass
 
 
-def _build_name_mapping(roots):
-    mapping = {}
-    for root in roots:
-        mapping.setdefault(root.subject, []).append(root)
-    return mapping
+def _build_name_mapping(roots):
+    mapping = {}
+    for root in roots:
+        mapping.setdefault(root.subject, []).append(root)
+    return mapping
+
+
+# Roughly what a short string costs once it's stored in a set or dict: the
+# object itself and its slot in the table.
+_STRING_ENTRY_BYTES = 100
+# Roughly what an empty dict costs.
+_DICT_BYTES = 240
+
+
+class _SubjectAltNameIndex(object):
+    """
+    The DNS names of a subjectAltName extension, split into exact names and
+    the parent domains of wildcard names, so that matching a hostname is a
+    couple of set lookups however many names the certificate carries.
+    """
+
+    def __init__(self, san):
+        self.exact_names = set()
+        self.wildcard_domains = set()
+        for entry in san or []:
+            # TODO: support other name types
+            if not isinstance(entry, x509.DNSName):
+                continue
+            prefix, dot, rest = entry.value.lower().partition(".")
+            if prefix == "*" and dot:
+                self.wildcard_domains.add(rest)
+            else:
+                self.exact_names.add(entry.value.lower())
+
+    def estimated_size(self):
+        return sum(
+            _STRING_ENTRY_BYTES + len(name)
+            for names in (self.exact_names, self.wildcard_domains)
+            for name in names
+        )
+
+    def matches(self, hostname):
+        hostname = hostname.lower()
+        if hostname in self.exact_names:
+            return True
+        _, dot, rest = hostname.partition(".")
+        return bool(dot) and rest in self.wildcard_domains
+
+
+class _DomainTrie(object):
+    """
+    DNS name constraints stored by reversed labels, so checking a hostname
+    takes one dictionary lookup per label however many constraints there are.
+    A constraint of "example.com" matches that name and any name under it,
+    while ".example.com" only matches names under it.
+    """
+
+    _SUBTREE = 1
+    _DESCENDANTS = 2
+
+    def __init__(self, constraints):
+        # Each node maps a label to its child node, and `None` to its flags.
+        self._root = {}
+        self._size = _DICT_BYTES
+        for constraint in constraints:
+            constraint = constraint.lower()
+            if constraint.startswith("."):
+                flag = self._DESCENDANTS
+                constraint = constraint[1:]
+            else:
+                flag = self._SUBTREE
+            node = self._root
+            for label in reversed(constraint.split(".")):
+                if label not in node:
+                    node[label] = {}
+                    self._size += (
+                        _STRING_ENTRY_BYTES + len(label) + _DICT_BYTES
+                    )
+                node = node[label]
+            node[None] = node.get(None, 0) | flag
+
+    def estimated_size(self):
+        return self._size
+
+    def matches(self, hostname):
+        labels = hostname.lower().split(".")
+        node = self._root
+        for remaining in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[remaining])
+            if node is None:
+                return False
+            flags = node.get(None, 0)
+            if flags & self._SUBTREE:
+                return True
+            if flags & self._DESCENDANTS and remaining:
+                return True
+        return False
+
+
+class _CompiledNameConstraints(object):
+    """
+    A NameConstraints extension compiled into one matcher per general name
+    type. Only DNS names have a matcher so far; subtrees of other types are
+    never matched, but still count towards there being permitted subtrees.
+    """
+
+    _MATCHERS = {x509.DNSName: _DomainTrie}
+
+    def __init__(self, nc):
+        self.has_permitted = bool(nc.permitted_subtrees)
+        self.permitted = self._compile(nc.permitted_subtrees or [])
+        self.excluded = self._compile(nc.excluded_subtrees or [])
+
+    def _compile(self, subtrees):
+        return dict(
+            (name_type, matcher(
+                [s.value for s in subtrees if isinstance(s, name_type)]
+            ))
+            for (name_type, matcher) in self._MATCHERS.items()
+        )
+
+    def estimated_size(self):
+        return sum(
+            matcher.estimated_size()
+            for matchers in (self.permitted, self.excluded)
+            for matcher in matchers.values()
+        )
+
+    def permits(self, name):
+        permitted = self.permitted[type(name)]
+        if self.has_permitted and not permitted.matches(name.value):
+            return False
+        return not self.excluded[type(name)].matches(name.value)
+
+
+class _FrequencySketch(object):
+    """
+    A count-min sketch of how often keys have been seen recently, with
+    counters up to 15 which are all halved once ten times as many keys as
+    there are counters in a row have been counted, so that old popularity
+    fades.
+    """
+
+    # Odd multipliers for multiply-shift hashing, one per row.
+    _SEEDS = (
+        0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+        0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+    )
+    _MAX_COUNT = 15
+    _MASK_64 = (1 << 64) - 1
+    # Maps every counter value to half of it, for `bytearray.translate`.
+    _HALVED = bytes(bytearray(i >> 1 for i in range(256)))
+
+    def __init__(self, width_bits):
+        width = 1 << width_bits
+        self._shift = 64 - width_bits
+        self._rows = [bytearray(width) for _ in self._SEEDS]
+        self._additions = 0
+        self._sample_size = 10 * width
+
+    def _indexes(self, key):
+        h = hash(key) & self._MASK_64
+        mask = self._MASK_64
+        shift = self._shift
+        return [((h * seed) & mask) >> shift for seed in self._SEEDS]
+
+    def increment(self, key, count=1):
+        for row, i in zip(self._rows, self._indexes(key)):
+            row[i] = min(row[i] + count, self._MAX_COUNT)
+        self._additions += count
+        while self._additions >= self._sample_size:
+            self._rows = [row.translate(self._HALVED) for row in self._rows]
+            self._additions //= 2
+
+    def estimate(self, key):
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+
+class _CacheManager(object):
+    """
+    Holds the entries of all of a validator's caches within one budget of
+    `max_bytes`, as estimated by each cache's entry size. New entries go to
+    a small LRU window; an entry leaving the window is only admitted to the
+    main LRU space (split into probation and protected segments) if it has
+    been used more often than the entry it would evict (W-TinyLFU), so a
+    one-off scan can't flush out entries that are in steady use.
+
+    Hits don't take the lock: they are recorded in a buffer which is
+    replayed into the frequency sketch and LRU order in a batch, when it's
+    full and the lock is free, or on the next insertion. A read lost to a
+    race only makes the counts a little less exact.
+    """
+
+    _WINDOW_FRACTION = 0.01
+    _PROTECTED_FRACTION = 0.8
+    # The frequency sketch gets a counter per row for about every this many
+    # bytes of budget, within the bounds on its width.
+    _SKETCH_BYTES_PER_COUNTER = 128
+    _SKETCH_WIDTH_BITS = (12, 20)
+    _READ_BUFFER_SIZE = 64
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._window_max = int(max_bytes * self._WINDOW_FRACTION)
+        self._main_max = max_bytes - self._window_max
+        self._protected_max = int(self._main_max * self._PROTECTED_FRACTION)
+        self._window = OrderedDict()
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._window_bytes = 0
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        # Only created on the first insertion, so that validators which
+        # never cache anything are cheap to construct.
+        self._sketch = None
+        # Every entry, whichever segment it's in, for lock-free lookups.
+        self._entries = {}
+        self._reads = []
+        self._lock = threading.Lock()
+        self.caches = OrderedDict()
+
+    def _create_sketch(self):
+        (low, high) = self._SKETCH_WIDTH_BITS
+        counters = self.max_bytes // self._SKETCH_BYTES_PER_COUNTER
+        width_bits = max(0, counters - 1).bit_length()
+        return _FrequencySketch(max(low, min(high, width_bits)))
+
+    def cache(self, name, entry_size):
+        cache = _ManagedCache(self, name, entry_size)
+        self.caches[name] = cache
+        return cache
+
+    def get(self, cache, key, default):
+        full_key = (cache.name, key)
+        entry = self._entries.get(full_key)
+        if entry is None:
+            cache.misses += 1
+            return default
+        cache.hits += 1
+        reads = self._reads
+        reads.append(full_key)
+        if len(reads) >= self._READ_BUFFER_SIZE and self._lock.acquire(False):
+            try:
+                self._replay_reads()
+            finally:
+                self._lock.release()
+        return entry[0]
+
+    def _replay_reads(self):
+        (reads, self._reads) = (self._reads, [])
+        # Warm workloads hit the same few keys over and over, so each key
+        # is only counted and moved once per batch, in order of last use.
+        batch = {}
+        for (i, full_key) in enumerate(reads):
+            read = batch.get(full_key)
+            if read is None:
+                batch[full_key] = [i, 1]
+            else:
+                read[0] = i
+                read[1] += 1
+        for (_, count, full_key) in sorted(
+            (i, count, full_key) for (full_key, (i, count)) in batch.items()
+        ):
+            self._sketch.increment(full_key, count)
+            if full_key in self._window:
+                self._window[full_key] = self._window.pop(full_key)
+            elif full_key in self._protected:
+                self._protected[full_key] = self._protected.pop(full_key)
+            elif full_key in self._probation:
+                entry = self._probation.pop(full_key)
+                self._probation_bytes -= entry[1]
+                self._protected[full_key] = entry
+                self._protected_bytes += entry[1]
+                self._demote_protected()
+
+    def set(self, cache, key, value, size):
+        full_key = (cache.name, key)
+        with self._lock:
+            if self._sketch is None:
+                self._sketch = self._create_sketch()
+            self._replay_reads()
+            self._sketch.increment(full_key)
+            self._remove(full_key)
+            if size > self._main_max:
+                # It would never be admitted, however many entries were
+                # evicted for it.
+                return
+            entry = (value, size, cache)
+            self._window[full_key] = entry
+            self._entries[full_key] = entry
+            self._window_bytes += size
+            cache.entries += 1
+            cache.bytes += size
+            while self._window and self._window_bytes > self._window_max:
+                (candidate_key, candidate) = self._window.popitem(last=False)
+                self._window_bytes -= candidate[1]
+                self._admit(candidate_key, candidate)
+
+    def discard_if(self, cache, predicate):
+        with self._lock:
+            for segment in (self._window, self._probation, self._protected):
+                for full_key in [
+                    k for k in segment
+                    if k[0] == cache.name and predicate(k[1])
+                ]:
+                    self._remove(full_key)
+
+    def _admit(self, key, entry):
+        size = entry[1]
+        frequency = self._sketch.estimate(key)
+        while self._probation_bytes + self._protected_bytes + size > (
+            self._main_max
+        ):
+            segment = self._probation or self._protected
+            if not segment:
+                victim_key = None
+            else:
+                victim_key = next(iter(segment))
+            if (
+                victim_key is None or
+                self._sketch.estimate(victim_key) >= frequency
+            ):
+                self._forget(key, entry)
+                return
+            self._remove(victim_key)
+        self._probation[key] = entry
+        self._probation_bytes += size
+
+    def _demote_protected(self):
+        while self._protected_bytes > self._protected_max:
+            (key, entry) = self._protected.popitem(last=False)
+            self._protected_bytes -= entry[1]
+            self._probation[key] = entry
+            self._probation_bytes += entry[1]
+
+    def _remove(self, full_key):
+        for segment, attribute in (
+            (self._window, "_window_bytes"),
+            (self._probation, "_probation_bytes"),
+            (self._protected, "_protected_bytes"),
+        ):
+            entry = segment.pop(full_key, None)
+            if entry is not None:
+                setattr(self, attribute, getattr(self, attribute) - entry[1])
+                self._forget(full_key, entry)
+                return
+
+    def _forget(self, full_key, entry):
+        del self._entries[full_key]
+        (_, size, cache) = entry
+        cache.entries -= 1
+        cache.bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                (name, cache._stats()) for name, cache in self.caches.items()
+            )
+
+
+class _ManagedCache(object):
+    """
+    One kind of cache entry within a `_CacheManager`, all estimated to take
+    `entry_size` bytes unless given a size.
+    """
+
+    def __init__(self, manager, name, entry_size):
+        self._manager = manager
+        self.name = name
+        self.entry_size = entry_size
+        self.entries = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.entries
+
+    def get(self, key, default=None):
+        return self._manager.get(self, key, default)
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = self.entry_size
+        self._manager.set(self, key, value, size)
+
+    def discard_if(self, predicate):
+        self._manager.discard_if(self, predicate)
+
+    def clear(self):
+        self.discard_if(lambda key: True)
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+_INTERN_CACHE_BYTES = 8 * 1024 * 1024
+# Roughly what a parsed certificate costs beyond its DER encoding.
+_CERTIFICATE_OVERHEAD = 1024
+# Maps the SHA-256 digest of a DER encoded certificate to the parsed
+# certificate, shared by every validator and validation context, so it has
+# its own budget rather than one validator's `cache_bytes`. Certificates
+# can't be weakly referenced, so instead of a weak cache this keeps the ones
+# which are used most.
+_interned_certificates = _CacheManager(_INTERN_CACHE_BYTES).cache(
+    "certificates", None
+)
+
+
+def set_certificate_cache_bytes(cache_bytes):
+    """
+    Set the memory budget of the cache of certificates parsed from DER,
+    which every validator and validation context share (8 MiB by default).
+    The certificates cached so far are dropped.
+    """
+    global _interned_certificates
+    _interned_certificates = _CacheManager(cache_bytes).cache(
+        "certificates", None
+    )
+
+
+def _load_der_certificate(data):
+    """
+    Parse a DER encoded certificate, returning the same object for identical
+    bytes for as long as it stays cached, so that its metadata is only
+    computed once too.
+    """
+    data = bytes(data)
+    key = hashlib.sha256(data).digest()
+    cert = _interned_certificates.get(key)
+    if cert is None:
+        cert = x509.load_der_x509_certificate(data, default_backend())
+        _interned_certificates.set(
+            key, cert, len(data) + _CERTIFICATE_OVERHEAD
+        )
+    return cert
+
+
+def _as_certificate(cert):
+    if isinstance(cert, x509.Certificate):
+        return cert
+    return _load_der_certificate(cert)
+
+
+def _get_extension_value(cert, extension_class):
+    try:
+        return cert.extensions.get_extension_for_class(extension_class).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+class _CertificateInfo(object):
+    """
+    The parts of a certificate that validation looks at, parsed once.
+    Extensions which aren't present are `None`.
+    """
+
+    def __init__(self, cert):
+        self.not_valid_before = cert.not_valid_before
+        self.not_valid_after = cert.not_valid_after
+        self.public_key = cert.public_key()
+        self.critical_extensions = tuple(
+            ext.oid for ext in cert.extensions if ext.critical
+        )
+        self.basic_constraints = _get_extension_value(
+            cert, x509.BasicConstraints
+        )
+        self.key_usage = _get_extension_value(cert, x509.KeyUsage)
+        self.extended_key_usage = _get_extension_value(
+            cert, x509.ExtendedKeyUsage
+        )
+        self.name_constraints = _get_extension_value(
+            cert, x509.NameConstraints
+        )
+        # Only needed for leaves and for CAs respectively, so built on first
+        # use.
+        self.san_index = None
+        self.compiled_name_constraints = None
+        self.key_id = None
+        self.ocsp_key_hash = None
+
+
+class _VerifiedIntermediate(object):
+    """
+    A registered intermediate together with the path to a root that was
+    verified for it at registration time, and a summary of everything about
+    that path which still has to be checked against a validation context.
+    """
+
+    def __init__(self, path, infos):
+        self.cert = path[0]
+        self.path = tuple(path)
+        self.anchor = path[-1]
+        self.not_valid_before = max(i.not_valid_before for i in infos)
+        self.not_valid_after = min(i.not_valid_after for i in infos)
+        self.path_lengths = tuple(
+            i.basic_constraints.path_length for i in infos
+        )
+        self.extended_key_usages = tuple(
+            i.extended_key_usage for i in infos
+        )
+        self.name_constrained = tuple(
+            c for (c, i) in zip(path, infos)
+            if i.name_constraints is not None
+        )
+
+
+_monotonic = getattr(time, "monotonic", time.time)
+_store_generations = itertools.count()
+
+
+class _TrustStore(object):
+    """
+    An immutable snapshot of the trusted roots and registered intermediates.
+    Validations hold on to the snapshot they started with, so swapping in a
+    new one never affects in-flight work. Every snapshot has a distinct
+    `generation`, for caches which depend on its contents.
+    """
+
+    def __init__(self, roots):
+        self.roots = tuple(roots)
+        self.roots_by_name = _build_name_mapping(self.roots)
+        self._root_set = frozenset(self.roots)
+        self.intermediates = {}
+        self.intermediates_by_name = {}
+        self.generation = next(_store_generations)
+
+    @property
+    def shared_generation(self):
+        """
+        The generation of the store this one shares its base contents with:
+        its own, or for an overlay, its base's.
+        """
+        return self.generation
+
+    def __contains__(self, cert):
+        return cert in self._root_set
+
+    @property
+    def own_intermediates(self):
+        """
+        The intermediates registered with this store itself, rather than
+        with a store it overlays.
+        """
+        return self.intermediates
+
+    def with_intermediate(self, record):
+        store = copy.copy(self)
+        store.generation = next(_store_generations)
+        store.intermediates = dict(self.intermediates)
+        store.intermediates[record.cert] = record
+        name = record.cert.subject
+        store.intermediates_by_name = dict(self.intermediates_by_name)
+        store.intermediates_by_name[name] = (
+            self.intermediates_by_name.get(name, []) + [record.cert]
+        )
+        return store
+
+
+class _OverlayNameIndex(object):
+    """
+    Looks names up in a base index, skipping certificates for which
+    `is_distrusted` is true (if it's given), and then in an overlay's own
+    index.
+    """
+
+    def __init__(self, base, own, is_distrusted=None):
+        self._base = base
+        self._own = own
+        self._is_distrusted = is_distrusted
+
+    def get(self, name, default=None):
+        certs = self._base.get(name, [])
+        if self._is_distrusted is not None:
+            certs = [c for c in certs if not self._is_distrusted(c)]
+        certs = certs + self._own.get(name, [])
+        return certs if certs else default
+
+
+class _OverlayIntermediates(object):
+    """
+    The registered intermediates of a base store whose path doesn't end at
+    a distrusted root, and an overlay's own.
+    """
+
+    def __init__(self, base, own, distrusted):
+        self._base = base
+        self._own = own
+        self._distrusted = distrusted
+
+    def get(self, cert, default=None):
+        record = self._own.get(cert)
+        if record is None:
+            record = self._base.get(cert)
+            if record is None or record.anchor in self._distrusted:
+                return default
+        return record
+
+    def __contains__(self, cert):
+        return self.get(cert) is not None
+
+    def values(self):
+        for record in self._base.values():
+            if record.anchor not in self._distrusted:
+                yield record
+        for record in self._own.values():
+            yield record
+
+    def __iter__(self):
+        return (record.cert for record in self.values())
+
+
+class _OverlayTrustStore(_TrustStore):
+    """
+    A lightweight trust store layered over a `base` store (a snapshot of
+    another validator's store): the base's roots except for `distrusted`
+    ones, plus `roots`. Only the overlay's own roots and registered
+    intermediates are stored, so overlays don't grow with the base.
+    """
+
+    def __init__(self, base, roots, distrusted):
+        self.base = base
+        self.added_roots = tuple(roots)
+        self.distrusted = frozenset(distrusted)
+        self._added_root_set = frozenset(self.added_roots)
+        self._own_roots_by_name = _build_name_mapping(self.added_roots)
+        self._own_intermediates = {}
+        self._own_intermediates_by_name = {}
+        self.generation = next(_store_generations)
+        self._build_indexes()
+
+    @property
+    def shared_generation(self):
+        return self.base.shared_generation
+
+    def _build_indexes(self):
+        # The base's indexes are used as they are, and distrust is checked
+        # per lookup, so an overlay costs the same however big its base is.
+        distrusted = self.distrusted
+        base_intermediates = self.base.intermediates
+        self.roots_by_name = _OverlayNameIndex(
+            self.base.roots_by_name, self._own_roots_by_name,
+            distrusted.__contains__ if distrusted else None,
+        )
+        self.intermediates = _OverlayIntermediates(
+            base_intermediates, self._own_intermediates, distrusted
+        )
+        self.intermediates_by_name = _OverlayNameIndex(
+            self.base.intermediates_by_name,
+            self._own_intermediates_by_name,
+            (
+                lambda cert: base_intermediates.get(cert).anchor in distrusted
+            ) if distrusted else None,
+        )
+
+    @property
+    def roots(self):
+        return tuple(
+            r for r in self.base.roots if r not in self.distrusted
+        ) + self.added_roots
+
+    @property
+    def _root_set(self):
+        return frozenset(self.roots)
+
+    @property
+    def own_intermediates(self):
+        return self._own_intermediates
+
+    def __contains__(self, cert):
+        return cert in self._added_root_set or (
+            cert in self.base and cert not in self.distrusted
+        )
+
+    def with_intermediate(self, record):
+        store = copy.copy(self)
+        store.generation = next(_store_generations)
+        store._own_intermediates = dict(self._own_intermediates)
+        store._own_intermediates[record.cert] = record
+        name = record.cert.subject
+        store._own_intermediates_by_name = dict(
+            self._own_intermediates_by_name
+        )
+        store._own_intermediates_by_name[name] = (
+            self._own_intermediates_by_name.get(name, []) + [record.cert]
+        )
+        store._build_indexes()
+        return store
+
+
+class _ValidationState(object):
+    """
+    Per-validation bookkeeping: the trust store snapshot the validation runs
+    against and what it has cost so far.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.signature_checks = 0
+        self.aia_fetches = 0
+        # Maps id(cert) to the certificates fetched through AIA. A chain used
+        # AIA if it holds one of these objects: a local copy of the same
+        # certificate is a different object, and wasn't fetched.
+        self.aia_certs = {}
+        self.ocsp_fetches = 0
+        self.follow_aia = True
+        # Maps (cert, issuer) to the future of a signature check which was
+        # started speculatively.
+        self.pending_signatures = {}
+        # Maps id(cert) to (cert, info) for the `_CertificateInfo`s looked up
+        # so far, so each certificate only goes through the shared cache once
+        # per validation. Keyed by identity since hashing a certificate
+        # hashes its whole encoding.
+        self.infos = {}
+
+
+class ValidationResult(list):
+    """
+    The chain returned by `X509Validator.validate`, from the leaf to the
+    trusted root. It can be used as a plain list of certificates, and also
+    records the window during which the whole chain is valid, so callers can
+    cache the decision until `valid_until`, and what it cost to build.
+    """
+
+    def __init__(self, chain, anchor, valid_from, valid_until, used_aia,
+                 signature_checks, aia_fetches, ocsp_fetches=0):
+        super(ValidationResult, self).__init__(chain)
+        self.anchor = anchor
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+        self.used_aia = used_aia
+        self.signature_checks = signature_checks
+        self.aia_fetches = aia_fetches
+        self.ocsp_fetches = ocsp_fetches
+
+
+# Serial numbers are at most 20 octets (RFC 5280, section 4.1.2.2).
+_SERIAL_NUMBER_LENGTH = 20
+
+
+def _encode_serial_number(serial_number):
+    if not 0 <= serial_number < 1 << (8 * _SERIAL_NUMBER_LENGTH):
+        return None
+    return binascii.unhexlify(
+        "{:0{}x}".format(serial_number, 2 * _SERIAL_NUMBER_LENGTH)
+    )
+
+
+class _MappedSerialSet(object):
+    """
+    The revoked serial numbers of one CRL, as a sorted array of fixed-width
+    records in a memory-mapped file, for CRLs too large to keep in memory as
+    a set. Membership is a binary search over the mapping.
+    """
+
+    def __init__(self, path, others=frozenset()):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = len(self._mmap) // _SERIAL_NUMBER_LENGTH
+        # Serial numbers which don't fit in a record (negative or oversized
+        # ones, from non-conforming CAs).
+        self._others = others
+
+    @classmethod
+    def create(cls, path, serial_numbers):
+        records = []
+        others = set()
+        for serial_number in serial_numbers:
+            record = _encode_serial_number(serial_number)
+            if record is None:
+                others.add(serial_number)
+            else:
+                records.append(record)
+        if not records:
+            # Nothing to map; empty mappings fail on some platforms.
+            return frozenset(others)
+        records.sort()
+        with open(path, "wb") as f:
+            f.write(b"".join(records))
+        return cls(path, frozenset(others))
+
+    def discard(self):
+        """
+        Delete the file once the set has been superseded. Validations which
+        are still using the set keep their mapping, which is closed when the
+        last of them lets go of it.
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _record(self, i):
+        start = i * _SERIAL_NUMBER_LENGTH
+        return self._mmap[start:start + _SERIAL_NUMBER_LENGTH]
+
+    def __contains__(self, serial_number):
+        needle = _encode_serial_number(serial_number)
+        if needle is None:
+            return serial_number in self._others
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle) < needle:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self._count and self._record(low) == needle
+
+
+def _load_crl(data):
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_crl(data, default_backend())
+    return x509.load_der_x509_crl(data, default_backend())
+
+
+def _spki_digest(public_key):
+    return hashlib.sha256(public_key.public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )).digest()
+
+
+# The length of the issuer key id at the start of revocation filter keys.
+_FILTER_ISSUER_KEY_ID_LENGTH = 32
+
+
+def _revocation_filter_key(issuer_key_id, serial_number):
+    return issuer_key_id + str(serial_number).encode("ascii")
+
+
+def revocation_filter_key(issuer, serial_number):
+    """
+    The key under which a `FilterCascade` records the certificate with
+    `serial_number` issued by the `issuer` certificate.
+    """
+    return _revocation_filter_key(
+        _spki_digest(issuer.public_key()), serial_number
+    )
+
+
+class _BloomFilter(object):
+    _HEADER = struct.Struct(">QB")
+
+    def __init__(self, level, num_bits, num_hashes, bits, offset=0):
+        self._level = struct.pack(">B", level)
+        self._num_bits = num_bits
+        self._num_hashes = num_hashes
+        # The bits may live in a larger (possibly memory-mapped) buffer,
+        # starting at `offset`.
+        self._bits = bits
+        self._offset = offset
+
+    @classmethod
+    def create(cls, level, keys, false_positive_rate):
+        count = max(len(keys), 1)
+        num_bits = max(int(math.ceil(
+            -count * math.log(false_positive_rate) / math.log(2) ** 2
+        )), 8)
+        num_hashes = max(int(round(num_bits / count * math.log(2))), 1)
+        bloom = cls(
+            level, num_bits, num_hashes, bytearray((num_bits + 7) // 8)
+        )
+        for key in keys:
+            for index in bloom._indexes(key):
+                bloom._bits[index // 8] |= 1 << (index % 8)
+        return bloom
+
+    @classmethod
+    def from_buffer(cls, level, buf, offset):
+        (num_bits, num_hashes) = cls._HEADER.unpack_from(buf, offset)
+        start = offset + cls._HEADER.size
+        end = start + (num_bits + 7) // 8
+        return cls(level, num_bits, num_hashes, buf, start), end
+
+    def to_bytes(self):
+        start = self._offset
+        return (
+            self._HEADER.pack(self._num_bits, self._num_hashes) +
+            bytes(self._bits[start:start + (self._num_bits + 7) // 8])
+        )
+
+    def _indexes(self, key):
+        digest = hashlib.sha256(self._level + key).digest()
+        (h1, h2) = struct.unpack(">QQ", digest[:16])
+        for i in range(self._num_hashes):
+            yield (h1 + i * h2) % self._num_bits
+
+    def __contains__(self, key):
+        bits = self._bits
+        for index in self._indexes(key):
+            i = self._offset + index // 8
+            if not ord(bits[i:i + 1]) & (1 << (index % 8)):
+                return False
+        return True
+
+
+class FilterCascade(object):
+    """
+    A cascade of Bloom filters recording which of a known set of
+    certificates are revoked, in the manner of CRLite. The first level holds
+    the revoked keys, and each further level holds the keys of the other set
+    which the previous level wrongly matched, until none are left. Lookups
+    therefore have no false positives or negatives for the certificates the
+    cascade was built over; certificates outside that set may be reported as
+    revoked.
+
+    So the cascade also records which issuers it was built for and when.
+    Like CRLite, the validator only consults it for certificates it
+    `covers`: ones from those issuers which were issued before it was built.
+    CRLite takes the issuance time from Certificate Transparency; here it is
+    the certificate's notBefore, which the issuer chooses. A certificate
+    issued later with a backdated notBefore is still consulted, and so may
+    be wrongly reported as revoked (never wrongly as not revoked: the
+    cascade only ever rejects).
+
+    Keys come from `revocation_filter_key`.
+    """
+
+    _MAGIC = b"X5F2"
+    _HEADER = struct.Struct(">4sBQI")
+    _ISSUER_HEADER = struct.Struct(">B")
+
+    def __init__(self, levels, issuers, timestamp):
+        self._levels = levels
+        self.issuers = frozenset(issuers)
+        # In seconds since the epoch.
+        self.timestamp = timestamp
+
+    @classmethod
+    def build(cls, revoked, valid, false_positive_rate=0.01, timestamp=None):
+        """
+        Build a cascade from the keys of the revoked and of the not revoked
+        certificates. `false_positive_rate` is used for the first level;
+        later levels use 0.5, which gives the smallest cascades.
+
+        The cascade covers the issuers of all the keys, for certificates
+        issued up to `timestamp` (a naive UTC datetime, by default now).
+        """
+        include = set(revoked)
+        exclude = set(valid) - include
+        issuers = set(
+            key[:_FILTER_ISSUER_KEY_ID_LENGTH] for key in include | exclude
+        )
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow()
+        levels = []
+        while include:
+            bloom = _BloomFilter.create(
+                len(levels), include,
+                false_positive_rate if not levels else 0.5,
+            )
+            levels.append(bloom)
+            include, exclude = set(k for k in exclude if k in bloom), include
+        return cls(levels, issuers, _to_epoch_seconds(timestamp))
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, count, timestamp, num_issuers) = cls._HEADER.unpack_from(
+            data, 0
+        )
+        if magic != cls._MAGIC:
+            raise ValueError("Not a filter cascade")
+        offset = cls._HEADER.size
+        issuers = []
+        for _ in range(num_issuers):
+            (length,) = cls._ISSUER_HEADER.unpack_from(data, offset)
+            offset += cls._ISSUER_HEADER.size
+            issuers.append(bytes(data[offset:offset + length]))
+            offset += length
+        levels = []
+        for level in range(count):
+            bloom, offset = _BloomFilter.from_buffer(level, data, offset)
+            levels.append(bloom)
+        return cls(levels, issuers, timestamp)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a cascade written by `save`. The file is memory-mapped rather
+        than read.
+        """
+        with open(path, "rb") as f:
+            return cls.from_bytes(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+
+    def to_bytes(self):
+        return self._HEADER.pack(
+            self._MAGIC, len(self._levels), self.timestamp, len(self.issuers)
+        ) + b"".join(
+            self._ISSUER_HEADER.pack(len(issuer)) + issuer
+            for issuer in sorted(self.issuers)
+        ) + b"".join(
+            level.to_bytes() for level in self._levels
+        )
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    def covers(self, issuer_key_id, not_valid_before):
+        """
+        Whether the cascade was built over the certificates of the issuer
+        with `issuer_key_id` valid from the naive UTC `not_valid_before`.
+        This trusts the issuer not to backdate certificates.
+        """
+        return (
+            issuer_key_id in self.issuers and
+            _to_epoch_seconds(not_valid_before) <= self.timestamp
+        )
+
+    def __contains__(self, key):
+        for (i, level) in enumerate(self._levels):
+            if key not in level:
+                return i % 2 == 1
+        return len(self._levels) % 2 == 1
+
+
+def _to_epoch_seconds(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+_KEY_TYPE_UNSUPPORTED = 0
+_KEY_TYPE_RSA = 1
+_KEY_TYPE_EC = 2
+
+_EKU_BITS = 64
+
+
+class CertificatePool(object):
+    """
+    A large pool of candidate intermediates, stored column-wise in NumPy
+    arrays so that the cheap issuer checks (validity period, EKU, key type
+    and size, CA and keyCertSign flags, path length, subject) can be run over
+    the whole pool in one vectorized operation. It's a pre-filter: the
+    certificates that survive still go through the full issuer checks,
+    including their signatures. Requires NumPy.
+    """
+
+    def __init__(self, certs):
+        import numpy
+        self._np = numpy
+
+        self.certs = list(certs)
+        self._eku_bits = {ANY_EXTENDED_KEY_USAGE_OID: 1}
+        rows = [self._build_row(cert) for cert in self.certs]
+        (
+            not_before, not_after, key_types, key_sizes, supported_critical,
+            ca, key_cert_sign, path_lengths, ekus, subject_hashes,
+        ) = zip(*rows) if rows else [()] * 10
+
+        self._not_before = numpy.array(not_before, dtype=numpy.int64)
+        self._not_after = numpy.array(not_after, dtype=numpy.int64)
+        self._key_types = numpy.array(key_types, dtype=numpy.int8)
+        self._key_sizes = numpy.array(key_sizes, dtype=numpy.int32)
+        self._supported_critical = numpy.array(
+            supported_critical, dtype=bool
+        )
+        self._ca = numpy.array(ca, dtype=bool)
+        self._key_cert_sign = numpy.array(key_cert_sign, dtype=bool)
+        # -1 means there's no path length constraint.
+        self._path_lengths = numpy.array(path_lengths, dtype=numpy.int32)
+        self._ekus = numpy.array(ekus, dtype=numpy.uint64)
+        self._subject_hashes = numpy.array(subject_hashes, dtype=numpy.int64)
+
+        # All certificates without a time or EKU dependency pass or fail
+        # together, so that part is computed once.
+        self._static_mask = (
+            (
+                ((self._key_types == _KEY_TYPE_RSA) &
+                 (self._key_sizes >= 2048)) |
+                (self._key_types == _KEY_TYPE_EC)
+            ) &
+            self._supported_critical & self._ca & self._key_cert_sign
+        )
+        self._last_screen = (None, None)
+
+    def __len__(self):
+        return len(self.certs)
+
+    def _eku_bit(self, oid):
+        if oid not in self._eku_bits:
+            # Past the last bit usages share it, which can only let extra
+            # certificates through the screen.
+            self._eku_bits[oid] = 1 << min(
+                len(self._eku_bits), _EKU_BITS - 1
+            )
+        return self._eku_bits[oid]
+
+    def _build_row(self, cert):
+        key = cert.public_key()
+        if isinstance(key, rsa.RSAPublicKey):
+            key_type, key_size = _KEY_TYPE_RSA, key.key_size
+        elif (
+            isinstance(key, ec.EllipticCurvePublicKey) and
+            type(key.curve) in _SUPPORTED_CURVES
+        ):
+            key_type, key_size = _KEY_TYPE_EC, key.curve.key_size
+        else:
+            key_type, key_size = _KEY_TYPE_UNSUPPORTED, 0
+
+        basic_constraints = _get_extension_value(cert, x509.BasicConstraints)
+        if (
+            basic_constraints is None or
+            basic_constraints.path_length is None
+        ):
+            path_length = -1
+        else:
+            path_length = basic_constraints.path_length
+        ku = _get_extension_value(cert, x509.KeyUsage)
+        eku = _get_extension_value(cert, x509.ExtendedKeyUsage)
+        if eku is None:
+            eku_bits = (1 << _EKU_BITS) - 1
+        else:
+            eku_bits = 0
+            for oid in eku:
+                eku_bits |= self._eku_bit(oid)
+
+        return (
+            _to_epoch_seconds(cert.not_valid_before),
+            _to_epoch_seconds(cert.not_valid_after),
+            key_type,
+            key_size,
+            all(
+                ext.oid in _SUPPORTED_EXTENSIONS
+                for ext in cert.extensions if ext.critical
+            ),
+            basic_constraints is not None and basic_constraints.ca,
+            ku is not None and ku.key_cert_sign,
+            path_length,
+            eku_bits,
+            hash(cert.subject),
+        )
+
+    def _screen(self, timestamp, extended_key_usage):
+        key = (timestamp, extended_key_usage)
+        (last_key, mask) = self._last_screen
+        if last_key == key:
+            return mask
+
+        np = self._np
+        mask = self._static_mask
+        if timestamp is not _ANY_TIME:
+            seconds = _to_epoch_seconds(timestamp)
+            mask = mask & (
+                (self._not_before <= seconds) & (self._not_after >= seconds)
+            )
+        if extended_key_usage is not _ANY_PURPOSE:
+            eku_bits = self._eku_bits[ANY_EXTENDED_KEY_USAGE_OID]
+            try:
+                eku_bits |= self._eku_bits.get(extended_key_usage, 0)
+            except TypeError:
+                # Not an OID, so it can only be satisfied by
+                # anyExtendedKeyUsage.
+                pass
+            mask = mask & ((self._ekus & np.uint64(eku_bits)) != 0)
+        self._last_screen = (key, mask)
+        return mask
+
+    def screen(self, ctx, depth=None):
+        """
+        Return the certificates which could act as an issuer under `ctx`,
+        at `depth` if it's given.
+        """
+        mask = self._screen(ctx.timestamp, ctx.extended_key_usage)
+        if depth is not None:
+            mask = mask & (
+                (self._path_lengths < 0) | (self._path_lengths >= depth)
+            )
+        return [self.certs[i] for i in self._np.flatnonzero(mask)]
+
+    def _find_issuers(self, name, ctx):
+        mask = self._screen(ctx.timestamp, ctx.extended_key_usage) & (
+            self._subject_hashes == hash(name)
+        )
+        return [
+            self.certs[i] for i in self._np.flatnonzero(mask)
+            if self.certs[i].subject == name
+        ]
+
+
+class _OCSPStatus(object):
+    """
+    The outcome of a verified OCSP response, kept until its nextUpdate.
+    """
+
+    def __init__(self, digest, status, this_update, next_update):
+        self.digest = digest
+        self.status = status
+        self.this_update = this_update
+        self.next_update = next_update
+
+    def is_current(self, timestamp):
+        return self.this_update <= timestamp and (
+            self.next_update is None or timestamp <= self.next_update
+        )
+
+
+def _load_ocsp_response(data):
+    """
+    Returns the `(issuer key hash, serial number)` the response is about
+    together with the response, or `None` if it isn't usable.
+    """
+    try:
+        response = ocsp.load_der_ocsp_response(data)
+        if (
+            response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL or
+            not isinstance(response.hash_algorithm, hashes.SHA1)
+        ):
+            return None
+    except (ValueError, UnsupportedAlgorithm):
+        return None
+    return (response.issuer_key_hash, response.serial_number), response
+
+
+class RequestsFetcher(object):
+    """
+    Fetches AIA and OCSP URLs with `requests`, which is only imported, and
+    the session only created, on the first fetch.
+
+    Any object with the same `get(url)` and `post(url, data, content_type)`
+    methods can be passed as `X509Validator(roots, fetcher=...)`; both
+    return the response body, or None if the request failed or didn't
+    return a 200.
+    """
+
+    def __init__(self, timeout=10):
+        self._timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.session()
+            return self._session
+
+    def _request(self, method, url, **kwargs):
+        import requests
+
+        try:
+            response = self._get_session().request(
+                method, url, timeout=self._timeout, **kwargs
+            )
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.content
+
+    def get(self, url):
+        return self._request("GET", url)
+
+    def post(self, url, data, content_type):
+        return self._request(
+            "POST", url, data=data, headers={"Content-Type": content_type}
+        )
+
+
+class UrllibFetcher(object):
+    """
+    Fetches AIA and OCSP URLs with the standard library only.
+    """
+
+    def __init__(self, timeout=10):
+        self._timeout = timeout
+
+    def _request(self, url, data=None, headers={}):
+        try:
+            from urllib.request import Request, urlopen
+            from urllib.error import URLError
+        except ImportError:
+            from urllib2 import Request, URLError, urlopen
+
+        try:
+            response = urlopen(
+                Request(url, data=data, headers=headers),
+                timeout=self._timeout
+            )
+            try:
+                if response.getcode() != 200:
+                    return None
+                return response.read()
+            finally:
+                response.close()
+        except (URLError, EnvironmentError, ValueError):
+            return None
+
+    def get(self, url):
+        return self._request(url)
+
+    def post(self, url, data, content_type):
+        return self._request(url, data, {"Content-Type": content_type})
+
+
+class DisabledFetcher(object):
+    """
+    Never goes to the network: chains are only built from local
+    certificates, and OCSP only uses stapled responses.
+    """
+
+    def get(self, url):
+        return None
+
+    def post(self, url, data, content_type):
+        return None
+
+
+class StaticFetcher(object):
+    """
+    Serves fixed responses: `responses` maps URLs to GET response bodies,
+    and (URL, request body) pairs to POST response bodies. Every request is
+    appended to `requests`, as a URL or a pair.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url):
+        self.requests.append(url)
+        return self.responses.get(url)
+
+    def post(self, url, data, content_type):
+        self.requests.append((url, data))
+        return self.responses.get((url, data))
+
+
+class ValidationContext(object):
+    def __init__(self, name, extended_key_usage, extra_certs=[],
+                 candidate_pool=None, ocsp_responses=[]):
+        """
+        `candidate_pool` is an optional `CertificatePool` of further
+        intermediates, for when there are too many of them for `extra_certs`.
+        `ocsp_responses` are DER encoded OCSP responses stapled by the peer,
+        for any of the certificates in the chain.
+
+        `extra_certs` may be given as DER encoded bytes rather than parsed
+        certificates; ones which can't be parsed are ignored.
+        """
+        self.name = name
+        self.extended_key_usage = extended_key_usage
+        self.extra_certs = []
+        for cert in extra_certs:
+            try:
+                self.extra_certs.append(_as_certificate(cert))
+            except ValueError:
+                pass
+        self._extra_certs_by_name = _build_name_mapping(self.extra_certs)
+        self.candidate_pool = candidate_pool
+        self._ocsp_responses = {}
+        for data in ocsp_responses:
+            loaded = _load_ocsp_response(data)
+            if loaded is not None:
+                (key, response) = loaded
+                self._ocsp_responses[key] = (
+                    hashlib.sha256(data).digest(), response
+                )
+        self.timestamp = datetime.datetime.utcnow()
+
+    def _add_extra_cert(self, cert):
+        self.extra_certs.append(cert)
+        self._extra_certs_by_name.setdefault(cert.subject, []).append(cert)
+
+
+def _security_bits(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        key_size = public_key.key_size
+        if key_size < 2048:
+            return 80
+        if key_size < 3072:
+            return 112
+        if key_size < 7680:
+            return 128
+        return 192
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return public_key.curve.key_size // 2
+    return 0
+
+
+class PathCost(object):
+    """
+    The cost model for `X509Validator(roots, path_cost=...)`, which then
+    returns the cheapest acceptable chain rather than the first one found.
+
+    Every certificate in the chain costs `per_certificate`, an issuer which
+    had to be fetched through AIA costs another `aia_fetch`, issuers with
+    keys weaker than 128 bits of security cost `weak_key` per 16 bits short
+    of that, and `anchors` maps trusted roots to an extra cost for ending
+    the chain there. Subclasses can override `edge_cost`, `aia_cost` and
+    `anchor_cost`; costs must never be negative.
+    """
+
+    def __init__(self, per_certificate=1, aia_fetch=10, weak_key=1,
+                 anchors={}):
+        self.per_certificate = per_certificate
+        self.aia_fetch = aia_fetch
+        self.weak_key = weak_key
+        self.anchors = anchors
+
+    def edge_cost(self, cert, issuer, from_aia):
+        """
+        The cost of `issuer` issuing `cert`. `from_aia` is whether `issuer`
+        was fetched through AIA, in which case this must be at least
+        `aia_cost(cert)`.
+        """
+        cost = self.per_certificate
+        if from_aia:
+            cost += self.aia_fetch
+        if self.weak_key:
+            shortfall = 128 - _security_bits(issuer.public_key())
+            if shortfall > 0:
+                cost += self.weak_key * shortfall / 16
+        return cost
+
+    def aia_cost(self, cert):
+        """
+        A lower bound on the cost of any issuer of `cert` found through AIA,
+        so that AIA is only followed once no cheaper path is left.
+        """
+        return self.aia_fetch
+
+    def anchor_cost(self, anchor):
+        return self.anchors.get(anchor, 0)
+
+
+def issuer_affinity_key(cert):
+    """
+    Identifies the issuer of `cert` (a parsed certificate or its DER
+    encoding) by its authority key identifier, or by its issuer name if it
+    has none. Certificates with the same key need the same intermediates and
+    signature checks.
+    """
+    cert = _as_certificate(cert)
+    aki = _get_extension_value(cert, x509.AuthorityKeyIdentifier)
+    if aki is not None and aki.key_identifier is not None:
+        return b"k" + aki.key_identifier
+    return b"n" + cert.issuer.public_bytes(default_backend())
+
+
+class IssuerPartitioner(object):
+    """
+    Assigns certificates to `workers` (any hashable names, such as socket
+    paths or host names) by a consistent hash of their
+    `issuer_affinity_key`, so each worker sees a stable slice of the CA
+    hierarchy and keeps the intermediates and signature checks for it
+    cached. Each worker gets `replicas` points on the hash ring; adding or
+    removing one only moves the certificates of the issuers it owns.
+    """
+
+    def __init__(self, workers, replicas=64):
+        self.workers = list(workers)
+        ring = sorted(
+            (self._hash("{}:{}".format(worker, i).encode("utf-8")), worker)
+            for worker in self.workers
+            for i in range(replicas)
+        )
+        self._points = [point for (point, _) in ring]
+        self._owners = [worker for (_, worker) in ring]
+
+    @staticmethod
+    def _hash(data):
+        return struct.unpack(">Q", hashlib.sha256(data).digest()[:8])[0]
+
+    def worker_for(self, cert):
+        point = self._hash(issuer_affinity_key(cert))
+        index = bisect.bisect(self._points, point) % len(self._points)
+        return self._owners[index]
+
+    def partition(self, certs):
+        """
+        Returns a dict mapping each worker to the indexes of the `certs` it
+        owns, in order.
+        """
+        partitions = {}
+        for (i, cert) in enumerate(certs):
+            partitions.setdefault(self.worker_for(cert), []).append(i)
+        return partitions
+
+
+_MAX_CHAIN_DEPTH = 8
+_SUPPORTED_EXTENSIONS = {x509.ExtensionOID.BASIC_CONSTRAINTS}
+_SUPPORTED_CURVES = {ec.SECP256R1, ec.SECP384R1}
+_CRL_MMAP_THRESHOLD = 100000
+_CACHE_BYTES = 16 * 1024 * 1024
+_NEGATIVE_CACHE_TTL = 60
+
+# Stands in for the name and extended key usage of a validation context
+# while discovering paths for several purposes at once, so that only the
+# checks which don't depend on them are applied.
+_ANY_PURPOSE = object()
+# Likewise for the time, while computing when a certificate is valid.
+_ANY_TIME = object()
+
+# Kinds of entries in `_build_cheapest_chains_from`'s queue
+_COMPLETE = 0
+_EXPAND = 1
+_FOLLOW_AIA = 2
+
+
+class X509Validator(object):
+    def __init__(self, roots, signature_executor=None,
+                 revocation_filter=None, ocsp_fetch=False,
+                 negative_cache_ttl=_NEGATIVE_CACHE_TTL, fetcher=None,
+                 cache_bytes=_CACHE_BYTES, path_cost=None, recorder=None):
+        """
+        If `signature_executor` (a `concurrent.futures.Executor`) is given,
+        then whenever a certificate has several local candidate issuers their
+        signatures are checked concurrently on it. The executor can be shared
+        between validators.
+
+        `revocation_filter` is an optional `FilterCascade`, which every chain
+        is checked against before it's accepted.
+
+        Stapled OCSP responses in the validation context are always checked.
+        With `ocsp_fetch`, certificates without one have their status fetched
+        from the responder named in their AIA extension. Either way, chains
+        are only rejected for a verified "revoked" status.
+
+        When no issuer at all can be found for a certificate, neither locally
+        nor through AIA, that is remembered for `negative_cache_ttl` seconds
+        (or until the roots or registered intermediates change), and further
+        certificates naming the same issuer fail without a search.
+
+        AIA and OCSP URLs are fetched with `fetcher`, a `RequestsFetcher` by
+        default; `DisabledFetcher()` keeps the validator off the network.
+
+        All of the validator's caches share one budget of roughly
+        `cache_bytes`; see `cache_stats`.
+
+        By default the first acceptable chain found is returned. With a
+        `PathCost`, chains are built best-first instead and the cheapest one
+        is returned.
+
+        A `CaptureRecorder` records a sample of calls to `validate`, for
+        replaying later.
+        """
+        self._trust_store = _TrustStore(roots)
+        self._update_lock = threading.Lock()
+        # Set on overlays (see `overlay`) to the validator they're layered
+        # over; every validator tracks its own overlays to rebase them.
+        self._base = None
+        self._distrusted = frozenset()
+        self._overlays = weakref.WeakSet()
+        self._caches = _CacheManager(cache_bytes)
+        # Maps (cert, issuer) to whether issuer's key signed cert. This is
+        # independent of the trust store and of the validation context.
+        self._edge_cache = self._caches.cache("edges", 200)
+        # Parsed extensions and public keys; the certificate itself is
+        # usually kept alive by the edge cache too.
+        self._info_cache = self._caches.cache("info", 2048)
+        self._signature_executor = signature_executor
+        # Maps (issuer name, issuer key id) to the revoked serial numbers of
+        # that issuer, and each loaded CRL file to the digest of its contents
+        # and the issuer it was loaded for. Both are replaced, never mutated.
+        self._revoked_serials = {}
+        self._crl_sources = {}
+        self._revocation_filter = revocation_filter
+        self._ocsp_fetch = ocsp_fetch
+        # Maps (issuer key hash, serial number) to an `_OCSPStatus`.
+        self._ocsp_cache = self._caches.cache("ocsp", 400)
+        # Maps the shared trust store generation and (issuer name, authority
+        # key id, AIA URLs) to the time until which no issuer can be found
+        # for them.
+        self._negative_cache = self._caches.cache("negative_issuers", 400)
+        self._negative_cache_ttl = negative_cache_ttl
+        if fetcher is None:
+            fetcher = RequestsFetcher()
+        self._recorder = recorder
+        if recorder is not None:
+            fetcher = _RecordingFetcher(fetcher, recorder)
+        self._fetcher = fetcher
+        self._path_cost = path_cost
+        if recorder is not None:
+            recorder._record_config(self)
+            recorder._record_roots(self._trust_store.roots)
+
+    @property
+    def roots(self):
+        return self._trust_store.roots
+
+    def cache_stats(self):
+        """
+        Returns a dict mapping the name of each cache to a dict of its
+        `entries`, estimated `bytes`, `hits`, `misses` and `hit_rate`.
+        `certificates`, the certificates parsed from DER, is shared by all
+        validators and isn't part of `cache_bytes`; see
+        `set_certificate_cache_bytes`.
+        """
+        stats = self._caches.stats()
+        interned = _interned_certificates
+        stats[interned.name] = interned._manager.stats()[interned.name]
+        return stats
+
+    @property
+    def intermediates(self):
+        return tuple(self._trust_store.intermediates)
+
+    def overlay(self, roots=(), distrusted=()):
+        """
+        Returns a validator for one tenant of a multi-tenant deployment,
+        which trusts this validator's roots except for `distrusted` ones,
+        plus its own `roots`. Overlays only store their own roots and
+        intermediates, and share this validator's caches, fetcher and
+        revocation data, so paths through the shared roots are only verified
+        once for all tenants.
+
+        Changes to this validator's roots, registered intermediates and
+        revocation data show up in its overlays. On an overlay,
+        `update_roots` replaces the overlay's own roots, and
+        `register_intermediates` registers intermediates for that tenant
+        only.
+        """
+        tenant = copy.copy(self)
+        tenant._base = self
+        tenant._update_lock = threading.Lock()
+        tenant._overlays = weakref.WeakSet()
+        tenant._distrusted = frozenset(distrusted)
+        tenant._recorder = None
+        tenant._trust_store = _OverlayTrustStore(
+            self._trust_store, roots, tenant._distrusted
+        )
+        with self._update_lock:
+            self._overlays.add(tenant)
+            # Catch up with any change made while the overlay was created.
+            tenant._rebase(self._trust_store)
+        return tenant
+
+    def _new_store(self, roots):
+        if self._base is None:
+            return _TrustStore(roots)
+        return _OverlayTrustStore(
+            self._base._trust_store, roots, self._distrusted
+        )
+
+    def _carry_intermediates(self, old_store, new_store):
+        # Keeps the intermediates registered with `old_store` itself whose
+        # path still leads to a root of `new_store`, and re-verifies the
+        # others.
+        stale = []
+        for record in old_store.own_intermediates.values():
+            if record.cert in new_store.intermediates:
+                continue
+            if record.anchor in new_store:
+                new_store = new_store.with_intermediate(record)
+            else:
+                stale.append(record.cert)
+        new_store, _ = self._register(stale, new_store)
+        return new_store
+
+    def _rebase(self, base_store):
+        with self._update_lock:
+            old_store = self._trust_store
+            new_store = _OverlayTrustStore(
+                base_store, old_store.added_roots, self._distrusted
+            )
+            self._trust_store = self._carry_intermediates(
+                old_store, new_store
+            )
+            self._rebase_overlays()
+
+    def _rebase_overlays(self):
+        # Called with `_update_lock` held, so overlays see the changes in
+        # order.
+        for overlay in list(self._overlays):
+            overlay._rebase(self._trust_store)
+
+    def update_roots(self, roots):
+        """
+        Atomically replace the trusted roots. Validations already in progress
+        finish against the previous roots; cached signature checks are kept
+        unless they were made against a root that has been removed, and
+        registered intermediates are only re-verified if their path led to
+        one.
+        """
+        with self._update_lock:
+            old_store = self._trust_store
+            new_store = self._carry_intermediates(
+                old_store, self._new_store(roots)
+            )
+            self._trust_store = new_store
+            if self._recorder is not None:
+                self._recorder._record_roots(new_store.roots)
+            self._rebase_overlays()
+
+        # The edge cache is shared with overlays, which may still trust the
+        # roots an overlay removes.
+        removed = old_store._root_set - new_store._root_set
+        if removed and self._base is None:
+            self._edge_cache.discard_if(lambda key: key[1] in removed)
+
+    def register_intermediates(self, certs):
+        """
+        Verify each intermediate against the trusted roots once and remember
+        the result, so that later validations only need to run the
+        context-specific checks for them. Returns the newly registered
+        certificates; ones that could not be chained to a root are skipped.
+        """
+        with self._update_lock:
+            store, registered = self._register(certs, self._trust_store)
+            self._trust_store = store
+            if registered:
+                self._rebase_overlays()
+        if registered and self._recorder is not None:
+            self._recorder._record_intermediates(registered)
+        return registered
+
+    def _register(self, certs, store):
+        registered = []
+        pending = [
+            cert for cert in certs
+            if cert not in store and cert not in store.intermediates
+        ]
+        # Intermediates may chain through each other, so keep going for as
+        # long as registering one might allow another.
+        while pending:
+            remaining = []
+            for cert in pending:
+                for path in self._build_verified_path_from(cert, 1, store):
+                    store = store.with_intermediate(_VerifiedIntermediate(
+                        path, [self._get_info(c) for c in path]
+                    ))
+                    registered.append(cert)
+                    break
+                else:
+                    remaining.append(cert)
+            if len(remaining) == len(pending):
+                break
+            pending = remaining
+        return store, registered
+
+    def validate(self, cert, ctx):
+        """
+        `cert` may be a parsed certificate or its DER encoding. Identical DER
+        bytes are only parsed once, and share cached metadata.
+        """
+        recorder = self._recorder
+        if recorder is not None and recorder._should_sample():
+            return recorder._record_validation(self._validate, cert, ctx)
+        return self._validate(cert, ctx)
+
+    def validate_batch(self, certs, ctx):
+        """
+        Validates each of `certs` against `ctx`, returning a
+        `ValidationResult` for each, or None if it didn't validate. The
+        certificates are validated grouped by issuer (see
+        `issuer_affinity_key`), so the ones sharing intermediates run while
+        those are hot in the caches; unparseable ones fail.
+        """
+        certs = list(certs)
+        keyed = []
+        for (i, cert) in enumerate(certs):
+            try:
+                cert = _as_certificate(cert)
+                key = issuer_affinity_key(cert)
+            except ValueError:
+                continue
+            keyed.append((key, i, cert))
+        keyed.sort(key=lambda item: item[:2])
+
+        results = [None] * len(certs)
+        for (_, i, cert) in keyed:
+            try:
+                results[i] = self.validate(cert, ctx)
+            except ValidationError:
+                pass
+        return results
+
+    def _validate(self, cert, ctx):
+        chains = self._iter_chains(cert, ctx, first_only=True)
+        try:
+            for result in chains:
+                return result
+        finally:
+            chains.close()
+        raise ValidationError
+
+    def iter_chains(self, cert, ctx):
+        """
+        Lazily yield a `ValidationResult` for every acceptable chain for
+        `cert`, in order of increasing cost if the validator has a
+        `PathCost`. Stop iterating as soon as a chain is good enough, to
+        avoid building (and maybe fetching) the rest.
+        """
+        return self._iter_chains(cert, ctx)
+
+    def _iter_chains(self, cert, ctx, first_only=False):
+        try:
+            cert = _as_certificate(cert)
+        except ValueError:
+            return
+
+        state = _ValidationState(self._trust_store)
+        if not self._is_valid_cert(cert, ctx, state):
+            return
+
+        if not self._is_name_correct(cert, ctx.name):
+            return
+
+        chains = self._find_acceptable_chains(cert, ctx, state, first_only)
+        for chain in chains:
+            yield self._make_result(chain, state)
+
+    def start_session(self, leaf, name, extended_key_usage,
+                      candidate_pool=None, ocsp_responses=[]):
+        """
+        Start validating `leaf` before its intermediates have all arrived;
+        see `ValidationSession`.
+        """
+        return ValidationSession(self, leaf, ValidationContext(
+            name=name, extended_key_usage=extended_key_usage,
+            candidate_pool=candidate_pool, ocsp_responses=ocsp_responses,
+        ))
+
+    def validate_purposes(self, cert, purposes, extra_certs=[],
+                          candidate_pool=None, ocsp_responses=[]):
+        """
+        Validate `cert` for each of several (name, extended_key_usage)
+        `purposes` at once, returning a `ValidationResult` or None for each
+        of them. Paths are only discovered, and signatures only checked,
+        once; just the name and usage checks are repeated per purpose.
+        """
+        ctx = ValidationContext(
+            name=_ANY_PURPOSE, extended_key_usage=_ANY_PURPOSE,
+            extra_certs=extra_certs, candidate_pool=candidate_pool,
+            ocsp_responses=ocsp_responses,
+        )
+        try:
+            cert = _as_certificate(cert)
+        except ValueError:
+            return [None for _ in purposes]
+        state = _ValidationState(self._trust_store)
+        if not self._is_valid_cert(cert, ctx, state):
+            return [None for _ in purposes]
+
+        chains = self._find_acceptable_chains(cert, ctx, state)
+        found = []
+        results = []
+        try:
+            for (name, extended_key_usage) in purposes:
+                purpose_ctx = copy.copy(ctx)
+                purpose_ctx.name = name
+                purpose_ctx.extended_key_usage = extended_key_usage
+                results.append(None)
+                # Earlier purposes may already have found the right chain;
+                # otherwise keep building.
+                i = 0
+                while True:
+                    if i == len(found):
+                        chain = next(chains, None)
+                        if chain is None:
+                            break
+                        found.append(chain)
+                    chain = found[i]
+                    i += 1
+                    if self._is_valid_for_purpose(chain, purpose_ctx):
+                        results[-1] = self._make_result(chain, state)
+                        break
+        finally:
+            chains.close()
+        return results
+
+    def validity_timeline(self, cert, name, extended_key_usage,
+                          extra_certs=[], candidate_pool=None,
+                          follow_aia=True):
+        """
+        Work out over which time ranges `cert` validates, checking each
+        candidate path's signatures once rather than validating again for
+        every point in time. Returns a list of `ValidationResult`s in time
+        order, whose `valid_from`/`valid_until` are non-overlapping ranges
+        and whose chain is valid throughout its range. OCSP isn't consulted,
+        as responses only speak for the time they were produced.
+        """
+        ctx = ValidationContext(
+            name=name, extended_key_usage=extended_key_usage,
+            extra_certs=extra_certs, candidate_pool=candidate_pool,
+        )
+        ctx.timestamp = _ANY_TIME
+        try:
+            cert = _as_certificate(cert)
+        except ValueError:
+            return []
+        if not (
+            self._is_valid_cert(cert, ctx) and
+            self._is_name_correct(cert, ctx.name)
+        ):
+            return []
+
+        state = _ValidationState(self._trust_store)
+        state.follow_aia = follow_aia
+        windows = []
+        for chain in self._find_acceptable_chains(cert, ctx, state):
+            infos = [self._get_info(c) for c in chain]
+            valid_from = max(i.not_valid_before for i in infos)
+            valid_until = min(i.not_valid_after for i in infos)
+            if valid_from <= valid_until:
+                windows.append((valid_from, valid_until, chain))
+
+        # Split time at every window boundary, and give each piece the
+        # first chain found which covers it, merging neighbouring pieces
+        # with the same chain.
+        boundaries = sorted(set(
+            t for (start, end, _) in windows for t in (start, end)
+        ))
+        timeline = []
+        for start, end in zip(boundaries, boundaries[1:] or boundaries):
+            for (window_start, window_end, chain) in windows:
+                if window_start <= start and end <= window_end:
+                    break
+            else:
+                continue
+            if timeline and timeline[-1][2] is chain and (
+                timeline[-1][1] == start
+            ):
+                timeline[-1][1] = end
+            else:
+                timeline.append([start, end, chain])
+
+        return [
+            ValidationResult(
+                chain, anchor=chain[-1], valid_from=start, valid_until=end,
+                used_aia=any(id(c) in state.aia_certs for c in chain),
+                signature_checks=state.signature_checks,
+                aia_fetches=state.aia_fetches,
+            )
+            for (start, end, chain) in timeline
+        ]
+
+    def _is_valid_for_purpose(self, chain, ctx):
+        """
+        The checks of `_is_valid_chain` which depend on the name and
+        extended key usage of the validation context.
+        """
+        cert = chain[0]
+        eku = self._get_info(cert).extended_key_usage
+        if not (
+            self._is_valid_usage(eku, ctx) and
+            self._is_name_correct(cert, ctx.name)
+        ):
+            return False
+        return all(
+            self._is_valid_usage(
+                self._get_info(issuer).extended_key_usage, ctx
+            ) and
+            self._check_name_constraints(issuer, ctx.name)
+            for issuer in chain[1:]
+        )
+
+    def _find_acceptable_chains(self, cert, ctx, state, first_only=False):
+        """
+        Yield the acceptable chains for `cert`. With `first_only`, the
+        caller only wants the first one, so a registered intermediate's
+        verified path is taken without looking for others through it.
+        Otherwise every distinct chain is yielded once.
+        """
+        if self._path_cost is None:
+            chains = self._build_chain_from(cert, ctx, 0, state, first_only)
+        else:
+            chains = self._build_cheapest_chains_from(cert, ctx, state)
+        # Maps the identities of the certificates of each chain yielded to
+        # the chain, which keeps them alive.
+        seen = {}
+        try:
+            for chain in chains:
+                # Self-signed roots would otherwise also be their own issuers
+                if len(set(chain)) != len(chain):
+                    continue
+                if not first_only:
+                    # A registered intermediate's verified path is also
+                    # found again by building through it. Certificates
+                    # fetched over AIA are distinct objects, so a chain
+                    # through them still counts as a different chain.
+                    ids = tuple(id(c) for c in chain)
+                    if ids in seen:
+                        continue
+                    seen[ids] = chain
+                if self._is_acceptable_chain(chain, ctx, state):
+                    yield chain
+        finally:
+            chains.close()
+
+    def set_revocation_filter(self, revocation_filter):
+        """
+        Replace the `FilterCascade` chains are checked against, or remove it
+        with `None`.
+        """
+        self._check_owns_revocation_data()
+        with self._update_lock:
+            self._revocation_filter = revocation_filter
+            self._share_revocation_data()
+        if self._recorder is not None:
+            self._recorder._record_config(self)
+
+    def _check_owns_revocation_data(self):
+        if self._base is not None:
+            raise ValueError(
+                "An overlay's revocation data is managed by its base validator"
+            )
+
+    def _share_revocation_data(self):
+        # Called with `_update_lock` held.
+        for overlay in list(self._overlays):
+            with overlay._update_lock:
+                overlay._revoked_serials = self._revoked_serials
+                overlay._crl_sources = self._crl_sources
+                overlay._revocation_filter = self._revocation_filter
+                overlay._share_revocation_data()
+
+    def _is_acceptable_chain(self, chain, ctx, state):
+        revocation_filter = self._revocation_filter
+        for (cert, issuer) in zip(chain, chain[1:]):
+            if revocation_filter is not None:
+                issuer_key_id = self._get_revocation_key(issuer)[1]
+                if revocation_filter.covers(
+                    issuer_key_id, self._get_info(cert).not_valid_before
+                ) and _revocation_filter_key(
+                    issuer_key_id, cert.serial_number
+                ) in revocation_filter:
+                    return False
+            status = self._get_ocsp_status(cert, issuer, ctx, state)
+            if status == ocsp.OCSPCertStatus.REVOKED:
+                return False
+        return True
+
+    def _get_ocsp_key_hash(self, issuer):
+        info = self._get_info(issuer)
+        if info.ocsp_key_hash is None:
+            info.ocsp_key_hash = x509.SubjectKeyIdentifier.from_public_key(
+                info.public_key
+            ).digest
+        return info.ocsp_key_hash
+
+    def _get_ocsp_status(self, cert, issuer, ctx, state):
+        if not ctx._ocsp_responses and not self._ocsp_fetch:
+            return None
+        if ctx.timestamp is _ANY_TIME:
+            return None
+        key = (self._get_ocsp_key_hash(issuer), cert.serial_number)
+        cached = self._ocsp_cache.get(key)
+
+        stapled = ctx._ocsp_responses.get(key)
+        if stapled is not None:
+            (digest, response) = stapled
+            if (
+                cached is not None and cached.digest == digest and
+                cached.is_current(ctx.timestamp)
+            ):
+                return cached.status
+        elif self._ocsp_fetch:
+            if cached is not None and cached.is_current(ctx.timestamp):
+                return cached.status
+            fetched = self._fetch_ocsp_response(cert, issuer, state)
+            if fetched is None or fetched[1][0] != key:
+                return None
+            (digest, (_, response)) = fetched
+        else:
+            return None
+
+        status = self._verify_ocsp_response(response, digest, cert, issuer)
+        if status is None or not status.is_current(ctx.timestamp):
+            return None
+        self._ocsp_cache.set(key, status)
+        return status.status
+
+    def _verify_ocsp_response(self, response, digest, cert, issuer):
+        if (
+            response.serial_number != cert.serial_number or
+            response.issuer_name_hash != hashlib.sha1(
+                issuer.subject.public_bytes(default_backend())
+            ).digest()
+        ):
+            return None
+
+        signer = self._find_ocsp_signer(response, issuer)
+        if signer is None or not self._verify_signed_data(
+            self._get_info(signer).public_key,
+            response,
+            response.tbs_response_bytes,
+        ):
+            return None
+        return _OCSPStatus(
+            digest, response.certificate_status, response.this_update,
+            response.next_update,
+        )
 
+    def _find_ocsp_signer(self, response, issuer):
+        def is_responder(cert):
+            if response.responder_key_hash is not None:
+                return response.responder_key_hash == (
+                    self._get_ocsp_key_hash(cert)
+                )
+            return response.responder_name == cert.subject
 
-def _hostname_matches(hostname, cert_hostname):
-    hostname_prefix, hostname_rest = hostname.split(".", 1)
-    cert_hostname_prefix, cert_hostname_rest = cert_hostname.split(".", 1)
-    return (
-        (
-            cert_hostname_prefix == "*" or
-            cert_hostname_prefix == hostname_prefix
-        ) and
-        cert_hostname_rest == hostname_rest
-    )
+        if is_responder(issuer):
+            return issuer
+        # Otherwise it must be a responder the issuer delegated to.
+        for responder in response.certificates:
+            if not is_responder(responder):
+                continue
+            info = self._get_info(responder)
+            if (
+                info.extended_key_usage is not None and
+                x509.ExtendedKeyUsageOID.OCSP_SIGNING in
+                info.extended_key_usage and
+                info.not_valid_before <= response.produced_at <=
+                info.not_valid_after and
+                self._is_supported_cert(responder) and
+                responder.issuer == issuer.subject and
+                self._is_signed_by(responder, issuer)
+            ):
+                return responder
+        return None
 
+    def _fetch_ocsp_response(self, cert, issuer, state):
+        aia = _get_extension_value(cert, x509.AuthorityInformationAccess)
+        if aia is None:
+            return None
+        request = ocsp.OCSPRequestBuilder().add_certificate(
+            cert, issuer, hashes.SHA1()
+        ).build().public_bytes(serialization.Encoding.DER)
+        for loc in aia:
+            am = loc.access_method
+            if (
+                am == x509.AuthorityInformationAccessOID.OCSP and
+                isinstance(loc.access_location, x509.UniformResourceIdentifier)
+            ):
+                location = loc.access_location.value
+                if not location.startswith("http://"):
+                    continue
+                if state is not None:
+                    state.ocsp_fetches += 1
+                content = self._fetcher.post(
+                    location, request, "application/ocsp-request"
+                )
+                if content is None:
+                    continue
+                loaded = _load_ocsp_response(content)
+                if loaded is not None:
+                    return hashlib.sha256(content).digest(), loaded
+        return None
 
-def _name_constraint_matches(hostname, name_constraint):
-    if not isinstance(name_constraint, x509.DNSName):
-        return False
-    constraint_hostname = name_constraint.value
+    def load_crls(self, paths, issuers=(), mmap_dir=None,
+                  mmap_threshold=_CRL_MMAP_THRESHOLD):
+        """
+        Load CRLs (PEM or DER) from files. Each CRL's signature is verified
+        once, against a root, a registered intermediate or one of `issuers`,
+        and its revoked serial numbers are indexed by issuer, so checking a
+        certificate costs a lookup. CRLs with at least `mmap_threshold`
+        entries are stored in memory-mapped files under `mmap_dir`, if it's
+        given.
 
-    if constraint_hostname.startswith("."):
-        return hostname.endswith(constraint_hostname)
-    else:
-        return (
-            hostname == constraint_hostname or
-            hostname.endswith("." + constraint_hostname)
+        `paths` replaces the CRLs loaded before: ones from paths which are
+        no longer given are dropped. Loading again only re-reads files whose
+        contents changed, and validations keep using the previous CRLs until
+        the new ones are ready. A file which can't be read or loaded keeps
+        its previous CRL. CRLs past their nextUpdate are dropped, so CRLs
+        have to be reloaded periodically to stay in force. Returns the paths
+        which were (re)loaded.
+        """
+        self._check_owns_revocation_data()
+        now = datetime.datetime.utcnow()
+        by_digest = dict(
+            (source[0], source[2]) for source in self._crl_sources.values()
         )
+        updates = {}
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except EnvironmentError:
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            source = self._crl_sources.get(path)
+            if source is not None and source[0] == digest:
+                continue
+            try:
+                crl = _load_crl(data)
+                if crl.next_update is not None and crl.next_update < now:
+                    continue
+                issuer = self._find_crl_issuer(crl, issuers)
+            except (ValueError, UnsupportedAlgorithm):
+                continue
+            if issuer is None:
+                continue
 
+            serial_numbers = [revoked.serial_number for revoked in crl]
+            if digest in by_digest:
+                # The same CRL under another path; its mapped file must not
+                # be rewritten while it's in use.
+                revoked_serials = by_digest[digest]
+            elif (
+                mmap_dir is not None and len(serial_numbers) >= mmap_threshold
+            ):
+                revoked_serials = _MappedSerialSet.create(
+                    os.path.join(mmap_dir, digest + ".serials"),
+                    serial_numbers,
+                )
+            else:
+                revoked_serials = frozenset(serial_numbers)
+            by_digest[digest] = revoked_serials
+            updates[path] = (
+                digest, self._get_revocation_key(issuer), revoked_serials,
+                crl.next_update,
+            )
 
-class ValidationContext(object):
-    def __init__(self, name, extended_key_usage, extra_certs=[]):
-        self.name = name
-        self.extended_key_usage = extended_key_usage
-        self.extra_certs = extra_certs
-        self._extra_certs_by_name = _build_name_mapping(extra_certs)
-        self.timestamp = datetime.datetime.utcnow()
-
+        with self._update_lock:
+            old_sources = self._crl_sources
+            sources = {}
+            revoked_by_issuer = {}
+            # Rebuilt from scratch, so CRLs that were dropped, and issuers
+            # whose CRL moved to another key, leave nothing behind.
+            for path in paths:
+                source = updates.get(path, old_sources.get(path))
+                if source is not None and (
+                    source[3] is None or now <= source[3]
+                ):
+                    sources[path] = source
+                    revoked_by_issuer[source[1]] = source[2]
+            self._revoked_serials = revoked_by_issuer
+            self._crl_sources = sources
+            self._share_revocation_data()
+        if self._recorder is not None and (
+            _crl_digests(sources) != _crl_digests(old_sources)
+        ):
+            self._recorder._record_config(self)
+        in_use = set(id(source[2]) for source in sources.values())
+        for source in old_sources.values():
+            if isinstance(source[2], _MappedSerialSet) and (
+                id(source[2]) not in in_use
+            ):
+                source[2].discard()
+        return list(updates)
 
-_MAX_CHAIN_DEPTH = 8
-_SUPPORTED_EXTENSIONS = {x509.ExtensionOID.BASIC_CONSTRAINTS}
-_SUPPORTED_CURVES = {ec.SECP256R1, ec.SECP384R1}
+    def _find_crl_issuer(self, crl, issuers):
+        store = self._trust_store
+        candidates = (
+            [c for c in issuers if c.subject == crl.issuer] +
+            store.roots_by_name.get(crl.issuer, []) +
+            store.intermediates_by_name.get(crl.issuer, [])
+        )
+        for issuer in candidates:
+            ku = self._get_info(issuer).key_usage
+            if ku is None or not ku.crl_sign:
+                continue
+            if crl.is_signature_valid(self._get_info(issuer).public_key):
+                return issuer
+        return None
 
+    def _get_revocation_key(self, issuer):
+        info = self._get_info(issuer)
+        if info.key_id is None:
+            info.key_id = _spki_digest(info.public_key)
+        return (issuer.subject, info.key_id)
 
-class X509Validator(object):
-    def __init__(self, roots):
-        self._roots = roots
-        self._roots_by_name = _build_name_mapping(roots)
+    def _is_revoked(self, cert, issuer):
+        revoked_by_issuer = self._revoked_serials
+        if not revoked_by_issuer:
+            return False
+        revoked_serials = revoked_by_issuer.get(
+            self._get_revocation_key(issuer)
+        )
+        return (
+            revoked_serials is not None and
+            cert.serial_number in revoked_serials
+        )
 
-        self._http_session = requests.session()
+    def revalidate(self, chain, ctx):
+        """
+        Check that a chain previously returned by `validate` is still
+        acceptable for `ctx`. The known path is re-checked first, which
+        normally only re-runs the time and context dependent checks; a new
+        path is only built if that one is no longer valid.
+        """
+        state = _ValidationState(self._trust_store)
+        if self._is_valid_chain(chain, ctx, state):
+            return self._make_result(chain, state)
+        return self.validate(chain[0], ctx)
 
-    def validate(self, cert, ctx):
-        if not self._is_valid_cert(cert, ctx):
-            raise ValidationError
+    def _make_result(self, chain, state):
+        infos = [self._get_info(c, state) for c in chain]
+        return ValidationResult(
+            chain,
+            anchor=chain[-1],
+            valid_from=max(i.not_valid_before for i in infos),
+            valid_until=min(i.not_valid_after for i in infos),
+            used_aia=any(id(c) in state.aia_certs for c in chain),
+            signature_checks=state.signature_checks,
+            aia_fetches=state.aia_fetches,
+            ocsp_fetches=state.ocsp_fetches,
+        )
 
-        if not self._is_name_correct(cert, ctx.name):
-            raise ValidationError
+    def _is_valid_chain(self, chain, ctx, state):
+        if not chain or chain[-1] not in state.store:
+            return False
+        if len(chain) - 1 > _MAX_CHAIN_DEPTH:
+            return False
 
-        for chain in self._build_chain_from(cert, ctx, depth=0):
-            return chain
-        raise ValidationError
+        cert = chain[0]
+        if not (
+            self._is_valid_cert(cert, ctx, state) and
+            self._is_name_correct(cert, ctx.name)
+        ):
+            return False
+        for depth, issuer in enumerate(chain[1:]):
+            if not self._is_valid_issuer(cert, issuer, depth, ctx, state):
+                return False
+            cert = issuer
+        return self._is_acceptable_chain(chain, ctx, state)
 
-    def _find_potential_issuers(self, cert, ctx):
-        for issuer in ctx._extra_certs_by_name.get(cert.issuer, []):
+    def _find_potential_issuers(self, cert, local_issuers, state):
+        for issuer in local_issuers:
             yield issuer
-        for issuer in self._roots_by_name.get(cert.issuer, []):
+        for issuer in self._find_aia_issuers(cert, local_issuers, state):
             yield issuer
-        for issuer in self._follow_aia(cert):
+
+    def _find_aia_issuers(self, cert, local_issuers, state):
+        if not state.follow_aia:
+            return
+        # Whether there's an issuer only depends on the trust store and on
+        # AIA when the context didn't offer any candidates. Overlays share
+        # their base's entries: what an overlay adds to its base could only
+        # have shown up as a local candidate.
+        key = None
+        if not local_issuers and self._negative_cache_ttl:
+            key = (
+                state.store.shared_generation,
+                self._get_negative_cache_key(cert),
+            )
+            expires = self._negative_cache.get(key)
+            if expires is not None and _monotonic() < expires:
+                return
+
+        found = False
+        for issuer in self._follow_aia(cert, state):
+            state.aia_certs[id(issuer)] = issuer
+            # Whatever the server returned, only a certificate allowed to
+            # issue ever gets its signature checked.
+            found = found or (
+                self._may_issue(issuer, 0, state) and
+                self._is_signed_by(cert, issuer, state)
+            )
             yield issuer
+        if key is not None and not found:
+            self._negative_cache.set(
+                key, _monotonic() + self._negative_cache_ttl
+            )
+
+    def _get_negative_cache_key(self, cert):
+        aki = _get_extension_value(cert, x509.AuthorityKeyIdentifier)
+        aia = _get_extension_value(cert, x509.AuthorityInformationAccess)
+        return (
+            cert.issuer,
+            aki.key_identifier if aki is not None else None,
+            frozenset(
+                loc.access_location.value for loc in aia or []
+                if loc.access_method ==
+                x509.AuthorityInformationAccessOID.CA_ISSUERS
+            ),
+        )
+
+    def _find_local_issuers(self, cert, ctx, store):
+        issuers = (
+            ctx._extra_certs_by_name.get(cert.issuer, []) +
+            store.roots_by_name.get(cert.issuer, []) +
+            store.intermediates_by_name.get(cert.issuer, [])
+        )
+        if ctx.candidate_pool is not None:
+            issuers += ctx.candidate_pool._find_issuers(cert.issuer, ctx)
+        return issuers
 
-    def _follow_aia(self, cert):
+    def _follow_aia(self, cert, state=None, fetcher=None):
+        if fetcher is None:
+            fetcher = self._fetcher
         try:
             aia = cert.extensions.get_extension_for_class(
                 x509.AuthorityInformationAccess
@@ -108,83 +2437,105 @@ class X509Validator(object):
                 location = loc.access_location.value
                 if location.startswith("http://"):
                     # TODO: filtering out addresses that shouldn't be
-                    # accessible (e.g. 169.254.169.254), timeouts, disabling
-                    # AIA, ...
-                    try:
-                        response = self._http_session.get(location)
-                    except requests.ConnectionError:
-                        continue
-                    if response.status_code != 200:
+                    # accessible (e.g. 169.254.169.254), ...
+                    if state is not None:
+                        state.aia_fetches += 1
+                    content = fetcher.get(location)
+                    if content is None:
                         continue
                     try:
                         yield x509.load_der_x509_certificate(
-                            response.content, default_backend()
+                            content, default_backend()
                         )
                     except ValueError:
                         pass
 
+    def match_names(self, cert, names):
+        """
+        Check which of `names` the certificate's subjectAltName covers,
+        returning a list of booleans in the same order. Only the names are
+        checked, not the rest of the certificate.
+        """
+        return [self._is_name_correct(cert, name) for name in names]
+
     def _is_name_correct(self, cert, name):
         if not isinstance(name, x509.DNSName):
             raise ValidationError
-        hostname = name.value
-        try:
-            san = cert.extensions.get_extension_for_class(
-                x509.SubjectAlternativeName
-            ).value
-        except x509.ExtensionNotFound:
-            return False
+        return self._get_san_index(cert).matches(name.value)
 
-        for entry in san:
-            # TODO: support other name types
-            if not isinstance(entry, x509.DNSName):
-                continue
-            if _hostname_matches(hostname, entry.value):
-                return True
-        return False
+    def _get_san_index(self, cert):
+        info = self._get_info(cert)
+        if info.san_index is None:
+            info.san_index = _SubjectAltNameIndex(
+                _get_extension_value(cert, x509.SubjectAlternativeName)
+            )
+            self._charge_info(cert, info)
+        return info.san_index
 
-    def _check_name_constraints(self, cert, name):
-        try:
-            nc = cert.extensions.get_extension_for_class(
-                x509.NameConstraints
-            ).value
-        except x509.ExtensionNotFound:
+    def _check_name_constraints(self, cert, name, state=None):
+        info = self._get_info(cert, state)
+        if info.name_constraints is None or name is _ANY_PURPOSE:
             return True
 
         assert isinstance(name, x509.DNSName)
-        if nc.permitted_subtrees:
-            for constraint in nc.permitted_subtrees:
-                if _name_constraint_matches(name.value, constraint):
-                    break
-            else:
-                return False
+        if info.compiled_name_constraints is None:
+            info.compiled_name_constraints = _CompiledNameConstraints(
+                info.name_constraints
+            )
+            self._charge_info(cert, info)
+        return info.compiled_name_constraints.permits(name)
 
-        for constraint in nc.excluded_subtrees:
-            if _name_constraint_matches(name.value, constraint):
-                return False
+    def _is_valid_cert(self, cert, ctx, state=None):
+        return (
+            self._is_valid_for_context(cert, ctx, state) and
+            self._is_supported_cert(cert, state)
+        )
 
-        return True
+    def _get_info(self, cert, state=None):
+        if state is not None:
+            memo = state.infos.get(id(cert))
+            if memo is not None and memo[0] is cert:
+                return memo[1]
+        info = self._info_cache.get(cert)
+        if info is None:
+            info = _CertificateInfo(cert)
+            self._info_cache.set(cert, info)
+        if state is not None:
+            state.infos[id(cert)] = (cert, info)
+        return info
 
-    def _is_valid_cert(self, cert, ctx):
-        try:
-            eku = cert.extensions.get_extension_for_class(
-                x509.ExtendedKeyUsage
-            ).value
-        except x509.ExtensionNotFound:
-            # No EKU extension means "anything is permitted"
-            pass
-        else:
-            if (
-                ctx.extended_key_usage not in eku and
-                ANY_EXTENDED_KEY_USAGE_OID not in eku
-            ):
-                return False
+    def _charge_info(self, cert, info):
+        # Re-insert the info with what its lazily built indexes take, so a
+        # certificate with thousands of names counts for what it holds.
+        size = self._info_cache.entry_size
+        for index in (info.san_index, info.compiled_name_constraints):
+            if index is not None:
+                size += index.estimated_size()
+        self._info_cache.set(cert, info, size)
 
+    def _is_valid_for_context(self, cert, ctx, state=None):
+        info = self._get_info(cert, state)
+        if not self._is_valid_usage(info.extended_key_usage, ctx):
+            return False
+
+        return ctx.timestamp is _ANY_TIME or (
+            info.not_valid_before <= ctx.timestamp <= info.not_valid_after
+        )
+
+    def _is_valid_usage(self, eku, ctx):
+        # No EKU extension means "anything is permitted"
+        return eku is None or ctx.extended_key_usage is _ANY_PURPOSE or (
+            ctx.extended_key_usage in eku or
+            ANY_EXTENDED_KEY_USAGE_OID in eku
+        )
+
+    def _is_supported_cert(self, cert, state=None):
+        info = self._get_info(cert, state)
         return (
-            cert.not_valid_before <= ctx.timestamp <= cert.not_valid_after and
-            self._is_valid_public_key(cert.public_key()) and
+            self._is_valid_public_key(info.public_key) and
             all(
-                ext.oid in _SUPPORTED_EXTENSIONS
-                for ext in cert.extensions if ext.critical
+                oid in _SUPPORTED_EXTENSIONS
+                for oid in info.critical_extensions
             )
         )
 
@@ -197,17 +2548,31 @@ class X509Validator(object):
             )
         )
 
-    def _is_valid_issuer(self, cert, issuer, depth, ctx):
-        if not self._is_valid_cert(issuer, ctx):
-            return False
+    def _is_valid_issuer(self, cert, issuer, depth, ctx, state=None):
+        return (
+            self._is_valid_for_context(issuer, ctx, state) and
+            self._check_name_constraints(issuer, ctx.name, state) and
+            self._can_issue(cert, issuer, depth, state) and
+            not self._is_revoked(cert, issuer)
+        )
 
-        try:
-            basic_constraints = issuer.extensions.get_extension_for_class(
-                x509.BasicConstraints
-            ).value
-        except x509.ExtensionNotFound:
+    def _can_issue(self, cert, issuer, depth, state=None):
+        """
+        The checks of `_is_valid_issuer` which don't depend on the validation
+        context.
+        """
+        return (
+            self._may_issue(issuer, depth, state) and
+            self._is_signed_by(cert, issuer, state)
+        )
+
+    def _may_issue(self, issuer, depth, state=None):
+        if not self._is_supported_cert(issuer, state):
             return False
-        if not basic_constraints.ca:
+
+        info = self._get_info(issuer, state)
+        basic_constraints = info.basic_constraints
+        if basic_constraints is None or not basic_constraints.ca:
             return False
         if (
             basic_constraints.path_length is not None and
@@ -215,58 +2580,819 @@ class X509Validator(object):
         ):
             return False
 
-        try:
-            ku = issuer.extensions.get_extension_for_class(x509.KeyUsage).value
-        except x509.ExtensionNotFound:
-            return False
+        ku = info.key_usage
+        return ku is not None and ku.key_cert_sign
 
-        if not ku.key_cert_sign:
-            return False
+    def _is_signed_by(self, cert, issuer, state=None):
+        key = (cert, issuer)
+        if state is not None:
+            future = state.pending_signatures.pop(key, None)
+            if future is not None and not future.cancelled():
+                return future.result()
+        result = self._edge_cache.get(key)
+        if result is None:
+            if state is not None:
+                state.signature_checks += 1
+            result = self._verify_signature(cert, issuer)
+            self._edge_cache.set(key, result)
+        return result
 
-        if not self._check_name_constraints(issuer, ctx.name):
-            return False
+    def _verify_signature(self, cert, issuer):
+        return self._verify_signed_data(
+            self._get_info(issuer).public_key,
+            cert,
+            cert.tbs_certificate_bytes,
+        )
 
-        public_key = issuer.public_key()
+    def _verify_signed_data(self, public_key, signed, data):
+        """
+        Check the signature of `signed` (a certificate or OCSP response)
+        over `data`. The hash algorithm is only looked up once the signature
+        algorithm is known to be allowed, since unknown ones raise.
+        """
+        signature_algorithm_oid = signed.signature_algorithm_oid
         if isinstance(public_key, rsa.RSAPublicKey):
-            if cert.signature_algorithm_oid not in [
+            if signature_algorithm_oid not in [
                 x509.SignatureAlgorithmOID.RSA_WITH_SHA256
             ]:
                 return False
 
             try:
                 public_key.verify(
-                    cert.signature,
-                    cert.tbs_certificate_bytes,
+                    signed.signature,
+                    data,
                     padding.PKCS1v15(),
-                    cert.signature_hash_algorithm,
+                    signed.signature_hash_algorithm,
                 )
-            except InvalidSignature:
+            except (InvalidSignature, UnsupportedAlgorithm):
                 return False
         else:
             # Always true because of the `_is_valid_public_key` check.
             assert isinstance(public_key, ec.EllipticCurvePublicKey)
-            if cert.signature_algorithm_oid not in [
+            if signature_algorithm_oid not in [
                 x509.SignatureAlgorithmOID.ECDSA_WITH_SHA256
             ]:
                 return False
 
             try:
                 public_key.verify(
-                    cert.signature,
-                    cert.tbs_certificate_bytes,
-                    ec.ECDSA(cert.signature_hash_algorithm),
+                    signed.signature,
+                    data,
+                    ec.ECDSA(signed.signature_hash_algorithm),
                 )
-            except InvalidSignature:
+            except (InvalidSignature, UnsupportedAlgorithm):
                 return False
         return True
 
-    def _build_chain_from(self, cert, ctx, depth):
+    def _build_chain_from(self, cert, ctx, depth, state, first_only=False):
         if depth > _MAX_CHAIN_DEPTH:
             return
-        if cert in self._roots:
+        if cert in state.store:
             yield [cert]
-        for issuer in self._find_potential_issuers(cert, ctx):
-            if self._is_valid_issuer(cert, issuer, depth, ctx):
-                chains = self._build_chain_from(issuer, ctx, depth=depth+1)
+        local_issuers = self._find_local_issuers(cert, ctx, state.store)
+        futures = []
+        if self._signature_executor is not None:
+            futures = self._start_signature_checks(
+                cert, local_issuers, ctx, depth, state
+            )
+        try:
+            for issuer in self._find_potential_issuers(
+                cert, local_issuers, state
+            ):
+                if not self._is_valid_issuer(cert, issuer, depth, ctx, state):
+                    continue
+                record = state.store.intermediates.get(issuer)
+                if record is not None and self._is_valid_verified_path(
+                    record, depth + 1, ctx
+                ):
+                    yield [cert] + list(record.path)
+                    if first_only:
+                        continue
+                chains = self._build_chain_from(
+                    issuer, ctx, depth + 1, state, first_only
+                )
                 for chain in chains:
                     yield [cert] + chain
+        finally:
+            # Once a chain has been accepted, the other candidates' signatures
+            # are no longer needed.
+            for future in futures:
+                future.cancel()
+
+    def _build_cheapest_chains_from(self, leaf, ctx, state):
+        """
+        Like `_build_chain_from`, but yields chains in order of increasing
+        cost. Partial paths are expanded cheapest first, and candidate
+        issuers are only checked (and AIA only followed) when their path is
+        the cheapest one left.
+        """
+        path_cost = self._path_cost
+        counter = itertools.count()
+        # Entries are (cost, kind, tie breaker, path, local issuers); at
+        # equal cost, finished chains come out first.
+        heap = [(0, _EXPAND, next(counter), [leaf], None)]
+        futures = []
+        try:
+            while heap:
+                (cost, kind, _, path, local_issuers) = heapq.heappop(heap)
+                if kind == _COMPLETE:
+                    yield path
+                    continue
+
+                cert = path[-1]
+                depth = len(path) - 1
+                if kind == _FOLLOW_AIA:
+                    issuers = self._find_aia_issuers(
+                        cert, local_issuers, state
+                    )
+                    for issuer in issuers:
+                        if issuer not in path:
+                            heapq.heappush(heap, (
+                                cost + path_cost.edge_cost(cert, issuer, True),
+                                _EXPAND, next(counter), path + [issuer], None
+                            ))
+                    continue
+
+                if depth > 0:
+                    if not self._is_valid_issuer(
+                        path[-2], cert, depth - 1, ctx, state
+                    ):
+                        continue
+                    # A registered intermediate's verified path is one
+                    # finished candidate, but cheaper ones may go through
+                    # other issuers, so the intermediate is expanded too.
+                    record = state.store.intermediates.get(cert)
+                    if record is not None and self._is_valid_verified_path(
+                        record, depth, ctx
+                    ):
+                        rest = record.path
+                        heapq.heappush(heap, (
+                            cost + sum(
+                                path_cost.edge_cost(c, i, False)
+                                for c, i in zip(rest, rest[1:])
+                            ) + path_cost.anchor_cost(rest[-1]),
+                            _COMPLETE, next(counter), path + list(rest[1:]),
+                            None
+                        ))
+                if depth > _MAX_CHAIN_DEPTH:
+                    continue
+                if cert in state.store:
+                    heapq.heappush(heap, (
+                        cost + path_cost.anchor_cost(cert), _COMPLETE,
+                        next(counter), path, None
+                    ))
+
+                local_issuers = self._find_local_issuers(
+                    cert, ctx, state.store
+                )
+                if self._signature_executor is not None:
+                    futures += self._start_signature_checks(
+                        cert, local_issuers, ctx, depth, state
+                    )
+                for issuer in local_issuers:
+                    if issuer not in path:
+                        heapq.heappush(heap, (
+                            cost + path_cost.edge_cost(cert, issuer, False),
+                            _EXPAND, next(counter), path + [issuer], None
+                        ))
+                if _get_extension_value(
+                    cert, x509.AuthorityInformationAccess
+                ) is not None:
+                    heapq.heappush(heap, (
+                        cost + path_cost.aia_cost(cert), _FOLLOW_AIA,
+                        next(counter), path, local_issuers
+                    ))
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _start_signature_checks(self, cert, local_issuers, ctx, depth, state):
+        """
+        Speculatively check the signatures of all of the `local_issuers` of
+        `cert` at once. `_is_signed_by` then waits for the result
+        when it gets to a candidate, so candidates are still accepted in the
+        usual order of preference.
+        """
+        candidates = [
+            issuer
+            for issuer in local_issuers
+            if self._is_valid_for_context(issuer, ctx, state) and
+            self._may_issue(issuer, depth, state) and
+            self._edge_cache.get((cert, issuer)) is None
+        ]
+        if len(candidates) < 2:
+            return []
+        futures = []
+        for issuer in candidates:
+            if (cert, issuer) in state.pending_signatures:
+                continue
+            future = self._signature_executor.submit(
+                self._is_signed_by, cert, issuer
+            )
+            state.pending_signatures[(cert, issuer)] = future
+            futures.append(future)
+        state.signature_checks += len(futures)
+        return futures
+
+    def _is_valid_verified_path(self, record, depth, ctx):
+        if not self._fits_at_depth(record, depth):
+            return False
+        if ctx.timestamp is not _ANY_TIME and not (
+            record.not_valid_before <= ctx.timestamp <=
+            record.not_valid_after
+        ):
+            return False
+        return (
+            all(
+                self._is_valid_usage(eku, ctx)
+                for eku in record.extended_key_usages
+            ) and
+            all(
+                self._check_name_constraints(c, ctx.name)
+                for c in record.name_constrained
+            ) and
+            not any(
+                self._is_revoked(c, issuer)
+                for (c, issuer) in zip(record.path, record.path[1:])
+            )
+        )
+
+    def _fits_at_depth(self, record, depth):
+        if depth + len(record.path) - 1 > _MAX_CHAIN_DEPTH:
+            return False
+        for i, path_length in enumerate(record.path_lengths):
+            if path_length is not None and path_length < depth + i - 1:
+                return False
+        return True
+
+    def _build_verified_path_from(self, cert, depth, store):
+        """
+        Like `_build_chain_from`, but only performs the checks which don't
+        depend on a validation context, and doesn't go to the network.
+        """
+        if depth > _MAX_CHAIN_DEPTH:
+            return
+        if cert in store:
+            yield [cert]
+            return
+        record = store.intermediates.get(cert)
+        if record is not None and self._fits_at_depth(record, depth):
+            yield list(record.path)
+            return
+        issuers = (
+            store.roots_by_name.get(cert.issuer, []) +
+            store.intermediates_by_name.get(cert.issuer, [])
+        )
+        for issuer in issuers:
+            if self._can_issue(cert, issuer, depth):
+                paths = self._build_verified_path_from(
+                    issuer, depth + 1, store
+                )
+                for path in paths:
+                    yield [cert] + path
+
+
+class ValidationSession(object):
+    """
+    Validates a leaf whose intermediates arrive one at a time, e.g. across
+    several TLS records. Each `add` parses the new certificate and tries to
+    complete a chain from the certificates seen so far, without going to
+    the network, so that most of the signature checks are done by the time
+    the last certificate arrives. `finish` then falls back to AIA if no
+    chain was found.
+    """
+
+    def __init__(self, validator, leaf, ctx):
+        self._validator = validator
+        self._ctx = ctx
+        self.result = None
+        try:
+            self._leaf = _as_certificate(leaf)
+        except ValueError:
+            self._leaf = None
+        self._failed = self._leaf is None or not (
+            validator._is_valid_cert(self._leaf, ctx) and
+            validator._is_name_correct(self._leaf, ctx.name)
+        )
+        self._try_complete()
+
+    @property
+    def failed(self):
+        """
+        Whether the leaf itself was rejected, so that no intermediate can
+        help.
+        """
+        return self._failed
+
+    def add(self, cert):
+        """
+        Add an intermediate (parsed or DER). Returns the `ValidationResult`
+        once a chain has been found, and None until then. Certificates
+        which can't be parsed are ignored.
+        """
+        if self.result is None and not self._failed:
+            try:
+                self._ctx._add_extra_cert(_as_certificate(cert))
+            except ValueError:
+                pass
+            else:
+                self._try_complete()
+        return self.result
+
+    def finish(self):
+        """
+        Returns the `ValidationResult` once every certificate has been
+        added, following AIA if that's still needed, or raises
+        `ValidationError`.
+        """
+        if self._failed:
+            raise ValidationError
+        if self.result is None:
+            self.result = self._validator.validate(self._leaf, self._ctx)
+        return self.result
+
+    def _try_complete(self):
+        if self._failed:
+            return
+        validator = self._validator
+        state = _ValidationState(validator._trust_store)
+        state.follow_aia = False
+        chains = validator._find_acceptable_chains(
+            self._leaf, self._ctx, state, first_only=True
+        )
+        try:
+            for chain in chains:
+                self.result = validator._make_result(chain, state)
+                return
+        finally:
+            chains.close()
+
+
+class _ThrottledFetcher(object):
+    """
+    Passes GETs through to `fetcher`, spaced at least `min_interval` seconds
+    apart, until `stopped` is set.
+    """
+
+    def __init__(self, fetcher, min_interval, stopped):
+        self._fetcher = fetcher
+        self._min_interval = min_interval
+        self._stopped = stopped
+        self._last_fetch = None
+
+    def get(self, url):
+        if self._last_fetch is not None:
+            delay = self._last_fetch + self._min_interval - _monotonic()
+            if delay > 0:
+                self._stopped.wait(delay)
+        if self._stopped.is_set():
+            return None
+        self._last_fetch = _monotonic()
+        return self._fetcher.get(url)
+
+
+class AIAPrefetcher(object):
+    """
+    Follows the AIA caIssuers URLs of certificates ahead of demand (e.g. ones
+    taken from access logs), and registers each fetched intermediate that
+    chains to one of the validator's roots with `register_intermediates`.
+
+    At most `max_depth` levels of AIA are followed from each certificate,
+    and fetches are spaced at least `min_interval` seconds apart. `crawl`
+    works synchronously; alternatively `start` a background thread and
+    `submit` certificates to it.
+    """
+
+    def __init__(self, validator, max_depth=3, min_interval=0.1):
+        self._validator = validator
+        self._max_depth = max_depth
+        self._queue = []
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._fetcher = _ThrottledFetcher(
+            validator._fetcher, min_interval, self._stopped
+        )
+        self._thread = None
+        self._busy = False
+
+    def crawl(self, certs):
+        """
+        Returns the newly registered intermediates.
+        """
+        validator = self._validator
+        registered = []
+        unchained = []
+        seen = set()
+        frontier = list(certs)
+        for _ in range(self._max_depth):
+            fetched = []
+            for cert in frontier:
+                if self._stopped.is_set():
+                    break
+                if cert in seen or self._is_chained(cert):
+                    continue
+                seen.add(cert)
+                for issuer in self._validator._follow_aia(
+                    cert, fetcher=self._fetcher
+                ):
+                    if issuer not in seen:
+                        fetched.append(issuer)
+            if not fetched:
+                break
+            # Issuers which don't chain yet might once their own issuers
+            # have been found, so they're retried at every level.
+            unchained += fetched
+            newly_registered = validator.register_intermediates(unchained)
+            registered += newly_registered
+            unchained = [c for c in unchained if c not in newly_registered]
+            frontier = [c for c in fetched if c not in newly_registered]
+        return registered
+
+    def _is_chained(self, cert):
+        store = self._validator._trust_store
+        if cert in store or cert in store.intermediates:
+            return True
+        paths = self._validator._build_verified_path_from(cert, 0, store)
+        return next(paths, None) is not None
+
+    def submit(self, certs):
+        with self._condition:
+            self._queue.extend(certs)
+            self._condition.notify_all()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread once its current fetch has finished.
+        Certificates which have been submitted but not crawled are dropped.
+        `crawl` and `start` can still be used afterwards.
+        """
+        with self._condition:
+            self._stopped.set()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stopped.clear()
+
+    def join(self):
+        """
+        Waits until every submitted certificate has been crawled.
+        """
+        with self._condition:
+            while self._queue or self._busy:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped.is_set():
+                    self._condition.wait()
+                if self._stopped.is_set():
+                    del self._queue[:]
+                    self._condition.notify_all()
+                    return
+                (certs, self._queue) = (self._queue, [])
+                self._busy = True
+            try:
+                self.crawl(certs)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+def _der(cert):
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+_CAPTURE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+# The types of name a capture can store, by the tag stored with the name.
+_CAPTURE_NAME_TYPES = {
+    "dns": x509.DNSName,
+    "ip": x509.IPAddress,
+    "email": x509.RFC822Name,
+    "uri": x509.UniformResourceIdentifier,
+}
+
+
+def _encode_captured_name(name):
+    """
+    Returns the (tag, text) pair a capture stores for `name`, or None if it
+    has a type captures can't store.
+    """
+    for (tag, name_type) in _CAPTURE_NAME_TYPES.items():
+        if type(name) is name_type:
+            return (tag, "{}".format(name.value))
+    return None
+
+
+def _crl_digests(crl_sources):
+    return sorted(set(source[0] for source in crl_sources.values()))
+
+
+def _describe_config(validator):
+    """
+    The parts of `validator`'s configuration which a capture records, as
+    stored in its "config" records. Certificates are referred to by digest.
+    """
+    path_cost = validator._path_cost
+    revocation_filter = validator._revocation_filter
+    return {
+        "ocsp_fetch": bool(validator._ocsp_fetch),
+        "path_cost": None if path_cost is None else {
+            "class": type(path_cost).__name__,
+            "per_certificate": path_cost.per_certificate,
+            "aia_fetch": path_cost.aia_fetch,
+            "weak_key": path_cost.weak_key,
+            "anchors": dict(
+                (hashlib.sha256(_der(cert)).hexdigest(), cost)
+                for (cert, cost) in path_cost.anchors.items()
+            ),
+        },
+        "crls": _crl_digests(validator._crl_sources),
+        "revocation_filter": None if revocation_filter is None else (
+            hashlib.sha256(revocation_filter.to_bytes()).hexdigest()
+        ),
+    }
+
+
+def _decode_captured_name(tag, text):
+    if tag == "ip":
+        if "/" in text:
+            text = ipaddress.ip_network(text)
+        else:
+            text = ipaddress.ip_address(text)
+    return _CAPTURE_NAME_TYPES[tag](text)
+
+
+class _RecordingFetcher(object):
+    """
+    Passes fetches through to `fetcher`, and lets `recorder` see them while
+    it's recording a validation on the current thread.
+    """
+
+    def __init__(self, fetcher, recorder):
+        self._fetcher = fetcher
+        self._recorder = recorder
+
+    def get(self, url):
+        body = self._fetcher.get(url)
+        self._recorder._record_fetch(url, None, body)
+        return body
+
+    def post(self, url, data, content_type):
+        body = self._fetcher.post(url, data, content_type)
+        self._recorder._record_fetch(url, data, body)
+        return body
+
+
+class CaptureRecorder(object):
+    """
+    Records a random `sample_rate` share of the calls to `validate` of the
+    validators it's passed to, into a gzipped capture file at `path`: the
+    leaf, extra certificates, name, extended key usage, stapled OCSP
+    responses and timestamp, every AIA and OCSP response fetched, the
+    result and how long it took. Certificates are stored once per file and
+    referred to by digest. The roots and registered intermediates are
+    recorded as they change, and so is the configuration replays have to
+    match: `ocsp_fetch`, the `path_cost` and digests of the loaded CRLs and
+    revocation filter. Read captures back with `load_capture`.
+    """
+
+    def __init__(self, path, sample_rate=0.01, seed=None):
+        self.sample_rate = sample_rate
+        self._random = random.Random(seed)
+        self._file = gzip.open(path, "ab")
+        self._lock = threading.Lock()
+        self._written_certs = set()
+        self._local = threading.local()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _should_sample(self):
+        # Recording everything or nothing doesn't need the shared generator.
+        if self.sample_rate <= 0:
+            return False
+        if self.sample_rate >= 1:
+            return True
+        with self._lock:
+            return self._random.random() < self.sample_rate
+
+    def _cert_ref(self, cert, lines):
+        data = _der(cert) if isinstance(cert, x509.Certificate) else bytes(
+            cert
+        )
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._written_certs:
+            self._written_certs.add(digest)
+            lines.append({
+                "type": "certificate", "digest": digest,
+                "der": base64.b64encode(data).decode("ascii"),
+            })
+        return digest
+
+    def _write(self, build):
+        with self._lock:
+            lines = []
+            lines.append(build(lines))
+            self._file.write(b"".join(
+                json.dumps(line).encode("utf-8") + b"\n" for line in lines
+            ))
+            self._file.flush()
+
+    def _record_roots(self, roots):
+        self._write(lambda lines: {
+            "type": "roots",
+            "certs": [self._cert_ref(c, lines) for c in roots],
+        })
+
+    def _record_config(self, validator):
+        config = _describe_config(validator)
+        path_cost = validator._path_cost
+
+        def build(lines):
+            # The anchors' certificates have to be in the file too.
+            if path_cost is not None:
+                for cert in path_cost.anchors:
+                    self._cert_ref(cert, lines)
+            config["type"] = "config"
+            return config
+
+        self._write(build)
+
+    def _record_intermediates(self, certs):
+        self._write(lambda lines: {
+            "type": "intermediates",
+            "certs": [self._cert_ref(c, lines) for c in certs],
+        })
+
+    def _record_fetch(self, url, data, body):
+        fetches = getattr(self._local, "fetches", None)
+        if fetches is not None:
+            fetches.append({
+                "url": url,
+                "data": None if data is None else base64.b64encode(
+                    data
+                ).decode("ascii"),
+                "body": None if body is None else base64.b64encode(
+                    body
+                ).decode("ascii"),
+            })
+
+    def _record_validation(self, validate, cert, ctx):
+        name = _encode_captured_name(ctx.name)
+        if name is None:
+            return validate(cert, ctx)
+
+        self._local.fetches = fetches = []
+        start = _monotonic()
+        try:
+            result = validate(cert, ctx)
+        except ValidationError:
+            result = None
+        finally:
+            elapsed = _monotonic() - start
+            self._local.fetches = None
+
+        self._write(lambda lines: {
+            "type": "validation",
+            "timestamp": ctx.timestamp.strftime(_CAPTURE_TIME_FORMAT),
+            "leaf": self._cert_ref(cert, lines),
+            "extra_certs": [self._cert_ref(c, lines) for c in ctx.extra_certs],
+            "name_type": name[0],
+            "name": name[1],
+            "extended_key_usage": ctx.extended_key_usage.dotted_string,
+            "ocsp_responses": [
+                base64.b64encode(
+                    response.public_bytes(serialization.Encoding.DER)
+                ).decode("ascii")
+                for (_, response) in ctx._ocsp_responses.values()
+            ],
+            "fetches": fetches,
+            "result": (
+                None if result is None else
+                [self._cert_ref(c, lines) for c in result]
+            ),
+            "elapsed": elapsed,
+        })
+        if result is None:
+            raise ValidationError
+        return result
+
+
+class CapturedValidation(object):
+    """
+    One validation read back from a capture. `fetcher` is a
+    `StaticFetcher` with the responses seen at the time, `result` the
+    chain that was returned (None if it failed) and `elapsed` how long it
+    took, in seconds.
+    """
+
+    def __init__(self, record, certs):
+        def decode(data):
+            return None if data is None else base64.b64decode(data)
+
+        self.leaf = certs[record["leaf"]]
+        self.ctx = ValidationContext(
+            # Captures from before names were tagged only had DNS names.
+            name=_decode_captured_name(
+                record.get("name_type", "dns"), record["name"]
+            ),
+            extended_key_usage=x509.ObjectIdentifier(
+                record["extended_key_usage"]
+            ),
+            extra_certs=[certs[d] for d in record["extra_certs"]],
+            ocsp_responses=[decode(r) for r in record["ocsp_responses"]],
+        )
+        self.ctx.timestamp = datetime.datetime.strptime(
+            record["timestamp"], _CAPTURE_TIME_FORMAT
+        )
+        responses = {}
+        for fetch in record["fetches"]:
+            if fetch["data"] is None:
+                key = fetch["url"]
+            else:
+                key = (fetch["url"], decode(fetch["data"]))
+            responses[key] = decode(fetch["body"])
+        self.fetcher = StaticFetcher(responses)
+        self.result = (
+            None if record["result"] is None else
+            [certs[d] for d in record["result"]]
+        )
+        self.elapsed = record["elapsed"]
+
+
+class CapturedConfig(object):
+    """
+    The configuration of the validator a capture was recorded from, as of
+    when it started recording or when its revocation data changed.
+    `path_cost` is rebuilt as a plain `PathCost`; `path_cost_class` names
+    the class it was recorded from. `crl_digests` and
+    `revocation_filter_digest` are SHA-256 hex digests of the loaded CRL
+    files and of the `FilterCascade`'s encoding, which can't be rebuilt from
+    the capture.
+    """
+
+    def __init__(self, record, certs):
+        self._record = dict(record)
+        del self._record["type"]
+        self.ocsp_fetch = record["ocsp_fetch"]
+        path_cost = record["path_cost"]
+        if path_cost is None:
+            self.path_cost = self.path_cost_class = None
+        else:
+            self.path_cost = PathCost(
+                per_certificate=path_cost["per_certificate"],
+                aia_fetch=path_cost["aia_fetch"],
+                weak_key=path_cost["weak_key"],
+                anchors=dict(
+                    (certs[digest], cost)
+                    for (digest, cost) in path_cost["anchors"].items()
+                ),
+            )
+            self.path_cost_class = path_cost["class"]
+        self.crl_digests = record["crls"]
+        self.revocation_filter_digest = record["revocation_filter"]
+
+    def differences(self, validator):
+        """
+        The names of the settings ("ocsp_fetch", "path_cost", "crls" and
+        "revocation_filter") on which `validator` differs from this.
+        """
+        current = _describe_config(validator)
+        return sorted(
+            name for (name, value) in self._record.items()
+            if current[name] != value
+        )
+
+
+def load_capture(path):
+    """
+    Yield the events of a capture written by `CaptureRecorder`, in order:
+    ("config", CapturedConfig), ("roots", [certs]), ("intermediates",
+    [certs]) and ("validation", CapturedValidation). Captures from before
+    configurations were recorded have no "config" events.
+    """
+    certs = {}
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            record = json.loads(line.decode("utf-8"))
+            kind = record["type"]
+            if kind == "certificate":
+                certs[record["digest"]] = _load_der_certificate(
+                    base64.b64decode(record["der"])
+                )
+            elif kind == "validation":
+                yield kind, CapturedValidation(record, certs)
+            elif kind == "config":
+                yield kind, CapturedConfig(record, certs)
+            else:
+                yield kind, [certs[d] for d in record["certs"]]
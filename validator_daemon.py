@@ -0,0 +1,509 @@
+"""
+A long-running local validation service, so that short-lived processes
+share one warm `X509Validator` (trust store, registered intermediates and
+caches) instead of each paying for imports and cold caches.
+
+    python validator_daemon.py --roots roots.pem --socket /run/x509.sock
+
+Clients connect to the Unix socket with `ValidatorClient`, which only needs
+the standard library. Each message is one line of JSON; a request is
+
+    {"id": 1, "name": "example.com", "extended_key_usage": "1.3.6.1...",
+     "certs": [...], "extra_certs": [...], "ocsp_responses": [...]}
+
+with base64 DER certificates and OCSP responses. Every leaf in `certs` is
+validated against the same context, and the response
+
+    {"id": 1, "results": [{"chain": [...], "valid_from": ...,
+                           "valid_until": ...}, null, ...]}
+
+has one entry per leaf, `null` for the ones which failed validation, and
+POSIX timestamps for the validity window. A request that can't be processed
+at all gets `{"id": 1, "error": "..."}` instead. Clients may send several
+requests before reading any responses; they're answered in order.
+`{"id": 2, "cache_stats": true}` is answered with the validator's
+`cache_stats()`.
+
+To spread a bulk scan over several daemons, `PartitionedClient` sends each
+leaf to the daemon owning its issuer (see `validator.IssuerPartitioner`), so
+that every daemon only caches its own part of the CA hierarchy.
+`LocalCluster` runs such daemons as local processes.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import argparse
+import base64
+import calendar
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import socketserver
+except ImportError:  # pragma: no cover
+    import SocketServer as socketserver
+
+
+def _encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _decode(data):
+    return base64.b64decode(data.encode("ascii"))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.process(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class ValidatorServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    """
+    Serves requests for `validator` on the Unix socket at `path`. Every
+    connection is handled on its own thread, all against the same
+    validator.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, validator, path):
+        self.validator = validator
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+    def process(self, line):
+        request_id = None
+        try:
+            request = json.loads(line.decode("utf-8"))
+            request_id = request.get("id")
+            if request.get("cache_stats"):
+                return {
+                    "id": request_id,
+                    "cache_stats": self.validator.cache_stats(),
+                }
+            ctx = self._build_validation_context(request)
+            leaves = [self._load_certificate(c) for c in request["certs"]]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {"id": request_id, "error": "{}".format(e)}
+        return {
+            "id": request_id,
+            "results": [
+                self._encode_result(result)
+                for result in self.validator.validate_batch(leaves, ctx)
+            ],
+        }
+
+    def _load_certificate(self, data):
+        from validator import _load_der_certificate
+
+        return _load_der_certificate(_decode(data))
+
+    def _build_validation_context(self, request):
+        from cryptography import x509
+        from validator import ValidationContext
+
+        return ValidationContext(
+            name=x509.DNSName(request["name"]),
+            extended_key_usage=x509.ObjectIdentifier(
+                request["extended_key_usage"]
+            ),
+            extra_certs=[_decode(c) for c in request.get("extra_certs", [])],
+            ocsp_responses=[
+                _decode(r) for r in request.get("ocsp_responses", [])
+            ],
+        )
+
+    def _encode_result(self, result):
+        from cryptography.hazmat.primitives import serialization
+
+        if result is None:
+            return None
+        return {
+            "chain": [
+                _encode(c.public_bytes(serialization.Encoding.DER))
+                for c in result
+            ],
+            "valid_from": calendar.timegm(result.valid_from.utctimetuple()),
+            "valid_until": calendar.timegm(result.valid_until.utctimetuple()),
+        }
+
+
+class DaemonResult(list):
+    """
+    A chain of DER encoded certificates from the leaf to the trusted root,
+    as built by the daemon, along with the naive UTC `valid_from` and
+    `valid_until` datetimes of `ValidationResult`.
+    """
+
+    def __init__(self, chain, valid_from, valid_until):
+        super(DaemonResult, self).__init__(chain)
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+
+
+class DaemonError(Exception):
+    pass
+
+
+class ValidatorClient(object):
+    """
+    A connection to a `ValidatorServer`. Not safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._rfile = self._socket.makefile("rb")
+        self._ids = itertools.count()
+
+    def close(self):
+        self._rfile.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def validate(self, certs, name, extended_key_usage, extra_certs=[],
+                 ocsp_responses=[]):
+        """
+        Validates each of the DER encoded leaf `certs` for the DNS `name` and
+        dotted `extended_key_usage` OID. Returns a `DaemonResult` for each
+        one, or None if it didn't validate.
+        """
+        return self.validate_many([{
+            "certs": certs,
+            "name": name,
+            "extended_key_usage": extended_key_usage,
+            "extra_certs": extra_certs,
+            "ocsp_responses": ocsp_responses,
+        }])[0]
+
+    def validate_many(self, requests):
+        """
+        Pipelines several requests, each a dict of `validate`'s arguments,
+        and returns their results in the same order.
+        """
+        return self._receive(self._send(requests))
+
+    def cache_stats(self):
+        """
+        Returns the daemon's `X509Validator.cache_stats()`.
+        """
+        request_id = next(self._ids)
+        self._socket.sendall(json.dumps({
+            "id": request_id, "cache_stats": True,
+        }).encode("utf-8") + b"\n")
+        response = self._read_responses([request_id])[request_id]
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["cache_stats"]
+
+    def _send(self, requests):
+        ids = []
+        lines = []
+        for request in requests:
+            request_id = next(self._ids)
+            ids.append(request_id)
+            lines.append(json.dumps({
+                "id": request_id,
+                "certs": [_encode(c) for c in request["certs"]],
+                "name": request["name"],
+                "extended_key_usage": request["extended_key_usage"],
+                "extra_certs": [
+                    _encode(c) for c in request.get("extra_certs", [])
+                ],
+                "ocsp_responses": [
+                    _encode(r) for r in request.get("ocsp_responses", [])
+                ],
+            }).encode("utf-8") + b"\n")
+        # Send from another thread, so that responses are read while the
+        # requests are still going out. Otherwise, once the responses fill
+        # the socket buffers, the daemon blocks writing them while we block
+        # sending.
+        writer = threading.Thread(
+            target=self._write, args=(b"".join(lines),)
+        )
+        writer.daemon = True
+        writer.start()
+        return ids, writer
+
+    def _write(self, data):
+        try:
+            self._socket.sendall(data)
+        except socket.error:
+            # Wake up the reader, which reports the connection as closed.
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _receive(self, sent):
+        (ids, writer) = sent
+        try:
+            responses = self._read_responses(ids)
+        finally:
+            writer.join()
+        return [self._load_results(responses[i]) for i in ids]
+
+    def _read_responses(self, ids):
+        responses = {}
+        while len(responses) < len(ids):
+            line = self._rfile.readline()
+            if not line:
+                raise DaemonError("connection closed")
+            response = json.loads(line.decode("utf-8"))
+            responses[response["id"]] = response
+        return responses
+
+    def _load_results(self, response):
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return [
+            None if result is None else DaemonResult(
+                [_decode(c) for c in result["chain"]],
+                datetime.datetime.utcfromtimestamp(result["valid_from"]),
+                datetime.datetime.utcfromtimestamp(result["valid_until"]),
+            )
+            for result in response["results"]
+        ]
+
+
+class PartitionedClient(object):
+    """
+    Validates through several daemons, one `ValidatorClient` per socket
+    path in `paths`. Each leaf goes to the daemon chosen by `partitioner`
+    (anything with a `worker_for(cert)` method returning one of the paths),
+    an `IssuerPartitioner` over the paths by default. Needs `cryptography`,
+    unlike `ValidatorClient`.
+    """
+
+    def __init__(self, paths, partitioner=None):
+        if partitioner is None:
+            from validator import IssuerPartitioner
+
+            partitioner = IssuerPartitioner(paths)
+        self.partitioner = partitioner
+        self._clients = OrderedDict()
+        try:
+            for path in paths:
+                self._clients[path] = ValidatorClient(path)
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def validate(self, certs, name, extended_key_usage, extra_certs=[],
+                 ocsp_responses=[]):
+        """
+        Like `ValidatorClient.validate`.
+        """
+        return self.validate_many([{
+            "certs": certs,
+            "name": name,
+            "extended_key_usage": extended_key_usage,
+            "extra_certs": extra_certs,
+            "ocsp_responses": ocsp_responses,
+        }])[0]
+
+    def validate_many(self, requests):
+        """
+        Like `ValidatorClient.validate_many`. The leaves of each request are
+        split between the daemons, which all work concurrently.
+        """
+        # Maps each path to its share of the requests, and to the request
+        # and position each of its leaves came from.
+        shares = OrderedDict((path, ([], [])) for path in self._clients)
+        for (i, request) in enumerate(requests):
+            split = OrderedDict()
+            for (j, cert) in enumerate(request["certs"]):
+                try:
+                    path = self.partitioner.worker_for(cert)
+                except ValueError as e:
+                    raise DaemonError("{}".format(e))
+                split.setdefault(path, []).append(j)
+            for (path, positions) in split.items():
+                share = dict(request)
+                share["certs"] = [request["certs"][j] for j in positions]
+                shares[path][0].append(share)
+                shares[path][1].append((i, positions))
+
+        # Every daemon is sent its share before any results are read. The
+        # clients send from writer threads, so a daemon whose responses
+        # aren't being read yet only stalls its own share.
+        sent = [
+            (self._clients[path], self._clients[path]._send(share), origins)
+            for (path, (share, origins)) in shares.items() if share
+        ]
+        results = [[None] * len(request["certs"]) for request in requests]
+        for (client, client_sent, origins) in sent:
+            for (leaf_results, (i, positions)) in zip(
+                client._receive(client_sent), origins
+            ):
+                for (j, result) in zip(positions, leaf_results):
+                    results[i][j] = result
+        return results
+
+    def cache_stats(self):
+        """
+        Returns a dict mapping each path to its daemon's cache stats.
+        """
+        return OrderedDict(
+            (path, client.cache_stats())
+            for (path, client) in self._clients.items()
+        )
+
+
+def _serve_worker(path, roots, intermediates, validator_kwargs, ready):
+    from validator import X509Validator, _load_der_certificate
+
+    validator = X509Validator(
+        [_load_der_certificate(r) for r in roots], **validator_kwargs
+    )
+    if intermediates:
+        validator.register_intermediates(
+            [_load_der_certificate(i) for i in intermediates]
+        )
+    server = ValidatorServer(validator, path)
+    ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class LocalCluster(object):
+    """
+    Runs `processes` daemons as local processes, each with its own
+    `X509Validator(roots, **validator_kwargs)`, as a stand-in for daemons
+    on several machines. `roots` and `intermediates` (which are registered
+    with every daemon) are DER encoded certificates. Use `client()` to
+    validate through them.
+    """
+
+    def __init__(self, roots, processes=4, intermediates=(),
+                 validator_kwargs={}, timeout=30):
+        self._directory = tempfile.mkdtemp()
+        self.paths = [
+            os.path.join(self._directory, "worker-{}.sock".format(i))
+            for i in range(processes)
+        ]
+        self._processes = []
+        try:
+            for path in self.paths:
+                ready = multiprocessing.Event()
+                process = multiprocessing.Process(
+                    target=_serve_worker,
+                    args=(path, list(roots), list(intermediates),
+                          dict(validator_kwargs), ready),
+                )
+                process.daemon = True
+                process.start()
+                self._processes.append(process)
+                if not ready.wait(timeout):
+                    raise DaemonError("worker didn't start")
+        except Exception:
+            self.close()
+            raise
+
+    def client(self, partitioner=None):
+        """
+        Returns a `PartitionedClient` for the daemons.
+        """
+        return PartitionedClient(self.paths, partitioner)
+
+    def close(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_PEM_CERTIFICATE = b"-----BEGIN CERTIFICATE-----"
+
+
+def _load_pem_certificates(path):
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+
+    with open(path, "rb") as f:
+        data = f.read()
+    return [
+        x509.load_pem_x509_certificate(
+            _PEM_CERTIFICATE + block, default_backend()
+        )
+        for block in data.split(_PEM_CERTIFICATE)[1:]
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--roots", required=True, help="PEM file of roots")
+    parser.add_argument(
+        "--intermediates", help="PEM file of intermediates to register"
+    )
+    parser.add_argument("--crl", action="append", default=[])
+    args = parser.parse_args(argv)
+
+    from validator import X509Validator
+
+    validator = X509Validator(_load_pem_certificates(args.roots))
+    if args.intermediates:
+        validator.register_intermediates(
+            _load_pem_certificates(args.intermediates)
+        )
+    if args.crl:
+        validator.load_crls(args.crl)
+
+    server = ValidatorServer(validator, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()